@@ -1,6 +1,11 @@
 import streamlit as st
 from datasets import load_dataset
 from sumtool.xsum_dataset import XsumDataset
+from sumtool.storage.join import join_models
+from sumtool.storage.view_cache import cached_records, dataset_fingerprint
+
+# bump when prepare_data_for_view changes, to rebuild the cached view data
+VIEW_VERSION = 1
 
 
 def prepare_data_for_view(data):
@@ -32,14 +37,41 @@ def prepare_data_for_view(data):
 
 @st.experimental_memo
 def load_annotated_data_by_id():
-    dataset = XsumDataset(
-        load_dataset("xsum")["test"],
-        factuality_data=load_dataset("xsum_factuality")["train"],
-        faithfulness_data=load_dataset("xsum_factuality", "xsum_faithfulness")["train"],
+    xsum_data = load_dataset("xsum")["test"]
+    factuality_data = load_dataset("xsum_factuality")["train"]
+    faithfulness_data = load_dataset("xsum_factuality", "xsum_faithfulness")["train"]
+
+    def build_view_dataset():
+        dataset = XsumDataset(
+            xsum_data,
+            factuality_data=factuality_data,
+            faithfulness_data=faithfulness_data,
+        )
+        # only the annotated documents are built, instead of all xsum test articles
+        annotated = (dataset[int(idx)] for idx in dataset.annotated_indices())
+        return {
+            v["id"]: prepare_data_for_view(v)
+            for v in annotated
+            if len(v["faithfulness_data"]) > 0
+        }
+
+    # persisted across server restarts, rebuilt when a source dataset changes
+    return cached_records(
+        "xsum",
+        "annotated-view",
+        dataset_fingerprint(
+            xsum_data, factuality_data, faithfulness_data, version=VIEW_VERSION
+        ),
+        build_view_dataset,
     )
-    view_dataset = {
-        k: prepare_data_for_view(v)
-        for k, v in dataset.data_by_id.items()
-        if len(v["faithfulness_data"]) > 0
-    }
-    return view_dataset
+
+
+@st.experimental_memo
+def load_summary_metrics():
+    """
+    Stored metrics of every xsum model, indexed by model & document id
+
+    Returns:
+        pandas.DataFrame with one column per metric
+    """
+    return join_models("xsum", fields=["metrics.*"]).set_index(["model", "document_id"])
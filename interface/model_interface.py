@@ -3,13 +3,13 @@ from sumtool import storage
 from backend.viz_data_loader import load_annotated_data_by_id
 import pandas as pd
 
-cache_summaries = storage.get_summaries("xsum", "facebook-bart-large-xsum")
-cache_keys = cache_summaries.keys()
+MODEL = "facebook-bart-large-xsum"
+
+# only document ids are read at startup, summaries are read one at a time when selected
+cache_keys = storage.get_summary_ids("xsum", MODEL)
 annotated_data_by_id = load_annotated_data_by_id()
 filtered_annotated_data_by_id = {
-    k: annotated_data_by_id[k]
-    for k in cache_summaries.keys()
-    if k in annotated_data_by_id
+    k: annotated_data_by_id[k] for k in cache_keys if k in annotated_data_by_id
 }
 
 
@@ -37,7 +37,11 @@ def render_model_interface():
     st.write(g_summary)
 
     # Output summarization
-    predicted_summary = cache_summaries[selected_id]["summary"][0]
+    predicted_summary = storage.get_summary(
+        "xsum", MODEL, selected_id, fields=["summary"]
+    )["summary"]
+    if isinstance(predicted_summary, list):
+        predicted_summary = predicted_summary[0]
     st.subheader("Predicted Summary")
     st.write(predicted_summary)
 
@@ -3,7 +3,7 @@ import streamlit as st
 # from memory_profiler import profile
 from os.path import exists, dirname, realpath, join
 
-from sumtool.ngram import preprocess, LookupCase
+from sumtool.ngram import preprocess, LookupCase, NgramLookup, SnapshotMismatchError
 from backend.viz_ngram_loader import (
     load_xsum_dataset,
     load_ngram_lookup,
@@ -16,17 +16,42 @@ VOCABS_PATH = join(CURRENT_PATH, "../sumtool/ngram/cache/vocabs")  # vocab file
 NGRAM_PATH = join(
     CURRENT_PATH, "../sumtool/ngram/cache/ngram_dict_%d"
 )  # ngram file path
+SNAPSHOT_PATH = join(
+    CURRENT_PATH, "../sumtool/ngram/cache/ngram_snapshot"
+)  # vocab + ngram snapshot file path
 MIN_N = 1  # min n for ngram
 MAX_N = 4  # max n for ngram
 MAX_VOCAB_SIZE = 10000  # vocab size
 SAVE_FLAG = True  # whether to save vocab, ngram files
 NUM_PROC = 5  # # of processes to use for preprocessing
+MAX_RESULTS = 100  # max # of matched documents to display
 
 
-# @profile
-def render_ngram_interface():
-    # load dataset
-    x_sum_dataset = load_xsum_dataset()
+@st.experimental_singleton
+def load_or_build_ngram_lookup(_x_sum_dataset, corpus_fingerprint):
+    """
+    Ngram lookup of the dataset, opened once per server process: the snapshot is memory mapped
+    on the first run and shared by every rerun & session afterwards
+
+    Args:
+        _x_sum_dataset: huggingface dataset the lookup is built from, not hashed
+        corpus_fingerprint: fingerprint of the dataset, the cache key
+
+    Returns:
+        NgramLookup
+    """
+    # load snapshot, fall back to building (or loading) vocab & ngram files
+    # if the snapshot is missing, stale or incompatible
+    try:
+        return NgramLookup.load_snapshot(
+            SNAPSHOT_PATH,
+            MIN_N,
+            MAX_N,
+            max_vocab_size=MAX_VOCAB_SIZE,
+            corpus_fingerprint=corpus_fingerprint,
+        )
+    except (OSError, SnapshotMismatchError) as e:
+        print("Ngram snapshot not usable (%s), rebuilding" % e)
 
     # check if file exists
     build_flag = False
@@ -41,7 +66,7 @@ def render_ngram_interface():
     # build or load ngram
     if build_flag:
         ngram_lookup = build_ngram_lookup(
-            x_sum_dataset,
+            _x_sum_dataset,
             VOCABS_PATH,
             NGRAM_PATH,
             MAX_VOCAB_SIZE,
@@ -54,6 +79,17 @@ def render_ngram_interface():
             VOCABS_PATH, NGRAM_PATH, MAX_VOCAB_SIZE, MIN_N, MAX_N
         )
 
+    if SAVE_FLAG:
+        ngram_lookup.save_snapshot(SNAPSHOT_PATH, corpus_fingerprint=corpus_fingerprint)
+    return ngram_lookup
+
+
+# @profile
+def render_ngram_interface():
+    # load dataset
+    x_sum_dataset = load_xsum_dataset()
+    ngram_lookup = load_or_build_ngram_lookup(x_sum_dataset, x_sum_dataset._fingerprint)
+
     st.header("XSUM N-Gram Lookup")
 
     # input query
@@ -63,10 +99,9 @@ def render_ngram_interface():
     pp_query_wrd = tuple(preprocess(query).split())
     st.write("Preprocessed query words:", pp_query_wrd)
 
-    # ngram lookup
-    lookup_dict = ngram_lookup.lookup(query_wrd=pp_query_wrd)
-    case = lookup_dict["case"]
-    matched_doc_idx = lookup_dict["match"]
+    # ngram lookup, count only
+    count_dict = ngram_lookup.lookup_count(pp_query_wrd)
+    case = count_dict["case"]
 
     # write results
     st.write("**Search result:**")
@@ -75,15 +110,21 @@ def render_ngram_interface():
     elif case == LookupCase.unk_in_query.value:
         st.write("Unknown word in query")
     else:
-        results = [
-            {
-                "id": x_sum_dataset[int(doc_idx)]["id"],
-                "document": x_sum_dataset[int(doc_idx)]["document"],
-            }
-            for doc_idx in matched_doc_idx
-        ]
-        st.write("* %d documents matched" % len(results))
-        st.write(results)
+        st.write("* %d documents matched" % count_dict["count"])
+        if case == LookupCase.match_found.value:
+            if count_dict["count"] > MAX_RESULTS:
+                st.write(
+                    "* showing %d of %d documents" % (MAX_RESULTS, count_dict["count"])
+                )
+            matched_doc_idx = ngram_lookup.lookup(query_wrd=pp_query_wrd)["match"]
+            results = [
+                {
+                    "id": x_sum_dataset[int(doc_idx)]["id"],
+                    "document": x_sum_dataset[int(doc_idx)]["document"],
+                }
+                for doc_idx in matched_doc_idx[:MAX_RESULTS]
+            ]
+            st.write(results)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,5 @@
 import streamlit as st
-from backend.viz_data_loader import load_annotated_data_by_id
+from backend.viz_data_loader import load_annotated_data_by_id, load_summary_metrics
 from utils.faithfulness_annotations import (
     annotation_overlap,
     annotation_color,
@@ -17,6 +17,7 @@ import regex as re
 from matplotlib.pyplot import cm
 
 annotated_data_by_id = load_annotated_data_by_id()
+summary_metrics = load_summary_metrics()
 
 
 def render_summary_with_annotations(
@@ -105,10 +106,18 @@ def render_summary_interface():
             if g_model in df_factuality.index
             else "Missing"
         )
+        # stored maynez model ids are the lowercased system names
+        metrics_key = (f"maynez-{g_model.lower()}", selected_id)
+        entailment_score = (
+            round(summary_metrics.loc[metrics_key]["metrics.entails_prob"], 2)
+            if metrics_key in summary_metrics.index
+            else "Missing"
+        )
         col1.write(
             f"""
 **{g_model}** \\
 _factuality score:_ {factuality_score} \\
+_entailment prob:_ {entailment_score} \\
 _rogue1 score:_ **TODO** \\
 _rogue2 score:_ **TODO** \\
 _bert score:_ **TODO**
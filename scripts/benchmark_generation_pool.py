@@ -0,0 +1,55 @@
+import argparse
+import time
+import datasets
+from sumtool.generation_pool import GenerationPool
+
+
+def benchmark(documents, num_workers: int, threads_per_worker=None, max_tokens=4096):
+    """
+    Measures generation throughput of a pool, excluding model loading
+
+    Args:
+        documents: documents to summarize
+        num_workers: number of worker processes
+        threads_per_worker: torch threads per worker, defaults to the cpus divided between workers
+        max_tokens: maximum number of (padded) input tokens per generate call
+
+    Returns:
+        documents per second
+    """
+    with GenerationPool(
+        num_workers, threads_per_worker, chunk_size=4, max_tokens=max_tokens
+    ) as pool:
+        # warm up, every worker loads its model replica
+        list(pool.iter_summaries(documents[: 4 * num_workers]))
+        start = time.monotonic()
+        list(pool.iter_summaries(documents))
+        return len(documents) / (time.monotonic() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark summary generation throughput by number of worker processes"
+    )
+    parser.add_argument("--num_docs", type=int, default=64)
+    parser.add_argument(
+        "--workers",
+        type=str,
+        default="1,2,4,8",
+        help="comma-separated numbers of worker processes",
+    )
+    parser.add_argument("--threads_per_worker", type=int, default=None)
+    parser.add_argument("--max_tokens", type=int, default=4096)
+    args = parser.parse_args()
+
+    documents = datasets.load_dataset("xsum")["test"][: args.num_docs]["document"]
+    baseline = None
+    for num_workers in [int(x) for x in args.workers.split(",")]:
+        docs_per_sec = benchmark(
+            documents, num_workers, args.threads_per_worker, args.max_tokens
+        )
+        baseline = baseline or docs_per_sec
+        print(
+            f"{num_workers} workers: {docs_per_sec:.2f} docs/sec, "
+            f"{docs_per_sec / baseline:.2f}x"
+        )
@@ -0,0 +1,119 @@
+import argparse
+import time
+from difflib import SequenceMatcher
+import datasets
+import numpy as np
+import torch
+from generate_all_entailment_labels import (
+    ENTAILMENT_LABELS,
+    compute_entailment_metrics,
+    construct_entailment_data_for_model,
+    load_entailment_model_and_tokenizer,
+)
+from sumtool.generate_xsum_summary import (
+    generate_summaries,
+    load_summarization_model_and_tokenizer,
+)
+from sumtool.xsum_dataset import XsumDataset
+
+
+def timed(fn, *args, **kwargs):
+    start = time.monotonic()
+    result = fn(*args, **kwargs)
+    return result, time.monotonic() - start
+
+
+def compare_summarization(documents):
+    """
+    Compares fp32 & dynamic int8 summary generation on CPU
+
+    Args:
+        documents: sample of documents to summarize
+    """
+    results = {}
+    for quantized in [False, True]:
+        model, tokenizer = load_summarization_model_and_tokenizer(quantized=quantized)
+        model.to("cpu")
+        # warm up
+        generate_summaries(model, tokenizer, documents[:1])
+        results[quantized] = timed(generate_summaries, model, tokenizer, documents)
+
+    (fp32_summaries, fp32_seconds), (int8_summaries, int8_seconds) = (
+        results[False],
+        results[True],
+    )
+    similarity = [
+        SequenceMatcher(None, a.split(), b.split()).ratio()
+        for a, b in zip(fp32_summaries, int8_summaries)
+    ]
+    print("Summarization")
+    print(f"  fp32: {len(documents) / fp32_seconds:.2f} docs/sec")
+    print(f"  int8: {len(documents) / int8_seconds:.2f} docs/sec")
+    print(f"  speedup: {fp32_seconds / int8_seconds:.2f}x")
+    print(
+        f"  identical summaries: {np.mean([a == b for a, b in zip(fp32_summaries, int8_summaries)]):.1%}"
+    )
+    print(f"  mean word overlap with fp32: {np.mean(similarity):.3f}")
+
+
+def compare_entailment(pairs):
+    """
+    Compares fp32 & dynamic int8 entailment probabilities on CPU
+
+    Args:
+        pairs: sample of (document, summary) pairs
+    """
+    device = torch.device("cpu")
+    results = {}
+    for quantized in [False, True]:
+        tokenizer, model = load_entailment_model_and_tokenizer(device, quantized)
+        compute_entailment_metrics(tokenizer, model, device, pairs[:1])
+        results[quantized] = timed(
+            compute_entailment_metrics, tokenizer, model, device, pairs
+        )
+
+    (fp32_metrics, fp32_seconds), (int8_metrics, int8_seconds) = (
+        results[False],
+        results[True],
+    )
+    fp32_probs = np.array(
+        [[x[label] for label in ENTAILMENT_LABELS] for x in fp32_metrics]
+    )
+    int8_probs = np.array(
+        [[x[label] for label in ENTAILMENT_LABELS] for x in int8_metrics]
+    )
+    drift = np.abs(fp32_probs - int8_probs)
+    print("Entailment")
+    print(f"  fp32: {len(pairs) / fp32_seconds:.2f} pairs/sec")
+    print(f"  int8: {len(pairs) / int8_seconds:.2f} pairs/sec")
+    print(f"  speedup: {fp32_seconds / int8_seconds:.2f}x")
+    print(f"  mean abs drift: {drift.mean():.4f}, max abs drift: {drift.max():.4f}")
+    print(
+        f"  same label: {np.mean(fp32_probs.argmax(axis=1) == int8_probs.argmax(axis=1)):.1%}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare speed & outputs of dynamic int8 quantized models against fp32 on CPU"
+    )
+    parser.add_argument("--num_docs", type=int, default=32)
+    parser.add_argument(
+        "--models",
+        type=str,
+        default="summarization,entailment",
+        help="comma-separated models to compare: summarization, entailment",
+    )
+    args = parser.parse_args()
+    models = args.models.split(",")
+
+    xsum_data = XsumDataset(datasets.load_dataset("xsum")["test"])
+    if "summarization" in models:
+        compare_summarization(
+            [xsum_data[idx]["document"] for idx in range(args.num_docs)]
+        )
+    if "entailment" in models:
+        data = construct_entailment_data_for_model(xsum_data.data_by_id, "maynez-gold")
+        compare_entailment(
+            [(x["document"], x["summary"]) for x in data[: args.num_docs]]
+        )
@@ -1,22 +1,98 @@
+from sumtool.batching import (
+    TokenBudgetBatchSampler,
+    TokenizerCollate,
+    restore_order,
+    token_lengths,
+)
+from sumtool import model_registry
+from sumtool.quantization import QUANTIZATION
 from sumtool.storage import get_summaries, store_summary_metrics
+from sumtool.storage.metric_cache import cached_scores
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
 import torch
 from datasets import load_dataset
 from sumtool.xsum_dataset import XsumDataset
-from typing import List
+from typing import List, Tuple
+import argparse
 
+ENTAILMENT_MODEL_ID = "madlag/bert-large-uncased-mnli"
+ENTAILMENT_LABELS = ["entails_prob", "neutral_prob", "contradicts_prob"]
 
-def load_entailment_model_and_tokenizer(device):
-    tokenizer = AutoTokenizer.from_pretrained("madlag/bert-large-uncased-mnli")
-    model = AutoModelForSequenceClassification.from_pretrained(
-        "madlag/bert-large-uncased-mnli"
-    ).to(device)
+
+def load_entailment_model_and_tokenizer(device, quantized: bool = False):
+    tokenizer = model_registry.get_tokenizer(AutoTokenizer, ENTAILMENT_MODEL_ID)
+    if quantized:
+        # quantized models run on CPU, see sumtool/quantization.py
+        model = model_registry.get_quantized_model(
+            AutoModelForSequenceClassification, ENTAILMENT_MODEL_ID
+        )
+    else:
+        model = model_registry.get_model(
+            AutoModelForSequenceClassification, ENTAILMENT_MODEL_ID
+        ).to(device)
 
     return tokenizer, model
 
 
+def compute_entailment_metrics(
+    tokenizer,
+    model,
+    device,
+    pairs: List[Tuple[str, str]],
+    batch_size: int = 64,
+    max_tokens: int = 8192,
+) -> List[dict]:
+    """
+    Computes entailment probabilities of (document, summary) pairs,
+    batching pairs of similar tokenized length
+
+    Args:
+        tokenizer: entailment model tokenizer
+        model: entailment model
+        device: torch device of the model
+        pairs: list of (document, summary)
+        batch_size: maximum number of pairs per forward pass
+        max_tokens: maximum number of (padded) tokens per forward pass
+
+    Returns:
+        list of dict of entails_prob, neutral_prob & contradicts_prob, aligned with pairs
+    """
+    tokenizer_kwargs = {"truncation": "only_first"}
+    sampler = TokenBudgetBatchSampler(
+        token_lengths(
+            tokenizer,
+            [document for document, _ in pairs],
+            [summary for _, summary in pairs],
+            **tokenizer_kwargs,
+        ),
+        max_tokens=max_tokens,
+        max_batch_size=batch_size,
+    )
+    loader = DataLoader(
+        pairs,
+        batch_sampler=sampler,
+        collate_fn=TokenizerCollate(tokenizer, [0, 1], **tokenizer_kwargs),
+    )
+
+    batch_metrics = []
+    for batch_tokenized in tqdm(loader):
+        with torch.no_grad():
+            batch_entailment_probs = (
+                model(**batch_tokenized.to(device))["logits"]
+                .softmax(dim=1)
+                .cpu()
+                .numpy()
+                .tolist()
+            )
+
+        batch_metrics.append(
+            [dict(zip(ENTAILMENT_LABELS, probs)) for probs in batch_entailment_probs]
+        )
+    return restore_order(sampler, batch_metrics)
+
+
 def construct_entailment_data_for_model(
     xsum_examples_by_id: dict, model_id: str
 ) -> List[dict]:
@@ -47,9 +123,28 @@ def construct_entailment_data_for_model(
 
 
 if __name__ == "__main__":
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-    tokenizer, model = load_entailment_model_and_tokenizer(device)
+    parser = argparse.ArgumentParser(
+        description="Script to compute entailment probabilities of stored xsum summaries"
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="use the dynamic int8 quantized model on CPU, metrics are stored with a _dynamic_int8 suffix",
+    )
+    args = parser.parse_args()
+
+    if args.quantize:
+        device = torch.device("cpu")
+    else:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    tokenizer, model = load_entailment_model_and_tokenizer(device, args.quantize)
+    params = {"truncation": "only_first"}
+    metric_suffix = ""
+    if args.quantize:
+        params["quantization"] = QUANTIZATION
+        # quantized probabilities never overwrite the fp32 ones
+        metric_suffix = "_" + QUANTIZATION.replace("-", "_")
 
     xsum_test_by_id = XsumDataset(load_dataset("xsum")["test"]).data_by_id
 
@@ -64,33 +159,18 @@ if __name__ == "__main__":
     for model_id in model_ids:
         print(f"Started: {model_id} summaries entailment probs")
         data_to_load = construct_entailment_data_for_model(xsum_test_by_id, model_id)
-        data_loader = DataLoader(data_to_load, batch_size=8)
-
-        entailment_metrics = []
-
-        for batch_idx, batch in enumerate(tqdm(data_loader)):
-            batch_tokenized = tokenizer(
-                batch["document"],
-                batch["summary"],
-                padding=True,
-                return_tensors="pt",
-                truncation="only_first",
-            ).to(device)
-
-            with torch.no_grad():
-                batch_entailment_probs = (
-                    model(**batch_tokenized)["logits"]
-                    .softmax(dim=1)
-                    .cpu()
-                    .numpy()
-                    .tolist()
-                )
-
-            batch_entailment_metric = [
-                dict(zip(["entails_prob", "neutral_prob", "contradicts_prob"], probs))
-                for probs in batch_entailment_probs
-            ]
-            entailment_metrics.extend(list(zip(batch["id"], batch_entailment_metric)))
-
-        store_summary_metrics("xsum", model_id, dict(entailment_metrics))
+        # pairs scored before, i.e. for another model with the same summary, come from the metric cache
+        entailment_metrics = cached_scores(
+            [(x["document"], x["summary"]) for x in data_to_load],
+            "entailment",
+            lambda pairs: compute_entailment_metrics(tokenizer, model, device, pairs),
+            model_id=ENTAILMENT_MODEL_ID,
+            params=params,
+        )
+        entailment_metrics = {
+            x["id"]: {f"{key}{metric_suffix}": value for key, value in metrics.items()}
+            for x, metrics in zip(data_to_load, entailment_metrics)
+        }
+
+        store_summary_metrics("xsum", model_id, entailment_metrics)
         print(f"Finished: {model_id} summaries enailment probs")
@@ -18,7 +18,9 @@ if __name__ == "__main__":
         "Link": "https://arxiv.org/pdf/2005.00661",
     }
 
-    for bbc_id, data in dataset.data_by_id.items():
+    for idx in dataset.annotated_indices():
+        data = dataset[int(idx)]
+        bbc_id = data["id"]
         if len(data["faithfulness_data"]) > 0:
             for val in data["faithfulness_data"].values():
                 model_name = val["system"]
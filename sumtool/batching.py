@@ -0,0 +1,135 @@
+"""
+Length-bucketed batching for inference over XsumDataset documents.
+
+Documents are sorted by tokenized length and grouped into batches of at most max_tokens
+padded tokens, so a batch pads to the length of similar documents instead of the longest
+document of a random batch. Outputs are put back in the original order with restore_order.
+
+    lengths = token_lengths(tokenizer, documents, max_length=1024, truncation=True)
+    sampler = TokenBudgetBatchSampler(lengths, max_tokens=8192)
+    loader = DataLoader(documents, batch_sampler=sampler, collate_fn=TokenizerCollate(tokenizer))
+    outputs = restore_order(sampler, [model(**batch) for batch in loader])
+"""
+
+from typing import Any, Iterator, List, Optional, Sequence
+
+import numpy as np
+from torch.utils.data import Sampler
+
+
+def token_lengths(tokenizer, texts: List[str], text_pairs=None, **kwargs) -> np.ndarray:
+    """
+    Tokenized lengths of texts, as they are tokenized for the model
+
+    Args:
+        tokenizer: huggingface tokenizer
+        texts: texts to tokenize
+        text_pairs: optional second texts, i.e. summaries of (document, summary) pairs
+        kwargs: tokenizer arguments that change the length, i.e. max_length & truncation
+
+    Returns:
+        numpy array of the number of tokens per text
+    """
+    encoded = tokenizer(texts, text_pairs, **kwargs)
+    return np.array([len(ids) for ids in encoded["input_ids"]], dtype=np.int64)
+
+
+class TokenBudgetBatchSampler(Sampler):
+    """
+    Batch sampler grouping examples of similar length into batches of at most max_tokens,
+    counted as batch size * longest example of the batch (the padded size).
+    Batches are yielded longest first, so running out of memory happens on the first batch.
+    """
+
+    def __init__(
+        self,
+        lengths: Sequence[int],
+        max_tokens: int,
+        max_batch_size: Optional[int] = None,
+    ):
+        """
+        Args:
+            lengths: tokenized length of every example, see token_lengths
+            max_tokens: maximum number of padded tokens per batch,
+                examples longer than max_tokens get a batch of their own
+            max_batch_size: optional maximum number of examples per batch
+        """
+        self.lengths = np.asarray(lengths)
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.batches = self._batches()
+
+    def _batches(self) -> List[List[int]]:
+        # stable, so examples of equal length keep their dataset order
+        order = np.argsort(-self.lengths, kind="stable")
+        batches = []
+        batch = []
+        for idx in order.tolist():
+            # examples are sorted by decreasing length, the first one sets the padded length
+            padded_length = self.lengths[batch[0]] if batch else self.lengths[idx]
+            if batch and (
+                (len(batch) + 1) * padded_length > self.max_tokens
+                or len(batch) == self.max_batch_size
+            ):
+                batches.append(batch)
+                batch = []
+            batch.append(idx)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        return iter(self.batches)
+
+    def __len__(self) -> int:
+        return len(self.batches)
+
+    def padding_ratio(self) -> float:
+        """
+        Fraction of padding tokens over all batches
+        """
+        padded = sum(len(batch) * self.lengths[batch[0]] for batch in self.batches)
+        return 1 - self.lengths.sum() / padded if padded > 0 else 0.0
+
+
+class TokenizerCollate:
+    """
+    DataLoader collate_fn tokenizing a batch of examples with padding
+    """
+
+    def __init__(self, tokenizer, text_keys: Optional[List[Any]] = None, **kwargs):
+        """
+        Args:
+            tokenizer: huggingface tokenizer
+            text_keys: keys (or tuple indices) of the texts in an example, a second key is
+                tokenized as text pair, i.e. ["document", "summary"].
+                Defaults to examples that are texts
+            kwargs: tokenizer arguments, i.e. max_length & truncation
+        """
+        self.tokenizer = tokenizer
+        self.text_keys = text_keys
+        self.kwargs = kwargs
+
+    def __call__(self, examples: List[Any]):
+        if self.text_keys is None:
+            texts = [list(examples)]
+        else:
+            texts = [[example[key] for example in examples] for key in self.text_keys]
+        return self.tokenizer(*texts, padding=True, return_tensors="pt", **self.kwargs)
+
+
+def restore_order(batch_sampler, batch_outputs: List[Sequence[Any]]) -> List[Any]:
+    """
+    Put per-example outputs of batches back in the original example order
+
+    Args:
+        batch_sampler: the batch sampler the batches were drawn from, i.e. TokenBudgetBatchSampler
+        batch_outputs: one sequence of outputs per batch, in batch order
+
+    Returns:
+        list of outputs, aligned with the examples
+    """
+    outputs = {}
+    for indices, batch_output in zip(batch_sampler, batch_outputs):
+        outputs.update(zip(indices, batch_output))
+    return [outputs[idx] for idx in range(len(outputs))]
@@ -0,0 +1,213 @@
+"""
+Sweeps of decoding configurations over the same documents, i.e. to study how num_beams, length
+and sampling settings affect hallucination.
+
+Every batch of documents is encoded once and the encoder outputs are reused by the decoder of
+every configuration, so a sweep of N configurations costs one encoder pass plus N decoder passes.
+Each configuration is stored as its own model, named after the settings it overrides:
+
+    facebook/bart-large-xsum-max_length=60-num_beams=1
+    facebook/bart-large-xsum-default (the default settings, {})
+
+    python -m sumtool.decoding_sweep --num_docs 100 \\
+        --configs '[{"num_beams": 1}, {"num_beams": 8}, {"do_sample": true, "top_p": 0.9, "seed": 0}]'
+"""
+
+import argparse
+import json
+from typing import Dict, Iterable, Iterator, List
+
+import datasets
+import torch
+from transformers.modeling_outputs import BaseModelOutput
+
+from sumtool.batching import restore_order
+from sumtool.generate_xsum_summary import (
+    length_batched_inputs,
+    load_summarization_model_and_tokenizer,
+)
+from sumtool.storage import store_model_summaries
+from sumtool.xsum_dataset import XsumDataset
+
+# decoding settings of generate_summaries, overridden by the settings of a configuration
+DEFAULT_DECODING = {"num_beams": 4, "max_length": 150, "early_stopping": True}
+
+
+def decoding_model_id(model_id: str, decoding_config: Dict) -> str:
+    """
+    Id that the summaries of a decoding configuration are stored under
+
+    Args:
+        model_id: id of the summarization model, i.e. model.config.name_or_path
+        decoding_config: settings overriding DEFAULT_DECODING, i.e. {"num_beams": 1}
+
+    Returns:
+        model id with the settings as suffix, "<model id>-default" for the default settings,
+        so sweeps never overwrite the summaries stored under the model id itself
+    """
+    if len(decoding_config) == 0:
+        return f"{model_id}-default"
+    return "-".join(
+        [model_id]
+        + [f"{key}={value}" for key, value in sorted(decoding_config.items())]
+    )
+
+
+def _generate(model, inputs, encoder_outputs, decoding_config: Dict):
+    decoding_config = dict(decoding_config)
+    if "seed" in decoding_config:
+        # reproducible sampling
+        torch.manual_seed(decoding_config.pop("seed"))
+    return model.generate(
+        inputs.input_ids,
+        attention_mask=inputs.attention_mask,
+        # generate expands the encoder outputs for beams in place, so each call gets its own
+        # output object around the shared hidden states
+        encoder_outputs=BaseModelOutput(
+            last_hidden_state=encoder_outputs.last_hidden_state
+        ),
+        **{**DEFAULT_DECODING, **decoding_config},
+    )
+
+
+def iter_sweep_summaries(
+    model,
+    tokenizer,
+    docs_to_summarize: Iterable[str],
+    decoding_configs: List[Dict],
+    max_tokens: int = 4096,
+    window_size: int = 256,
+) -> Iterator[List[str]]:
+    """
+    Summarize documents under several decoding configurations, encoding every document once
+
+    Args:
+        model: encoder-decoder model to run inference on
+        tokenizer: tokenizer corresponding to model
+        docs_to_summarize: iterable of documents to summarize
+        decoding_configs: generate settings overriding DEFAULT_DECODING, per configuration,
+            a "seed" setting seeds sampling
+        max_tokens: maximum number of (padded) input tokens per batch
+        window_size: number of documents sorted by length together
+
+    Yields:
+        list of summaries per document, one per decoding configuration, in input order
+    """
+    for sampler, batches in length_batched_inputs(
+        tokenizer, docs_to_summarize, max_tokens, window_size
+    ):
+        batch_outputs = []
+        for inputs in batches:
+            inputs = inputs.to(model.device)
+            with torch.no_grad():
+                encoder_outputs = model.get_encoder()(
+                    input_ids=inputs.input_ids,
+                    attention_mask=inputs.attention_mask,
+                    return_dict=True,
+                )
+            summaries_per_config = [
+                tokenizer.batch_decode(
+                    _generate(model, inputs, encoder_outputs, decoding_config),
+                    skip_special_tokens=True,
+                    clean_up_tokenization_spaces=False,
+                )
+                for decoding_config in decoding_configs
+            ]
+            batch_outputs.append(
+                [list(summaries) for summaries in zip(*summaries_per_config)]
+            )
+        yield from restore_order(sampler, batch_outputs)
+
+
+def run_decoding_sweep(
+    dataset: str,
+    model,
+    tokenizer,
+    documents: Dict[str, str],
+    decoding_configs: List[Dict],
+    max_tokens: int = 4096,
+    flush_every: int = 256,
+):
+    """
+    Summarize & store documents under several decoding configurations,
+    each configuration is stored as its own model (see decoding_model_id)
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: encoder-decoder model to run inference on
+        tokenizer: tokenizer corresponding to model
+        documents: dictionary of document id -> document
+        decoding_configs: generate settings overriding DEFAULT_DECODING, per configuration
+        max_tokens: maximum number of (padded) input tokens per batch
+        flush_every: number of documents buffered before their summaries are stored
+    """
+    model_ids = [
+        decoding_model_id(model.config.name_or_path, decoding_config)
+        for decoding_config in decoding_configs
+    ]
+    model_configs = [
+        {**model.config.to_dict(), "decoding": {**DEFAULT_DECODING, **decoding_config}}
+        for decoding_config in decoding_configs
+    ]
+    buffers = [{} for _ in decoding_configs]
+
+    def flush():
+        for model_id, model_config, buffer in zip(model_ids, model_configs, buffers):
+            if len(buffer) > 0:
+                store_model_summaries(dataset, model_id, model_config, buffer)
+                buffer.clear()
+
+    document_ids = list(documents.keys())
+    summaries = iter_sweep_summaries(
+        model,
+        tokenizer,
+        (documents[document_id] for document_id in document_ids),
+        decoding_configs,
+        max_tokens=max_tokens,
+    )
+    for i, (document_id, document_summaries) in enumerate(zip(document_ids, summaries)):
+        for buffer, summary in zip(buffers, document_summaries):
+            buffer[document_id] = summary
+        if (i + 1) % flush_every == 0:
+            flush()
+            print(f"{i + 1} of {len(document_ids)} documents completed.")
+    flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Script to summarize xsum documents under several decoding configurations"
+    )
+    parser.add_argument(
+        "--configs",
+        type=str,
+        required=True,
+        help='json list of generate settings per configuration, i.e. [{"num_beams": 1}, {"num_beams": 8}]',
+    )
+    parser.add_argument(
+        "--bbc_ids",
+        type=str,
+        default=None,
+        help="Comma-separated document BBC IDs in the Xsum test set, defaults to the first num_docs",
+    )
+    parser.add_argument("--num_docs", type=int, default=100)
+    parser.add_argument("--max_tokens", type=int, default=4096)
+    args = parser.parse_args()
+
+    model, tokenizer = load_summarization_model_and_tokenizer()
+    xsum_data = XsumDataset(datasets.load_dataset("xsum")["test"])
+    if args.bbc_ids is not None:
+        selected_data = [
+            xsum_data.data_by_id[x.strip()] for x in args.bbc_ids.split(",")
+        ]
+    else:
+        selected_data = [xsum_data[idx] for idx in range(args.num_docs)]
+
+    run_decoding_sweep(
+        "xsum",
+        model,
+        tokenizer,
+        {x["id"]: x["document"] for x in selected_data},
+        json.loads(args.configs),
+        max_tokens=args.max_tokens,
+    )
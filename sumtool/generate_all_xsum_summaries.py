@@ -1,33 +1,105 @@
 import argparse
 import datasets
+import signal
+import sys
+from contextlib import nullcontext
+from functools import partial
+from transformers import BartConfig
 from sumtool.generate_xsum_summary import (
+    MODEL_ID,
+    generation_pipeline,
     load_summarization_model_and_tokenizer,
-    generate_summaries,
+    iter_generate_summaries,
+    iter_pipeline_summaries,
 )
+from sumtool.generation_pool import GenerationPool
+from sumtool.quantization import stored_model
 from sumtool.xsum_dataset import XsumDataset
-from sumtool.storage import store_model_summaries
+from sumtool.generation_job import run_generation_job
+from sumtool import storage
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Script to run inference on an xsum example using a pre-trained model"
     )
+    parser.add_argument(
+        "--storage_backend",
+        type=str,
+        default=storage.STORAGE_BACKEND,
+        choices=["json", "log", "sharded"],
+        help="how summaries are written, defaults to the storage default (json). 'log' appends instead of rewriting the json file per flush",
+    )
+    parser.add_argument(
+        "--max_tokens",
+        type=int,
+        default=4096,
+        help="maximum number of (padded) input tokens per generation batch",
+    )
+    parser.add_argument(
+        "--flush_every",
+        type=int,
+        default=100,
+        help="number of summaries buffered before they are written to storage",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=0,
+        help="number of generation processes with their own model replica, 0 generates in this process",
+    )
+    parser.add_argument(
+        "--threads_per_worker",
+        type=int,
+        default=None,
+        help="torch threads per generation process, defaults to the cpus divided between processes",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="generate with the dynamic int8 quantized model on CPU, stored as a separate model",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="without workers, tokenize & decode on background threads while the model generates and report per-stage busy & idle time",
+    )
+    args = parser.parse_args()
+    storage.STORAGE_BACKEND = args.storage_backend
 
-    model, tokenizer = load_summarization_model_and_tokenizer()
+    if args.num_workers > 0:
+        # the model is only loaded by the workers
+        pool = GenerationPool(
+            args.num_workers,
+            args.threads_per_worker,
+            quantized=args.quantize,
+            max_tokens=args.max_tokens,
+        )
+        model_config = BartConfig.from_pretrained(MODEL_ID)
+        generate = pool.iter_summaries
+    else:
+        pool = nullcontext()
+        model, tokenizer = load_summarization_model_and_tokenizer(quantized=args.quantize)
+        model_config = model.config
+        if args.pipelined:
+            pipeline = generation_pipeline(model, tokenizer, max_tokens=args.max_tokens)
+            generate = partial(iter_pipeline_summaries, pipeline)
+        else:
+            generate = partial(iter_generate_summaries, model, tokenizer, max_tokens=args.max_tokens)
 
     xsum_data = XsumDataset(datasets.load_dataset("xsum")["test"])
-    total = len(xsum_data)
-    print(str(total) + " total documents to summarize")
-    i = 0
-    for x in xsum_data:
-        i += 1
-        gen_summary = generate_summaries(model, tokenizer, x["document"])
-
-        store_model_summaries(
+    # killed runs flush their buffered summaries, a rerun skips the stored documents
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    model_id, model_config = stored_model(model_config, args.quantize)
+    with pool:
+        run_generation_job(
             "xsum",
-            model.config.name_or_path,
-            model.config.to_dict(),
-            {x["id"]: gen_summary},
+            model_id,
+            model_config,
+            {x["id"]: x["document"] for x in xsum_data},
+            # stored as one-element lists, like the summaries of earlier runs of this script
+            lambda documents: ([summary] for summary in generate(documents)),
+            flush_every=args.flush_every,
         )
-        if i % 10 == 0:
-            print(str(i) + " of " + str(total) + " summaries completed.")
+    if args.num_workers == 0 and args.pipelined:
+        print(pipeline.report())
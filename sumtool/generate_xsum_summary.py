@@ -1,27 +1,44 @@
 import argparse
 import torch
 import datasets
-from typing import List, Tuple
-from sumtool.utils import entropy
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple
+from sumtool import model_registry
+from sumtool.batching import TokenBudgetBatchSampler, restore_order
+from sumtool.pipeline import Pipeline
+from sumtool.quantization import stored_model
+from sumtool.utils import batched_entropy
 from sumtool.xsum_dataset import XsumDataset
 from sumtool.storage import store_model_summaries
+from sumtool.storage.token_metadata import append_token_metadata
 from transformers import BartTokenizer, BartForConditionalGeneration
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+MODEL_ID = "facebook/bart-large-xsum"
 
-def load_summarization_model_and_tokenizer() -> Tuple[
+
+def load_summarization_model_and_tokenizer(quantized: bool = False) -> Tuple[
     BartForConditionalGeneration, BartTokenizer
 ]:
     """
     Load summary generation model and move to GPU, if possible.
+    Model & tokenizer are shared by all callers in the process, see model_registry.py
+
+    Args:
+        quantized: load the dynamic int8 quantized model for CPU inference (see quantization.py)
 
     Returns:
         (model, tokenizer)
     """
-    tokenizer = BartTokenizer.from_pretrained("facebook/bart-large-xsum")
-    model = BartForConditionalGeneration.from_pretrained("facebook/bart-large-xsum")
-    model.to(device)
+    tokenizer = model_registry.get_tokenizer(BartTokenizer, MODEL_ID)
+    if quantized:
+        model = model_registry.get_quantized_model(
+            BartForConditionalGeneration, MODEL_ID
+        )
+    else:
+        model = model_registry.get_model(BartForConditionalGeneration, MODEL_ID)
+        model.to(device)
 
     return model, tokenizer
 
@@ -29,9 +46,10 @@ def load_summarization_model_and_tokenizer() -> Tuple[
 def generate_summaries(
     model: BartForConditionalGeneration,
     tokenizer: BartTokenizer,
-    docs_to_summarize: List[str],
+    docs_to_summarize: Iterable[str],
     num_beams: int = 4,
-    return_generation_metadata: bool = False
+    return_generation_metadata: bool = False,
+    max_tokens: int = 4096,
 ):
     """
     Given a trained summary generation model and appropriate tokenizer,
@@ -40,34 +58,152 @@ def generate_summaries(
     2. Run inference on model to generate output vocabulary tokens for summary
     3. Decode tokens to a sentence using the tokenizer
 
+    Documents are batched by length, see iter_generate_summaries.
+
     Args:
         model: model to run inference on
         tokenizer: tokenizer corresponding to model
         docs_to_summarize: documents to summarize
         num_beams: number of beams for beam search
         return_generation_metadata: whether generation metadata should be returned
+        max_tokens: maximum number of (padded) input tokens per generate call
 
     Returns:
         decoded_sentence
     """
-    inputs = tokenizer(
-        docs_to_summarize,
-        max_length=1024,
-        truncation=True,
-        return_tensors="pt",
-        padding=True,
+    results = list(
+        iter_generate_summaries(
+            model,
+            tokenizer,
+            docs_to_summarize,
+            num_beams=num_beams,
+            return_generation_metadata=return_generation_metadata,
+            max_tokens=max_tokens,
+        )
     )
-    input_token_ids = inputs.input_ids.to(device)
+    if not return_generation_metadata:
+        return results
+    else:
+        return [summary for summary, _ in results], [metadata for _, metadata in results]
+
+
+def iter_generate_summaries(
+    model: BartForConditionalGeneration,
+    tokenizer: BartTokenizer,
+    docs_to_summarize: Iterable[str],
+    num_beams: int = 4,
+    return_generation_metadata: bool = False,
+    max_tokens: int = 4096,
+    window_size: int = 256,
+) -> Iterator:
+    """
+    Summarize a stream of documents in batches formed from a token budget.
+
+    Documents are read in windows of window_size, each window is tokenized once, sorted by length
+    and split into batches of at most max_tokens padded input tokens (beam search multiplies
+    memory by num_beams), so batches are large for short documents & small for long ones.
+    Summaries are yielded in input order after each window.
+
+    Args:
+        model: model to run inference on
+        tokenizer: tokenizer corresponding to model
+        docs_to_summarize: iterable of documents to summarize, of any length
+        num_beams: number of beams for beam search
+        return_generation_metadata: whether generation metadata should be returned
+        max_tokens: maximum number of (padded) input tokens per generate call
+        window_size: number of documents sorted by length together
+
+    Yields:
+        summary, or (summary, token metadata) if return_generation_metadata
+    """
+    for sampler, batches in length_batched_inputs(
+        tokenizer, docs_to_summarize, max_tokens, window_size
+    ):
+        batch_outputs = [
+            _generate_batch(
+                model, tokenizer, inputs, num_beams, return_generation_metadata
+            )
+            for inputs in batches
+        ]
+        yield from restore_order(sampler, batch_outputs)
+
 
-    model_output = model.generate(
-        input_token_ids,
+def _windows(docs: Iterable[str], window_size: int) -> Iterator[List[str]]:
+    if isinstance(docs, str):
+        docs = [docs]
+    docs = iter(docs)
+    while True:
+        window = list(islice(docs, window_size))
+        if len(window) == 0:
+            return
+        yield window
+
+
+def length_batched_inputs(
+    tokenizer: BartTokenizer,
+    docs: Iterable[str],
+    max_tokens: int = 4096,
+    window_size: int = 256,
+) -> Iterator[Tuple[TokenBudgetBatchSampler, List]]:
+    """
+    Read documents in windows, tokenize each window once & split it into length-sorted batches
+
+    Args:
+        tokenizer: tokenizer corresponding to model
+        docs: iterable of documents (or a single document)
+        max_tokens: maximum number of (padded) input tokens per batch
+        window_size: number of documents sorted by length together
+
+    Yields:
+        (sampler, padded inputs of every batch of the sampler), per window,
+        outputs of the batches are put back in input order with restore_order(sampler, ...)
+    """
+    for window in _windows(docs, window_size):
+        input_ids = tokenizer(window, max_length=1024, truncation=True).input_ids
+        sampler = TokenBudgetBatchSampler([len(ids) for ids in input_ids], max_tokens)
+        yield sampler, [
+            tokenizer.pad(
+                {"input_ids": [input_ids[idx] for idx in batch]}, return_tensors="pt"
+            )
+            for batch in sampler
+        ]
+
+
+def _generate_batch(
+    model: BartForConditionalGeneration,
+    tokenizer: BartTokenizer,
+    inputs,
+    num_beams: int,
+    return_generation_metadata: bool,
+) -> List:
+    model_output = _run_generate(model, inputs, num_beams, return_generation_metadata)
+    return _decode_outputs(tokenizer, inputs, model_output, return_generation_metadata)
+
+
+def _run_generate(
+    model: BartForConditionalGeneration,
+    inputs,
+    num_beams: int,
+    return_generation_metadata: bool,
+):
+    # quantized models stay on CPU
+    return model.generate(
+        inputs.input_ids.to(model.device),
+        attention_mask=inputs.attention_mask.to(model.device),
         num_beams=num_beams,
         max_length=150,
         early_stopping=True,
         return_dict_in_generate=True,
-        output_scores=True,
+        output_scores=return_generation_metadata,
     )
 
+
+def _decode_outputs(
+    tokenizer: BartTokenizer,
+    inputs,
+    model_output,
+    return_generation_metadata: bool,
+) -> List:
     generated_summaries = [
         tokenizer.decode(
             id, skip_special_tokens=True, clean_up_tokenization_spaces=False
@@ -78,35 +214,198 @@ def generate_summaries(
     if not return_generation_metadata:
         return generated_summaries
     else:
-        token_metadata = []
-        input_set = input_token_ids.view(-1).tolist()
-        for seq_idx in range(model_output.sequences.shape[0]):
-            seq_metadata = []
-            token_metadata.append(seq_metadata)
-            for idx, output_token_id in enumerate(model_output.sequences[seq_idx][1:]):
-                beam_idx = model_output.beam_indices[seq_idx][idx]
-                selected_beam_probs = torch.exp(model_output.scores[idx][beam_idx])
-
-                beam_top_alternatives = []
-                top_probs = torch.topk(selected_beam_probs, k=3)
-                for i, v in zip(top_probs.indices, top_probs.values):
-                    beam_top_alternatives.append({
-                        "token": tokenizer.decode(i),
-                        "token_id": i.item(),
-                        "beam_token_prob": v.item()
-                    })
-
-                seq_metadata.append({
-                    "token_id": output_token_id,
-                    "token": tokenizer.decode(output_token_id),
-                    "entropy": entropy(selected_beam_probs),
-                    "beam_token_prob": selected_beam_probs[output_token_id].item(),
-                    "beam_idx": beam_idx.item(),
-                    "beam_top_probs": beam_top_alternatives,
-                    "token_in_input": output_token_id in input_set,
-                })
-
-        return generated_summaries, token_metadata
+        token_metadata = _generation_metadata(tokenizer, inputs, model_output)
+        return list(zip(generated_summaries, token_metadata))
+
+
+def generation_pipeline(
+    model: BartForConditionalGeneration,
+    tokenizer: BartTokenizer,
+    num_beams: int = 4,
+    return_generation_metadata: bool = False,
+    max_tokens: int = 4096,
+    queue_size: int = 2,
+) -> Pipeline:
+    """
+    Pipeline of tokenize -> generate -> decode stages on background threads (see pipeline.py),
+    so the model does not wait for tokenization & decoding. Run it with iter_pipeline_summaries.
+
+    Args:
+        model: model to run inference on
+        tokenizer: tokenizer corresponding to model
+        num_beams: number of beams for beam search
+        return_generation_metadata: whether generation metadata should be returned
+        max_tokens: maximum number of (padded) input tokens per generate call
+        queue_size: maximum number of batches waiting between two stages
+
+    Returns:
+        Pipeline of windows of documents to (sampler, batch outputs)
+    """
+
+    def tokenize(window):
+        for sampler, batches in length_batched_inputs(tokenizer, window, max_tokens):
+            for inputs in batches:
+                yield sampler, inputs
+
+    def generate(batch):
+        sampler, inputs = batch
+        yield sampler, inputs, _run_generate(
+            model, inputs, num_beams, return_generation_metadata
+        )
+
+    def decode(batch):
+        sampler, inputs, model_output = batch
+        yield sampler, _decode_outputs(
+            tokenizer, inputs, model_output, return_generation_metadata
+        )
+
+    return Pipeline(
+        [("tokenize", tokenize), ("generate", generate), ("decode", decode)],
+        queue_size=queue_size,
+    )
+
+
+def iter_pipeline_summaries(
+    pipeline: Pipeline, docs_to_summarize: Iterable[str], window_size: int = 256
+) -> Iterator:
+    """
+    Summarize a stream of documents with a generation pipeline, like iter_generate_summaries
+
+    Args:
+        pipeline: see generation_pipeline
+        docs_to_summarize: iterable of documents to summarize, of any length
+        window_size: number of documents sorted by length together
+
+    Yields:
+        summary, or (summary, token metadata) if the pipeline returns generation metadata,
+        in input order
+    """
+    batch_outputs = []
+    for sampler, outputs in pipeline.run(_windows(docs_to_summarize, window_size)):
+        # batches arrive in order, a window is complete after its last batch
+        batch_outputs.append(outputs)
+        if len(batch_outputs) == len(sampler):
+            yield from restore_order(sampler, batch_outputs)
+            batch_outputs = []
+
+
+# tokenizer -> decoded string of every vocabulary id
+_vocabulary_strings = {}
+
+
+def _vocabulary(tokenizer) -> List[str]:
+    key = (tokenizer.name_or_path, len(tokenizer))
+    if key not in _vocabulary_strings:
+        _vocabulary_strings[key] = [tokenizer.decode([i]) for i in range(len(tokenizer))]
+    return _vocabulary_strings[key]
+
+
+def _sequence_lengths(tokenizer, output_token_ids, beam_indices) -> List[int]:
+    """
+    Number of generated tokens of every sequence, up to & including its first eos token:
+    sequences that finished early are padded to the longest one, and the beam indices of
+    their padding are -1 (newer transformers)
+    """
+    is_eos = output_token_ids == tokenizer.eos_token_id
+    after_eos = (is_eos.long().cumsum(dim=1) - is_eos.long()) > 0
+    is_token = ~after_eos & (beam_indices >= 0)
+    # tokens before the first padding position
+    return is_token.long().cumprod(dim=1).sum(dim=1).tolist()
+
+
+def _beam_indices(model_output, num_steps: int) -> torch.Tensor:
+    """
+    Beam of every generated token, as a (num sequences, num steps) tensor, -1 after the end
+    """
+    beam_indices = model_output.beam_indices
+    if isinstance(beam_indices, torch.Tensor):
+        return beam_indices[:, :num_steps].to(model_output.sequences.device)
+    # older transformers: tuple per sequence of per step beam indices
+    padded = torch.full((len(beam_indices), num_steps), -1, dtype=torch.long)
+    for seq_idx, seq_beam_indices in enumerate(beam_indices):
+        steps = min(len(seq_beam_indices), num_steps)
+        padded[seq_idx, :steps] = torch.as_tensor(
+            [int(beam_idx) for beam_idx in seq_beam_indices[:steps]]
+        )
+    return padded.to(model_output.sequences.device)
+
+
+def _generation_metadata(tokenizer, inputs, model_output, top_k: int = 3) -> List[List[dict]]:
+    """
+    Per-token metadata of generated sequences, computed per generation step for all sequences at once
+
+    Args:
+        tokenizer: tokenizer corresponding to model
+        inputs: padded inputs of the batch
+        model_output: beam search output with scores & beam_indices
+        top_k: number of most probable alternatives per token
+
+    Returns:
+        list of per token metadata dicts, per sequence
+    """
+    num_steps = len(model_output.scores)
+    output_token_ids = model_output.sequences[:, 1:num_steps + 1]
+    num_sequences, num_tokens = output_token_ids.shape
+    beam_indices = _beam_indices(model_output, num_tokens)
+    sequence_lengths = _sequence_lengths(tokenizer, output_token_ids, beam_indices)
+    # padding steps gather an arbitrary beam, their metadata is dropped below
+    beam_indices = beam_indices.clamp(min=0)
+
+    # vocabulary mask of the tokens of each sequence's own document, padding excluded
+    input_ids = inputs.input_ids.to(output_token_ids.device)
+    attention_mask = inputs.attention_mask.to(output_token_ids.device).bool()
+    input_ids = torch.where(attention_mask, input_ids, input_ids[:, :1])
+    vocabulary_mask = torch.zeros(
+        (num_sequences, model_output.scores[0].shape[-1]),
+        dtype=torch.bool,
+        device=input_ids.device,
+    )
+    vocabulary_mask.scatter_(1, input_ids, True)
+
+    entropies, token_probs, top_probs, top_ids = [], [], [], []
+    for step in range(num_tokens):
+        # scores of the beam each sequence's token was selected from
+        log_probs = model_output.scores[step][beam_indices[:, step]].log_softmax(dim=-1)
+        entropies.append(batched_entropy(log_probs))
+        token_probs.append(
+            log_probs.gather(1, output_token_ids[:, step:step + 1]).squeeze(1).exp()
+        )
+        step_top = torch.topk(log_probs, k=top_k, dim=-1)
+        top_probs.append(step_top.values.exp())
+        top_ids.append(step_top.indices)
+
+    # one device -> host transfer for the whole batch
+    entropies = torch.stack(entropies, dim=1).tolist()
+    token_probs = torch.stack(token_probs, dim=1).tolist()
+    top_probs = torch.stack(top_probs, dim=1).tolist()
+    top_ids = torch.stack(top_ids, dim=1).tolist()
+    in_input = vocabulary_mask.gather(1, output_token_ids).tolist()
+    token_ids = output_token_ids.tolist()
+    beam_indices = beam_indices.tolist()
+
+    vocabulary = _vocabulary(tokenizer)
+    return [
+        [
+            {
+                "token_id": token_ids[seq_idx][idx],
+                "token": vocabulary[token_ids[seq_idx][idx]],
+                "entropy": entropies[seq_idx][idx],
+                "beam_token_prob": token_probs[seq_idx][idx],
+                "beam_idx": beam_indices[seq_idx][idx],
+                "beam_top_probs": [
+                    {
+                        "token": vocabulary[token_id],
+                        "token_id": token_id,
+                        "beam_token_prob": prob,
+                    }
+                    for token_id, prob in zip(top_ids[seq_idx][idx], top_probs[seq_idx][idx])
+                ],
+                "token_in_input": in_input[seq_idx][idx],
+            }
+            for idx in range(sequence_lengths[seq_idx])
+        ]
+        for seq_idx in range(num_sequences)
+    ]
 
 
 if __name__ == "__main__":
@@ -129,9 +428,16 @@ if __name__ == "__main__":
         help="xsum data split to index into with `data_index`",
     )
 
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="generate with the dynamic int8 quantized model on CPU, stored as a separate model",
+    )
+
     args = parser.parse_args()
 
-    model, tokenizer = load_summarization_model_and_tokenizer()
+    model, tokenizer = load_summarization_model_and_tokenizer(quantized=args.quantize)
+    model_id, model_config = stored_model(model.config, args.quantize)
 
     xsum_data = XsumDataset(datasets.load_dataset("xsum")[args.data_split])
     selected_data = [xsum_data.data_by_id[x.strip()] for x in args.bbc_ids.split(",")]
@@ -144,28 +450,29 @@ if __name__ == "__main__":
         return_generation_metadata=True
     )
 
-    summary_metadata = {}
-
-    for source, gen_summary, seq_metadata in zip(selected_data, summaries, generation_metadata):
+    for source, gen_summary in zip(selected_data, summaries):
         print("XSUM ID", source["id"])
         print("GOLD STANDARD SUMMARY:", source["true_summary"])
         print("PREDICTED SUMMARY:", gen_summary)
 
-        tokens_with_entropy = []
-        for token_metadata in seq_metadata:
-            tokens_with_entropy.append((
-                token_metadata["token"],
-                token_metadata["entropy"]
-            ))
-
-        summary_metadata[source["id"]] = {
-            "tokens_with_entropy": tokens_with_entropy
+    # full per-token metadata is stored in a compact binary file, referenced from the summary metadata
+    token_metadata_references = append_token_metadata(
+        "xsum",
+        model_id,
+        {
+            source["id"]: seq_metadata
+            for source, seq_metadata in zip(selected_data, generation_metadata)
         }
+    )
+    summary_metadata = {
+        bbc_id: {"token_metadata": reference}
+        for bbc_id, reference in token_metadata_references.items()
+    }
 
     store_model_summaries(
         "xsum",
-        model.config.name_or_path,
-        model.config.to_dict(),
+        model_id,
+        model_config,
         {
             source["id"]: gen_summary
             for source, gen_summary in zip(selected_data, summaries)
@@ -0,0 +1,124 @@
+"""
+Resumable generation of summaries for a whole dataset split.
+
+Documents are streamed through a summarizer that batches them by length (see iter_generate_summaries)
+and buffered, the buffer is flushed to storage every flush_every summaries, on interruption and at
+the end. Flushed summaries are the checkpoint of the job: a restarted job skips every document that
+already has a stored summary for the model, so a killed run loses at most one buffer.
+"""
+
+import datetime
+import os
+import time
+from typing import Callable, Dict, Iterable, Set
+
+from sumtool import storage
+from sumtool.storage import sqlite as sqlite_storage
+
+
+def stored_document_ids(dataset: str, model: str) -> Set[str]:
+    """
+    Ids of the documents that already have a stored summary for a model
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored summaries
+
+    Returns:
+        set of document ids, empty if the model has no stored summaries
+    """
+    if not sqlite_storage.has_model(dataset, model) and not os.path.exists(
+        storage.summaries_path(dataset, model)
+    ):
+        return set()
+    return set(storage.get_summary_ids(dataset, model))
+
+
+class GenerationProgress:
+    """
+    Throughput & ETA of a generation job, counting only the documents generated by this run
+    """
+
+    def __init__(self, total: int, done: int = 0):
+        self.total = total
+        self.done = done
+        self.generated = 0
+        self.start = time.monotonic()
+
+    def update(self, num_documents: int):
+        self.done += num_documents
+        self.generated += num_documents
+
+    def docs_per_sec(self) -> float:
+        elapsed = time.monotonic() - self.start
+        return self.generated / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> datetime.timedelta:
+        rate = self.docs_per_sec()
+        remaining = self.total - self.done
+        return datetime.timedelta(seconds=int(remaining / rate) if rate > 0 else 0)
+
+    def __str__(self):
+        return (
+            f"{self.done} of {self.total} summaries completed, "
+            f"{self.docs_per_sec():.2f} docs/sec, ETA {self.eta()}"
+        )
+
+
+def run_generation_job(
+    dataset: str,
+    model_id: str,
+    model_config: Dict,
+    documents: Dict[str, str],
+    generate: Callable[[Iterable[str]], Iterable[str]],
+    flush_every: int = 100,
+    log: Callable[[str], None] = print,
+) -> GenerationProgress:
+    """
+    Generate & store the summaries of all documents without a stored summary
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model_id: id the summaries are stored under, i.e. model.config.name_or_path
+        model_config: config the summaries are stored with, i.e. model.config.to_dict()
+        documents: dictionary of document id -> document
+        generate: function streaming the summaries of documents in input order,
+            i.e. a partial of iter_generate_summaries
+        flush_every: number of summaries buffered before they are stored
+        log: progress reporting function
+
+    Returns:
+        GenerationProgress of the job
+    """
+    stored = stored_document_ids(dataset, model_id)
+    pending_ids = [
+        document_id for document_id in documents if str(document_id) not in stored
+    ]
+    progress = GenerationProgress(len(documents), len(documents) - len(pending_ids))
+    log(
+        f"{len(pending_ids)} of {len(documents)} documents to summarize, "
+        f"{progress.done} already stored"
+    )
+    if len(pending_ids) == 0:
+        return progress
+
+    buffer = {}
+
+    def flush():
+        if len(buffer) > 0:
+            storage.store_model_summaries(dataset, model_id, model_config, buffer)
+            buffer.clear()
+
+    try:
+        summaries = generate(documents[document_id] for document_id in pending_ids)
+        for document_id, summary in zip(pending_ids, summaries):
+            buffer[document_id] = summary
+            progress.update(1)
+            if len(buffer) >= flush_every:
+                flush()
+                log(str(progress))
+    finally:
+        # a killed (or failed) run keeps the summaries generated so far
+        flush()
+    log(str(progress))
+    return progress
@@ -0,0 +1,120 @@
+"""
+Multi-process summary generation on CPU.
+
+One generation process uses only part of a many-core CPU, so the pool starts num_workers processes
+that each load their own model replica once and run torch with threads_per_worker threads.
+Documents are sent to the workers in chunks through the pool's work queue, idle workers pick up
+the next chunk, and summaries are gathered back in input order:
+
+    with GenerationPool(num_workers=8) as pool:
+        for summary in pool.iter_summaries(documents):
+            ...
+"""
+
+import multiprocessing
+import os
+from collections import deque
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+import torch
+
+from sumtool.generate_xsum_summary import (
+    iter_generate_summaries,
+    load_summarization_model_and_tokenizer,
+)
+
+# model & tokenizer replica of a worker process
+_worker_model = None
+_worker_tokenizer = None
+_worker_generate_kwargs = {}
+
+
+def _init_worker(threads_per_worker: int, quantized: bool, generate_kwargs: dict):
+    global _worker_model, _worker_tokenizer, _worker_generate_kwargs
+    torch.set_num_threads(threads_per_worker)
+    _worker_model, _worker_tokenizer = load_summarization_model_and_tokenizer(quantized)
+    _worker_generate_kwargs = generate_kwargs
+
+
+def _summarize_chunk(documents: List[str]) -> List[str]:
+    return list(
+        iter_generate_summaries(
+            _worker_model, _worker_tokenizer, documents, **_worker_generate_kwargs
+        )
+    )
+
+
+def _chunks(documents: Iterable[str], chunk_size: int) -> Iterator[List[str]]:
+    documents = iter(documents)
+    while True:
+        chunk = list(islice(documents, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+class GenerationPool:
+    """
+    Pool of generation worker processes, each with its own model replica
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        threads_per_worker: Optional[int] = None,
+        chunk_size: int = 32,
+        quantized: bool = False,
+        **generate_kwargs,
+    ):
+        """
+        Args:
+            num_workers: number of worker processes
+            threads_per_worker: torch threads per worker, defaults to the cpus divided between workers
+            chunk_size: number of documents per work item, a worker batches its chunk by length
+            quantized: workers load the dynamic int8 quantized model (see quantization.py)
+            generate_kwargs: arguments of iter_generate_summaries, i.e. num_beams & max_tokens
+        """
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker or max(
+            1, (os.cpu_count() or 1) // num_workers
+        )
+        self.chunk_size = chunk_size
+        # workers are spawned, forking a process with an initialized torch can deadlock
+        self._pool = multiprocessing.get_context("spawn").Pool(
+            num_workers,
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker, quantized, generate_kwargs),
+        )
+
+    def iter_summaries(self, documents: Iterable[str]) -> Iterator[str]:
+        """
+        Summarize documents in the worker processes
+
+        Args:
+            documents: iterable of documents, read lazily
+
+        Yields:
+            summaries, in input order
+        """
+        # at most two chunks per worker are in flight, so documents are read as workers free up
+        in_flight = deque()
+        for chunk in _chunks(documents, self.chunk_size):
+            in_flight.append(self._pool.apply_async(_summarize_chunk, (chunk,)))
+            if len(in_flight) >= 2 * self.num_workers:
+                yield from in_flight.popleft().get()
+        while len(in_flight) > 0:
+            yield from in_flight.popleft().get()
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.terminate()
@@ -1,16 +1,21 @@
 import bert_score
 from rouge_score import rouge_scorer
+from sumtool.storage.metric_cache import cached_scores
 
+ROUGE_METRICS = ["rouge1", "rouge2", "rougeL", "rougeLsum"]
 
-def score_each(hyps, refs, metric="bertscore", model_type="microsoft/deberta-xlarge-mnli"):
+
+def score_each(hyps, refs, metric="bertscore", model_type="microsoft/deberta-xlarge-mnli", use_cache=True):
     """
     Compute the bert score or rough score for hypothesis and reference pairs.
+    Scores of pairs scored before (with the same metric & model) are read from the metric cache.
 
     Args:
         hyps: a list of string, hypothesis
         refs: a list of string, references
         metric: metric to compute, bertsocre, rouge1, rouge2, rougeL, rougeLsum
         model_type: model to cacluate bertscore
+        use_cache: whether to read & write the persistent metric cache
 
     Returns:
         precisions, recalls, fmeasures
@@ -18,11 +23,31 @@ def score_each(hyps, refs, metric="bertscore", model_type="microsoft/deberta-xla
     Raises:
         ValueError: if the metirc is not implemented
     """
+    if metric != "bertscore" and metric not in ROUGE_METRICS:
+        raise ValueError('Metric is not implemented.')
+    if not use_cache:
+        return _score_each(hyps, refs, metric, model_type)
+
+    def compute(pairs):
+        return list(zip(*_score_each([h for _, h in pairs], [r for r, _ in pairs], metric, model_type)))
+
+    scores = cached_scores(
+        list(zip(refs, hyps)),
+        metric,
+        compute,
+        model_id=model_type if metric == "bertscore" else None,
+    )
+    if len(scores) == 0:
+        return [], [], []
+    precisions, recalls, fmeasures = zip(*scores)
+    return list(precisions), list(recalls), list(fmeasures)
+
 
+def _score_each(hyps, refs, metric, model_type):
     if metric == "bertscore":
         precisions, recalls, fmeasures = bert_score.score(hyps, refs, model_type=model_type, lang="en", verbose=True)
         return precisions.tolist(), recalls.tolist(), fmeasures.tolist()
-    elif metric in ["rouge1", "rouge2", "rougeL", "rougeLsum"]:
+    elif metric in ROUGE_METRICS:
         scorer = rouge_scorer.RougeScorer([metric])
         precisions, recalls, fmeasures = [], [], []
         # for each of the hypothesis and reference documents pair
@@ -0,0 +1,385 @@
+"""
+Process-wide registry of models & tokenizers, so every caller in a process shares one copy.
+
+Models are loaded lazily on first use and kept until they are evicted:
+
+    from sumtool import model_registry
+    model = model_registry.get_model(BartForConditionalGeneration, "facebook/bart-large-xsum")
+    tokenizer = model_registry.get_tokenizer(BartTokenizer, "facebook/bart-large-xsum")
+
+Fast cold starts: the weights of a model loaded with from_pretrained are converted once to
+safetensors (requires the safetensors package),
+
+    /data/.safetensors/<model-id>-<model class>.safetensors
+
+later starts build the model from its config and read the memory mapped safetensors file
+instead of unpickling the checkpoint. Weight initialization is skipped with transformers'
+no_init_weights (transformers >= 4.18), older versions initialize the weights before loading.
+
+Memory budget: with a budget (MEMORY_BUDGET_BYTES, or the SUMTOOL_MODEL_MEMORY_GB environment
+variable), the least recently used models are evicted before a model is loaded, until the loaded
+models and the estimated size of the new one fit. Sizes are estimated from the safetensors (or
+quantized weights) file, so the budget bounds peak memory once a model has been converted;
+the first load of a model has no estimate and is only accounted for after loading.
+Idle models: with a maximum idle time (MAX_IDLE_SECONDS, or the SUMTOOL_MODEL_MAX_IDLE_SECONDS
+environment variable), every get frees the other models unused for longer. Long-running callers
+that stop calling get free idle models with registry.free_idle(seconds). An evicted model is
+freed once its callers drop their references, and reloaded on its next use.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from sumtool import storage
+
+SAFETENSORS_DIR = ".safetensors"
+MEMORY_BUDGET_BYTES: Optional[int] = (
+    int(float(os.environ["SUMTOOL_MODEL_MEMORY_GB"]) * (1 << 30))
+    if "SUMTOOL_MODEL_MEMORY_GB" in os.environ
+    else None
+)
+MAX_IDLE_SECONDS: Optional[float] = (
+    float(os.environ["SUMTOOL_MODEL_MAX_IDLE_SECONDS"])
+    if "SUMTOOL_MODEL_MAX_IDLE_SECONDS" in os.environ
+    else None
+)
+
+
+def _safetensors():
+    try:
+        import safetensors.torch
+    except ImportError:
+        return None
+    return safetensors.torch
+
+
+def model_size(model) -> int:
+    """
+    Bytes of the weights of a model, tied weights are counted once
+
+    Args:
+        model: torch model
+
+    Returns:
+        number of bytes, 0 for objects without a state dict, i.e. tokenizers
+    """
+    if not hasattr(model, "state_dict"):
+        return 0
+    seen = set()
+    size = 0
+    for value in model.state_dict().values():
+        # packed params of quantized layers are tuples of tensors
+        for tensor in value if isinstance(value, tuple) else [value]:
+            if hasattr(tensor, "data_ptr") and tensor.data_ptr() not in seen:
+                seen.add(tensor.data_ptr())
+                size += tensor.numel() * tensor.element_size()
+    return size
+
+
+def safetensors_path(model_class, model_id: str):
+    # per class, i.e. a checkpoint loaded with & without its task head has different weights
+    return (
+        f"{storage.STORAGE_DIR}/{SAFETENSORS_DIR}/"
+        f"{storage.slugify(model_id)}-{storage.slugify(model_class.__name__)}.safetensors"
+    )
+
+
+def _file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def build_from_config(model_class, model_id: str):
+    """
+    Build a model from its pretrained config, without initializing its weights
+
+    Args:
+        model_class: huggingface model class, i.e. BartForConditionalGeneration
+            or AutoModelForSequenceClassification
+        model_id: huggingface model id
+
+    Returns:
+        the model, with uninitialized (tied) weights to load a state dict into
+    """
+    from transformers import AutoConfig
+
+    try:
+        # transformers internals, added in 4.18
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:
+        no_init_weights = nullcontext
+
+    config = AutoConfig.from_pretrained(model_id)
+    # weights are overwritten by the loaded ones, skip their random initialization
+    with no_init_weights():
+        if hasattr(model_class, "from_config"):
+            model = model_class.from_config(config)
+        else:
+            model = model_class(config)
+    # skipping initialization also skips tying, i.e. BART's lm_head & shared embeddings.
+    # the file stores one name per tied tensor, which the model must share to load it strictly
+    model.tie_weights()
+    return model
+
+
+def load_model(model_class, model_id: str):
+    """
+    Load a pretrained model, from its safetensors file if it exists
+
+    Args:
+        model_class: huggingface model class, i.e. BartForConditionalGeneration
+            or AutoModelForSequenceClassification
+        model_id: huggingface model id
+
+    Returns:
+        the model, in eval mode
+    """
+    safetensors = _safetensors()
+    if safetensors is None:
+        return model_class.from_pretrained(model_id).eval()
+
+    path = safetensors_path(model_class, model_id)
+    if os.path.exists(path):
+        model = build_from_config(model_class, model_id)
+        safetensors.load_model(model, path)
+        return model.eval()
+
+    model = model_class.from_pretrained(model_id).eval()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # save_model deduplicates tied weights, i.e. shared embeddings
+    safetensors.save_model(model, f"{path}.{os.getpid()}.tmp")
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+    return model
+
+
+class ModelRegistry:
+    """
+    Lazily loaded, shared models & tokenizers, least recently used first out under a memory budget
+    """
+
+    def __init__(
+        self,
+        memory_budget: Optional[int] = None,
+        max_idle_seconds: Optional[float] = None,
+    ):
+        """
+        Args:
+            memory_budget: maximum bytes of loaded model weights, defaults to MEMORY_BUDGET_BYTES
+            max_idle_seconds: idle time after which get frees a model,
+                defaults to MAX_IDLE_SECONDS
+        """
+        self.memory_budget = memory_budget
+        self.max_idle_seconds = max_idle_seconds
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._last_used: Dict[Hashable, float] = {}
+        # estimated sizes of models being loaded, counted against the budget
+        self._loading: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def _budget(self) -> Optional[int]:
+        return (
+            self.memory_budget
+            if self.memory_budget is not None
+            else MEMORY_BUDGET_BYTES
+        )
+
+    def _max_idle_seconds(self) -> Optional[float]:
+        return (
+            self.max_idle_seconds
+            if self.max_idle_seconds is not None
+            else MAX_IDLE_SECONDS
+        )
+
+    def get(
+        self, key: Hashable, load: Callable[[], Any], estimated_size: int = 0
+    ) -> Any:
+        """
+        Get a shared object, loading it on first use
+
+        Args:
+            key: identifies the object, i.e. ("model", class name, model id)
+            load: function loading the object
+            estimated_size: bytes the loaded object is expected to take,
+                made room for before loading
+
+        Returns:
+            the shared object
+        """
+        with self._lock:
+            if self._max_idle_seconds() is not None:
+                self._drop_idle(self._max_idle_seconds(), keep=key)
+            if key in self._entries:
+                return self._hit(key)
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # one load per key, concurrent callers of the same key wait for it
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    return self._hit(key)
+                self._evict(estimated_size)
+                self._loading[key] = estimated_size
+            try:
+                value = load()
+            finally:
+                with self._lock:
+                    del self._loading[key]
+            size = model_size(value)
+            with self._lock:
+                # sizes without an estimate are only known now
+                self._evict(size)
+                self._entries[key] = value
+                self._sizes[key] = size
+                self._last_used[key] = time.monotonic()
+                self.loads += 1
+            return value
+
+    def _hit(self, key: Hashable):
+        self._entries.move_to_end(key)
+        self._last_used[key] = time.monotonic()
+        self.hits += 1
+        return self._entries[key]
+
+    def _evict(self, incoming: int):
+        budget = self._budget()
+        if budget is None:
+            return
+        while (
+            len(self._entries) > 0
+            and sum(self._sizes.values()) + sum(self._loading.values()) + incoming
+            > budget
+        ):
+            key, _ = self._entries.popitem(last=False)
+            self._drop(key)
+            self.evictions += 1
+
+    def _drop(self, key: Hashable):
+        self._entries.pop(key, None)
+        del self._sizes[key]
+        del self._last_used[key]
+
+    def get_model(self, model_class, model_id: str):
+        """
+        Get a shared pretrained model
+
+        Args:
+            model_class: huggingface model class, i.e. BartForConditionalGeneration
+            model_id: huggingface model id
+
+        Returns:
+            the model, in eval mode
+        """
+        return self.get(
+            ("model", model_class.__name__, model_id),
+            lambda: load_model(model_class, model_id),
+            estimated_size=_file_size(safetensors_path(model_class, model_id)),
+        )
+
+    def get_quantized_model(self, model_class, model_id: str):
+        """
+        Get a shared dynamic int8 quantized model, see quantization.py
+
+        Args:
+            model_class: huggingface model class, i.e. BartForConditionalGeneration
+            model_id: huggingface model id
+
+        Returns:
+            the quantized model, in eval mode on CPU
+        """
+        from sumtool.quantization import load_quantized_model, quantized_path
+
+        return self.get(
+            ("quantized", model_class.__name__, model_id),
+            lambda: load_quantized_model(model_class, model_id),
+            estimated_size=_file_size(quantized_path(model_class, model_id)),
+        )
+
+    def get_tokenizer(self, tokenizer_class, model_id: str):
+        """
+        Get a shared pretrained tokenizer
+
+        Args:
+            tokenizer_class: huggingface tokenizer class, i.e. AutoTokenizer
+            model_id: huggingface model id
+
+        Returns:
+            the tokenizer
+        """
+        return self.get(
+            ("tokenizer", tokenizer_class.__name__, model_id),
+            lambda: tokenizer_class.from_pretrained(model_id),
+        )
+
+    def free(self, key: Optional[Hashable] = None):
+        """
+        Drop the registry's reference to an object, or to all objects
+
+        Args:
+            key: key of the object, defaults to all objects
+        """
+        with self._lock:
+            keys = [key] if key is not None else list(self._entries.keys())
+            for k in keys:
+                if k in self._entries:
+                    self._drop(k)
+
+    def free_idle(self, max_idle_seconds: float) -> int:
+        """
+        Drop the registry's references to objects unused for longer than max_idle_seconds
+
+        Args:
+            max_idle_seconds: idle time after which an object is freed
+
+        Returns:
+            number of freed objects
+        """
+        with self._lock:
+            return self._drop_idle(max_idle_seconds)
+
+    def _drop_idle(
+        self, max_idle_seconds: float, keep: Optional[Hashable] = None
+    ) -> int:
+        now = time.monotonic()
+        idle = [
+            key
+            for key, last_used in self._last_used.items()
+            if now - last_used > max_idle_seconds and key != keep
+        ]
+        for key in idle:
+            self._drop(key)
+        self.evictions += len(idle)
+        return len(idle)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(self._sizes.values()),
+                "memory_budget": self._budget(),
+                "loads": self.loads,
+                "hits": self.hits,
+                "evictions": self.evictions,
+            }
+
+
+registry = ModelRegistry()
+
+
+def get_model(model_class, model_id: str):
+    return registry.get_model(model_class, model_id)
+
+
+def get_quantized_model(model_class, model_id: str):
+    return registry.get_quantized_model(model_class, model_id)
+
+
+def get_tokenizer(tokenizer_class, model_id: str):
+    return registry.get_tokenizer(tokenizer_class, model_id)
@@ -1,6 +1,7 @@
 from .dictionary import Dictionary
 from .ngram_lookup import NgramLookup, LookupCase, preprocess
 from .summary_ngram_lookup import SummaryNgramLookup
+from .snapshot import SnapshotMismatchError
 
 __all__ = [
     "Dictionary",
@@ -8,4 +9,5 @@ __all__ = [
     "preprocess",
     "LookupCase",
     "SummaryNgramLookup",
+    "SnapshotMismatchError",
 ]
@@ -0,0 +1,368 @@
+"""
+Posting list statistics for ngram tables: exact document counts and
+HyperLogLog sketches for approximate union & intersection counts
+
+Every ngram table gets two extra columns
+- doc_count: number of documents containing the ngram (len(doc_idx_list))
+- hll: HyperLogLog registers of doc_idx_list, only for ngrams in at least
+  HLL_THRESHOLD documents (rarer ngrams are sketched on the fly from their short posting list)
+
+Tables are sorted by ngram, so the rows of ngrams are found by binary search.
+PostingStatsMixin adds count-only lookups & estimates to the ngram lookup classes.
+"""
+
+import os
+from itertools import combinations
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+HLL_PRECISION = 10  # 2^10 registers, ~3% standard error, 1KB per sketch
+HLL_REGISTERS = 1 << HLL_PRECISION
+# a sketch costs as much as a posting list of this many int32 document indices
+HLL_THRESHOLD = HLL_REGISTERS // 4
+# inclusion-exclusion needs 2^k - 1 union estimates for k ngrams and their errors add up,
+# intersections of more ngrams are estimated from the rarest ones
+MAX_INTERSECTION_TERMS = 4
+
+
+def _hash(doc_idx):
+    # splitmix64 finalizer, spreads consecutive document indices over 64 bits
+    with np.errstate(over="ignore"):
+        x = doc_idx.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def hll_sketch(doc_idx):
+    """
+    Build HyperLogLog registers for a set of document indices
+
+    Args:
+        doc_idx: array-like of document indices
+
+    Returns:
+        numpy array of HLL_REGISTERS uint8 registers
+    """
+    hashed = _hash(np.asarray(doc_idx))
+    register_idx = (hashed >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+    remainder = hashed << np.uint64(HLL_PRECISION)
+
+    # rank = number of leading zeros + 1, read from the exponent of the top 53 bits
+    _, bit_length = np.frexp((remainder >> np.uint64(11)).astype(np.float64))
+    rank = np.where(bit_length > 0, 64 - 11 - bit_length + 1, 64 - 11 + 1)
+    rank = np.minimum(rank, 64 - HLL_PRECISION + 1).astype(np.uint8)
+
+    registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    np.maximum.at(registers, register_idx, rank)
+    return registers
+
+
+def hll_estimate(registers):
+    """
+    Estimate the cardinality of a HyperLogLog sketch
+
+    Args:
+        registers: numpy array of HLL_REGISTERS uint8 registers
+
+    Returns:
+        A float, estimated number of distinct documents
+    """
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)))
+
+    zero_registers = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zero_registers > 0:
+        # small range correction (linear counting)
+        return m * np.log(m / zero_registers)
+    return float(estimate)
+
+
+def add_posting_stats(table, hll_threshold=HLL_THRESHOLD):
+    """
+    Add doc_count & hll columns to an ngram table, if not present, and sort it by ngram
+
+    Args:
+        table: pyarrow.Table with columns ngram & doc_idx_list
+        hll_threshold: An integer, minimum document count of ngrams that get a stored sketch
+
+    Returns:
+        pyarrow.Table with columns ngram, doc_idx_list, doc_count & hll, sorted by ngram
+    """
+    if table.column("ngram").num_chunks > 1:
+        table = table.combine_chunks()
+    ngrams = _ngrams(table)
+    if np.any(ngrams[1:] < ngrams[:-1]):
+        table = table.take(pc.sort_indices(table, sort_keys=[("ngram", "ascending")]))
+        table = table.combine_chunks()
+    if "doc_count" not in table.column_names:
+        doc_count = pc.list_value_length(table.column("doc_idx_list")).cast(pa.int32())
+        table = table.append_column("doc_count", doc_count)
+
+    if "hll" not in table.column_names:
+        doc_count = table.column("doc_count").to_numpy()
+        doc_idx_list = table.column("doc_idx_list")
+        sketches = [None] * len(table)
+        for row in np.flatnonzero(doc_count >= hll_threshold):
+            doc_idx = doc_idx_list[int(row)].values.to_numpy(zero_copy_only=False)
+            sketches[row] = hll_sketch(doc_idx).tobytes()
+        table = table.append_column("hll", pa.array(sketches, pa.binary()))
+
+    return table
+
+
+def _has_posting_stats(table):
+    if "doc_count" not in table.column_names or "hll" not in table.column_names:
+        return False
+    ngrams = _ngrams(table)
+    return not np.any(ngrams[1:] < ngrams[:-1])
+
+
+def read_ngram_table(file_path):
+    """
+    Read an ngram parquet file with posting stats. Files written before posting stats
+    are upgraded once, the upgraded table replaces the file
+
+    Args:
+        file_path: A string, ngram dictionary file path
+
+    Returns:
+        pyarrow.Table with columns ngram, doc_idx_list, doc_count & hll, sorted by ngram
+    """
+    table = pq.read_table(source=file_path)
+    upgraded = add_posting_stats(table)
+    if not _has_posting_stats(table):
+        print("Saving posting stats to '%s' ..." % file_path)
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        pq.write_table(upgraded, tmp_path)
+        os.replace(tmp_path, file_path)
+    return upgraded
+
+
+def _ngrams(table):
+    # zero copy view of the ngram column, a single chunk after add_posting_stats
+    ngram = table.column("ngram")
+    if ngram.num_chunks == 0:
+        return np.zeros(0, dtype=np.int64)
+    if ngram.num_chunks == 1:
+        return ngram.chunk(0).to_numpy()
+    return ngram.to_numpy()
+
+
+def posting_rows(table, ngram_ints):
+    """
+    Find the table rows of several ngrams by binary search
+
+    Args:
+        table: ngram pyarrow.Table with posting stats (sorted by ngram)
+        ngram_ints: list of ngram int ids
+
+    Returns:
+        list of row indices, None for ngrams that are not in the table
+    """
+    ngrams = _ngrams(table)
+    queries = np.asarray(ngram_ints, dtype=np.int64)
+    rows = np.searchsorted(ngrams, queries)
+    found = rows < len(ngrams)
+    found[found] = ngrams[rows[found]] == queries[found]
+    return [int(row) if match else None for row, match in zip(rows, found)]
+
+
+def posting_sketch(table, row):
+    """
+    HyperLogLog registers of a table row, stored or built from the posting list
+
+    Args:
+        table: ngram pyarrow.Table with posting stats
+        row: An integer, row index
+
+    Returns:
+        numpy array of HLL_REGISTERS uint8 registers
+    """
+    stored = table.column("hll")[row].as_py()
+    if stored is not None:
+        return np.frombuffer(stored, dtype=np.uint8)
+    doc_idx = table.column("doc_idx_list")[row].values.to_numpy(zero_copy_only=False)
+    return hll_sketch(doc_idx)
+
+
+def estimate_union(sketches):
+    """
+    Estimate the number of documents containing any of the sketched ngrams
+
+    Args:
+        sketches: list of HyperLogLog registers
+
+    Returns:
+        A float, estimated union cardinality
+    """
+    if len(sketches) == 0:
+        return 0.0
+    return hll_estimate(np.maximum.reduce(sketches))
+
+
+def estimate_intersection(counts, sketches):
+    """
+    Estimate the number of documents containing all of the sketched ngrams
+    by inclusion-exclusion over union estimates. Exact counts are used for single ngrams.
+    The absolute error is that of the union estimates, so small intersections of
+    frequent ngrams are imprecise. Beyond MAX_INTERSECTION_TERMS ngrams only the rarest
+    ones are intersected, an upper bound of the intersection of all ngrams.
+
+    Args:
+        counts: list of exact document counts, aligned with sketches
+        sketches: list of HyperLogLog registers
+
+    Returns:
+        A float, estimated intersection cardinality
+    """
+    if len(sketches) == 0:
+        return 0.0
+    if len(sketches) > MAX_INTERSECTION_TERMS:
+        rarest = np.argsort(counts, kind="stable")[:MAX_INTERSECTION_TERMS]
+        counts = [counts[i] for i in rarest]
+        sketches = [sketches[i] for i in rarest]
+    if len(sketches) == 1:
+        return float(counts[0])
+
+    estimate = 0.0
+    for size in range(1, len(sketches) + 1):
+        sign = 1 if size % 2 == 1 else -1
+        for subset in combinations(range(len(sketches)), size):
+            if size == 1:
+                union = counts[subset[0]]
+            else:
+                union = estimate_union([sketches[i] for i in subset])
+            estimate += sign * union
+    return float(min(max(estimate, 0.0), min(counts)))
+
+
+class PostingStatsMixin:
+    """
+    Count-only lookups & cardinality estimates for ngram lookups.
+    Classes using it provide ngrams_root ({n: ngram table with posting stats}),
+    MAX (the key base of ngram ints) and _query_indices
+    """
+
+    def _query_indices(self, query):
+        """
+        Transform a query into vocabulary indices
+
+        Args:
+            query: A list of query words or indices
+
+        Returns:
+            A list of indices, None if the query includes <unk>
+        """
+        raise NotImplementedError
+
+    def _query_ngram_int(self, query):
+        """
+        Transform a query into the ngram int id
+
+        Args:
+            query: A list of query words or indices
+
+        Returns:
+            (case, ngram_int), ngram_int is None if the query is empty or includes <unk>
+        """
+        # imported here, ngram_lookup imports this module
+        from .ngram_lookup import LookupCase
+
+        n = len(query)
+        if n == 0:
+            return LookupCase.no_query_given.value, None
+
+        query_idx = self._query_indices(query)
+        if query_idx is None:
+            return LookupCase.unk_in_query.value, None
+
+        ngram_int = 0
+        for i, idx in enumerate(query_idx):
+            ngram_int += idx * (self.MAX ** (n - 1 - i))
+        return LookupCase.match_found.value, ngram_int
+
+    def lookup_count(self, query):
+        """
+        count documents matching the query from precomputed posting lengths,
+        without materializing the matched document indices
+
+        Args:
+            query: A list of query words or indices
+
+        Returns:
+            A dictionary of {"case": int, "count": int}
+            - case: (one of the values of LookupCase), which category given query belongs to
+            - count: number of matched documents, 0 if no match
+        """
+        from .ngram_lookup import LookupCase
+
+        case, ngram_int = self._query_ngram_int(query)
+        if ngram_int is None:
+            return {"case": case, "count": 0}
+
+        table = self.ngrams_root[len(query)]
+        row = posting_rows(table, [ngram_int])[0]
+        if row is None:
+            return {"case": LookupCase.match_not_found.value, "count": 0}
+        return {
+            "case": LookupCase.match_found.value,
+            "count": table.column("doc_count")[row].as_py(),
+        }
+
+    def _query_postings(self, queries):
+        """
+        Exact document counts and HyperLogLog sketches of the matched queries
+
+        Args:
+            queries: A list of queries, may mix ranks
+
+        Returns:
+            (counts, sketches, all_matched)
+        """
+        counts, sketches = [], []
+        all_matched = True
+        for query in queries:
+            _, ngram_int = self._query_ngram_int(query)
+            table = self.ngrams_root[len(query)] if ngram_int is not None else None
+            row = posting_rows(table, [ngram_int])[0] if table is not None else None
+            if row is None:
+                all_matched = False
+                continue
+            counts.append(table.column("doc_count")[row].as_py())
+            sketches.append(posting_sketch(table, row))
+        return counts, sketches, all_matched
+
+    def estimate_union_count(self, queries):
+        """
+        Estimate the number of documents matching any of the queries
+
+        Args:
+            queries: A list of queries, may mix ranks
+
+        Returns:
+            A float, estimated number of documents (exact for a single query)
+        """
+        counts, sketches, _ = self._query_postings(queries)
+        if len(counts) == 1:
+            return float(counts[0])
+        return estimate_union(sketches)
+
+    def estimate_intersection_count(self, queries):
+        """
+        Estimate the number of documents matching all of the queries
+
+        Args:
+            queries: A list of queries, may mix ranks
+
+        Returns:
+            A float, estimated number of documents (exact for a single query)
+        """
+        counts, sketches, all_matched = self._query_postings(queries)
+        if not all_matched:
+            return 0.0
+        return estimate_intersection(counts, sketches)
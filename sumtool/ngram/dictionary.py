@@ -5,6 +5,8 @@ reference: https://github.com/mmz33/N-Gram-Language-Model/blob/master/index_map.
 from collections import defaultdict
 from tqdm import tqdm  # progress bar
 
+import pyarrow as pa
+
 
 class Dictionary:
     """
@@ -40,6 +42,22 @@ class Dictionary:
         # set total number of words
         self.idx = len(self.wrd_to_idx)
 
+    def build_from_table(self, table):
+        """
+        Build vocabs from a pyarrow.Table with columns "wrd" and "freq", ordered by index
+
+        Args:
+            table: A pyarrow.Table, as returned by to_table()
+        """
+        for idx, (wrd, freq) in enumerate(
+            zip(table.column("wrd").to_pylist(), table.column("freq").to_pylist())
+        ):
+            self.add_wrd(wrd)  # add word
+            self.wrd_freq[idx] = freq  # add freq
+
+        # set total number of words
+        self.idx = len(self.wrd_to_idx)
+
     def build_from_corpus(self, corpus):
         """
         build dictionary from corpus
@@ -251,6 +269,23 @@ class Dictionary:
             for idx, freq in self.wrd_freq.items():
                 f.write("%s\t%d\n" % (self.get_wrd_by_idx(idx), freq))
 
+    def to_table(self):
+        """
+        Return the vocab dictionary as a pyarrow.Table ordered by index
+
+        Returns:
+            A pyarrow.Table with columns "wrd" (string) and "freq" (int64)
+        """
+
+        indices = sorted(self.idx_to_wrd.keys())
+        return pa.Table.from_arrays(
+            [
+                pa.array([self.idx_to_wrd[idx] for idx in indices], pa.string()),
+                pa.array([self.wrd_freq[idx] for idx in indices], pa.int64()),
+            ],
+            names=["wrd", "freq"],
+        )
+
     def sort_dict_by_key(self, d, reverse=True):
         return dict(sorted(d.items(), reverse=reverse))
 
@@ -15,6 +15,17 @@ import pyarrow.parquet as pq
 from microdict import mdict
 
 from .dictionary import Dictionary
+from .cardinality import (
+    PostingStatsMixin,
+    add_posting_stats,
+    read_ngram_table,
+)
+from .snapshot import (
+    SnapshotMismatchError,
+    fingerprint_items,
+    read_snapshot,
+    write_snapshot,
+)
 from enum import Enum
 
 
@@ -25,6 +36,15 @@ class LookupCase(Enum):
     match_found = 3
 
 
+# describes preprocess(), stored in snapshots so caches built with other preprocessing are detected
+PREPROCESS_CONFIG = {
+    "strip": True,
+    "lowercase": True,
+    "remove_punctuation": True,
+    "remove_control_sequences": True,
+}
+
+
 def preprocess(text):
     # strip
     out = text.strip()
@@ -44,7 +64,7 @@ def preprocess(text):
     return out
 
 
-class NgramLookup:
+class NgramLookup(PostingStatsMixin):
     def __init__(self, documents):
         """
         Args:
@@ -56,8 +76,9 @@ class NgramLookup:
         self.unk_idx = 0
         self.ngrams_root = {}
 
-        # key to build ngram int id
-        self.MAX = self._generate_int_key(self.tokenizer.vocab_size)
+        # key to build ngram int id, set once the dictionary is built
+        self.MAX = None
+        self.max_vocab_size = None
 
     def _generate_int_key(self, x):
         # check if x is power of 10
@@ -88,6 +109,9 @@ class NgramLookup:
             if save_flag:
                 self.dictionary.save_as_file(file_path=vocabs_path)
 
+        self.max_vocab_size = max_vocab_size
+        self.MAX = self._generate_int_key(self.dictionary.get_num_of_words())
+
     def build_ngram_dictionary(self, ngram_path, min_n, max_n, save_flag=True):
         """
         Build ngram dictionaries for n in (min_n, max_n + 1)
@@ -181,7 +205,7 @@ class NgramLookup:
         )
 
         print("%d-gram dictionary length: %d" % (n, len(ngram_to_idx_set)))
-        self.ngrams_root[n] = table
+        self.ngrams_root[n] = add_posting_stats(table)
 
     def load_ngram_dict(self, n, file_path):
         """
@@ -195,7 +219,7 @@ class NgramLookup:
         print("Loading %d-gram dictionary from '%s' ..." % (n, file_path))
 
         # save as parquet
-        self.ngrams_root[n] = pq.read_table(source=file_path)
+        self.ngrams_root[n] = read_ngram_table(file_path)
         # print(self.ngrams_root[n])
         print("%d-gram dictionary length: %d" % (n, len(self.ngrams_root[n])))
 
@@ -213,6 +237,109 @@ class NgramLookup:
         # parquet
         pq.write_table(self.ngrams_root[n], file_path)
 
+    def _dictionary_fingerprint(self):
+        return fingerprint_items(
+            (
+                self.dictionary.get_wrd_by_idx(idx),
+                self.dictionary.get_wrd_freq_by_idx(idx),
+            )
+            for idx in range(self.dictionary.get_num_of_words())
+        )
+
+    def save_snapshot(self, snapshot_path, corpus_fingerprint=None):
+        """
+        Save the dictionary and all built ngram dictionaries as a single snapshot file
+
+        Args:
+            snapshot_path: A string, snapshot file path
+            corpus_fingerprint: A string, optional fingerprint of the corpus (i.e. datasets.Dataset._fingerprint)
+        """
+
+        ns = sorted(self.ngrams_root.keys())
+        assert len(ns) > 0, "Build ngram dictionary first"
+        assert ns == list(range(ns[0], ns[-1] + 1)), "ngram ranks are not contiguous"
+
+        header = {
+            "min_n": ns[0],
+            "max_n": ns[-1],
+            "fingerprint": {
+                "lookup": "NgramLookup",
+                "dictionary_sha256": self._dictionary_fingerprint(),
+                "max_vocab_size": self.max_vocab_size,
+                "preprocess": PREPROCESS_CONFIG,
+                "key_base": self.MAX,
+                "corpus": corpus_fingerprint,
+            },
+        }
+        sections = {"vocabs": self.dictionary.to_table()}
+        for n in ns:
+            sections["ngram_dict_%d" % n] = self.ngrams_root[n]
+
+        write_snapshot(snapshot_path, header, sections)
+
+    @classmethod
+    def load_snapshot(
+        cls, snapshot_path, min_n, max_n, max_vocab_size=None, corpus_fingerprint=None
+    ):
+        """
+        Load a lookup from a snapshot file written by save_snapshot
+
+        Args:
+            snapshot_path: A string, snapshot file path
+            min_n: An integer, minimum rank of the grams
+            max_n: An integer, maximum rank of the grams
+            max_vocab_size: An integer, expected maximum vocabulary size (not checked if None)
+            corpus_fingerprint: A string, expected corpus fingerprint (not checked if None)
+
+        Returns:
+            NgramLookup, without documents
+
+        Raises:
+            SnapshotMismatchError: if the snapshot is stale or incompatible, the caller should rebuild
+        """
+
+        expected = {"lookup": "NgramLookup", "preprocess": PREPROCESS_CONFIG}
+        if max_vocab_size is not None:
+            expected["max_vocab_size"] = max_vocab_size
+        if corpus_fingerprint is not None:
+            expected["corpus"] = corpus_fingerprint
+
+        header, tables = read_snapshot(snapshot_path, expected, min_n, max_n)
+
+        ngram_lookup = cls(documents=None)
+        ngram_lookup.max_vocab_size = header["fingerprint"]["max_vocab_size"]
+        ngram_lookup.dictionary.build_from_table(tables["vocabs"])
+        if (
+            ngram_lookup._dictionary_fingerprint()
+            != header["fingerprint"]["dictionary_sha256"]
+        ):
+            raise SnapshotMismatchError("snapshot dictionary does not match its hash")
+
+        ngram_lookup.MAX = ngram_lookup._generate_int_key(
+            ngram_lookup.dictionary.get_num_of_words()
+        )
+        if ngram_lookup.MAX != header["fingerprint"]["key_base"]:
+            raise SnapshotMismatchError("snapshot ngram key base does not match")
+
+        for n in range(min_n, max_n + 1):
+            ngram_lookup.ngrams_root[n] = add_posting_stats(tables["ngram_dict_%d" % n])
+        return ngram_lookup
+
+    def _query_indices(self, query_wrd):
+        """
+        Transform query words into vocabulary indices
+
+        Args:
+            query_wrd: A list of query words
+
+        Returns:
+            A list of indices, None if the query includes <unk>
+        """
+        query_idx = self.dictionary.get_idx_by_wrd_multiple(query_wrd)
+        if any(idx == self.dictionary.get_unk_idx() for idx in query_idx):
+            return None
+        return query_idx
+
     def lookup(self, query_wrd):
         """
         lookup given query from ngram dictionary
@@ -245,7 +372,7 @@ class NgramLookup:
         for i, idx in enumerate(query_idx):
             ngram_int += idx * (self.MAX ** (n - 1 - i))
 
-        df = self.ngrams_root[n].to_pandas()
+        df = self.ngrams_root[n].select(["ngram", "doc_idx_list"]).to_pandas()
 
         matched_doc_idx = df.loc[df["ngram"] == ngram_int, "doc_idx_list"]
 
@@ -0,0 +1,167 @@
+"""
+Single-file snapshot container for ngram lookups
+
+Layout:
+    MAGIC (8 bytes) | header length (uint32, little endian) | header (json)
+    padding up to the next page boundary
+    section 0 (arrow ipc file), padded to the next page boundary
+    section 1 (arrow ipc file), padded to the next page boundary
+    ...
+
+The header records the snapshot format version, a fingerprint of everything
+the tables depend on (tokenizer/dictionary hash, preprocessing, key base, corpus)
+and the offset & length of every section, so the whole snapshot is loaded
+with a single mmap and each table is read zero-copy from its own section.
+"""
+
+import hashlib
+import json
+import struct
+from typing import Dict, Optional, Tuple
+
+import pyarrow as pa
+
+MAGIC = b"SUMNGRAM"
+SNAPSHOT_VERSION = 1
+PAGE_SIZE = 4096
+
+_HEADER_PREFIX = struct.Struct("<8sI")
+
+
+class SnapshotMismatchError(ValueError):
+    """
+    Raised when a snapshot is unreadable, from another format version
+    or was built for a different tokenizer, dictionary, preprocessing or n range
+    """
+
+
+def fingerprint_items(items) -> str:
+    """
+    Hash an iterable of (key, value) pairs, i.e. a vocabulary
+
+    Args:
+        items: iterable of (key, value) pairs
+
+    Returns:
+        sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    for key, value in items:
+        digest.update(("%s\t%s\n" % (key, value)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _pad(length):
+    return -length % PAGE_SIZE
+
+
+def _serialize_table(table: pa.Table) -> pa.Buffer:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def write_snapshot(file_path: str, header: Dict, sections: Dict[str, pa.Table]):
+    """
+    Write tables into a single page-aligned snapshot file
+
+    Args:
+        file_path: A string, snapshot file path
+        header: A json-serializable dictionary describing the snapshot
+        sections: A dictionary of section name -> pyarrow.Table
+    """
+    print("Saving snapshot to '%s' ..." % file_path)
+    buffers = {name: _serialize_table(table) for name, table in sections.items()}
+
+    header = dict(header, format_version=SNAPSHOT_VERSION)
+    # the header size depends on the section offsets, which depend on the header size
+    header_pages = 1
+    while True:
+        offset = header_pages * PAGE_SIZE
+        header["sections"] = {}
+        for name, buffer in buffers.items():
+            header["sections"][name] = {"offset": offset, "length": buffer.size}
+            offset += buffer.size + _pad(buffer.size)
+        header_bytes = json.dumps(header, sort_keys=True).encode("utf-8")
+        header_size = _HEADER_PREFIX.size + len(header_bytes)
+        if header_size <= header_pages * PAGE_SIZE:
+            break
+        header_pages = (header_size + PAGE_SIZE - 1) // PAGE_SIZE
+
+    with open(file_path, "wb") as f:
+        f.write(_HEADER_PREFIX.pack(MAGIC, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (header_pages * PAGE_SIZE - header_size))
+        for buffer in buffers.values():
+            f.write(buffer)
+            f.write(b"\0" * _pad(buffer.size))
+
+
+def read_snapshot_header(mapped: pa.Buffer) -> Dict:
+    if mapped.size < _HEADER_PREFIX.size:
+        raise SnapshotMismatchError("snapshot is truncated")
+    magic, header_length = _HEADER_PREFIX.unpack(
+        mapped.slice(0, _HEADER_PREFIX.size).to_pybytes()
+    )
+    if magic != MAGIC:
+        raise SnapshotMismatchError("not an ngram snapshot")
+
+    header = json.loads(
+        mapped.slice(_HEADER_PREFIX.size, header_length).to_pybytes().decode("utf-8")
+    )
+    if header.get("format_version") != SNAPSHOT_VERSION:
+        raise SnapshotMismatchError(
+            "snapshot format version %s, expected %d"
+            % (header.get("format_version"), SNAPSHOT_VERSION)
+        )
+    return header
+
+
+def read_snapshot(
+    file_path: str,
+    fingerprint: Optional[Dict] = None,
+    min_n: Optional[int] = None,
+    max_n: Optional[int] = None,
+) -> Tuple[Dict, Dict[str, pa.Table]]:
+    """
+    Memory-map a snapshot file and validate its header
+
+    Args:
+        file_path: A string, snapshot file path
+        fingerprint: A dictionary, expected values of header["fingerprint"] (only given keys are checked)
+        min_n: An integer, minimum rank of the grams the snapshot must contain
+        max_n: An integer, maximum rank of the grams the snapshot must contain
+
+    Returns:
+        (header, dictionary of section name -> pyarrow.Table)
+
+    Raises:
+        SnapshotMismatchError: if the snapshot is stale or incompatible
+    """
+    print("Loading snapshot from '%s' ..." % file_path)
+    mapped = pa.memory_map(file_path, "r").read_buffer()
+    header = read_snapshot_header(mapped)
+
+    for key, expected in (fingerprint or {}).items():
+        stored = header["fingerprint"].get(key)
+        if stored != expected:
+            raise SnapshotMismatchError(
+                "snapshot %s is %r, expected %r" % (key, stored, expected)
+            )
+
+    if (min_n is not None and min_n < header["min_n"]) or (
+        max_n is not None and max_n > header["max_n"]
+    ):
+        raise SnapshotMismatchError(
+            "snapshot contains %d to %d-grams, requested %s to %s-grams"
+            % (header["min_n"], header["max_n"], min_n, max_n)
+        )
+
+    tables = {}
+    for name, section in header["sections"].items():
+        if section["offset"] + section["length"] > mapped.size:
+            raise SnapshotMismatchError("snapshot section '%s' is truncated" % name)
+        reader = pa.ipc.open_file(mapped.slice(section["offset"], section["length"]))
+        tables[name] = reader.read_all()
+    return header, tables
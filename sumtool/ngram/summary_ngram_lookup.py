@@ -13,14 +13,25 @@ import pyarrow.parquet as pq
 from microdict import mdict
 
 from transformers import BartTokenizer
+from sumtool import model_registry
 from sumtool.ngram import LookupCase
+from sumtool.ngram.cardinality import (
+    PostingStatsMixin,
+    add_posting_stats,
+    posting_rows,
+    read_ngram_table,
+)
+from sumtool.ngram.snapshot import fingerprint_items, read_snapshot, write_snapshot
+
+# tokenizer arguments used to encode documents & summaries, stored in snapshots
+TOKENIZE_CONFIG = {"add_special_tokens": False}
 
 
 def load_tokenizer():
-    return BartTokenizer.from_pretrained("facebook/bart-large-xsum")
+    return model_registry.get_tokenizer(BartTokenizer, "facebook/bart-large-xsum")
 
 
-class SummaryNgramLookup:
+class SummaryNgramLookup(PostingStatsMixin):
     def __init__(self, documents, tokenizer):
         """
         Args:
@@ -134,7 +145,7 @@ class SummaryNgramLookup:
         )
 
         print("%d-gram dictionary length: %d" % (n, len(ngram_to_idx_set)))
-        self.ngrams_root[n] = table
+        self.ngrams_root[n] = add_posting_stats(table)
 
     def load_ngram_dict(self, n, file_path):
         """
@@ -148,7 +159,7 @@ class SummaryNgramLookup:
         print("Loading %d-gram dictionary from '%s' ..." % (n, file_path))
 
         # load parquet file
-        self.ngrams_root[n] = pq.read_table(source=file_path)
+        self.ngrams_root[n] = read_ngram_table(file_path)
         # print(self.ngrams_root[n])
         print("%d-gram dictionary length: %d" % (n, len(self.ngrams_root[n])))
 
@@ -166,6 +177,89 @@ class SummaryNgramLookup:
         # save as parquet file
         pq.write_table(self.ngrams_root[n], file_path)
 
+    def _tokenizer_fingerprint(self):
+        return {
+            "lookup": "SummaryNgramLookup",
+            "tokenizer": self.tokenizer.name_or_path,
+            "tokenizer_sha256": fingerprint_items(
+                sorted(self.tokenizer.get_vocab().items())
+            ),
+            "preprocess": TOKENIZE_CONFIG,
+            "key_base": self.MAX,
+        }
+
+    def save_snapshot(self, snapshot_path, corpus_fingerprint=None):
+        """
+        Save all built ngram dictionaries as a single snapshot file
+
+        Args:
+            snapshot_path: A string, snapshot file path
+            corpus_fingerprint: A string, optional fingerprint of the corpus (i.e. datasets.Dataset._fingerprint)
+        """
+
+        ns = sorted(self.ngrams_root.keys())
+        assert len(ns) > 0, "Build ngram dictionary first"
+        assert ns == list(range(ns[0], ns[-1] + 1)), "ngram ranks are not contiguous"
+
+        header = {
+            "min_n": ns[0],
+            "max_n": ns[-1],
+            "fingerprint": dict(
+                self._tokenizer_fingerprint(), corpus=corpus_fingerprint
+            ),
+        }
+        sections = {"ngram_dict_%d" % n: self.ngrams_root[n] for n in ns}
+
+        write_snapshot(snapshot_path, header, sections)
+
+    @classmethod
+    def load_snapshot(
+        cls, snapshot_path, tokenizer, min_n, max_n, corpus_fingerprint=None
+    ):
+        """
+        Load a lookup from a snapshot file written by save_snapshot
+
+        Args:
+            snapshot_path: A string, snapshot file path
+            tokenizer: A PreTrainedTokenizer(), must match the tokenizer the snapshot was built with
+            min_n: An integer, minimum rank of the grams
+            max_n: An integer, maximum rank of the grams
+            corpus_fingerprint: A string, expected corpus fingerprint (not checked if None)
+
+        Returns:
+            SummaryNgramLookup, without documents
+
+        Raises:
+            SnapshotMismatchError: if the snapshot is stale or incompatible, the caller should rebuild
+        """
+
+        ngram_summary_lookup = cls(documents=None, tokenizer=tokenizer)
+        expected = ngram_summary_lookup._tokenizer_fingerprint()
+        if corpus_fingerprint is not None:
+            expected["corpus"] = corpus_fingerprint
+
+        _, tables = read_snapshot(snapshot_path, expected, min_n, max_n)
+
+        for n in range(min_n, max_n + 1):
+            ngram_summary_lookup.ngrams_root[n] = add_posting_stats(
+                tables["ngram_dict_%d" % n]
+            )
+        return ngram_summary_lookup
+
+    def _query_indices(self, query_idx):
+        """
+        Check query indices against the tokenizer vocabulary
+
+        Args:
+            query_idx: A list of query indices
+
+        Returns:
+            The list of indices, None if the query includes <unk>
+        """
+        if any(idx == self.unk_idx for idx in query_idx):
+            return None
+        return query_idx
+
     def lookup(self, query_idx, ngram_df):
         """
         lookup given query from ngram table (pa.DataFrame)
@@ -225,7 +319,7 @@ class SummaryNgramLookup:
         print("Looking up summary ngrams from the training set")
         summary_indices = self.tokenizer.encode(summary, add_special_tokens=False)
 
-        ngram_df = self.ngrams_root[n].to_pandas()
+        ngram_df = self.ngrams_root[n].select(["ngram", "doc_idx_list"]).to_pandas()
 
         result_dict_list = []
         sum_ngrams = [summary_indices[k:] for k in range(n)]
@@ -240,6 +334,49 @@ class SummaryNgramLookup:
             )
         return result_dict_list
 
+    def count_summary_from_dataset(self, summary, n):
+        """
+        count documents of the whole training dataset containing each summary ngram,
+        from precomputed posting lengths in a single pass over the ngram table
+
+        Args:
+            summary: A String, summary generated from the document
+            n: An integer, the rank of the grams that are generated
+
+        Returns:
+            A List of dictionaries
+            Dictionary: {"ngram": Tuple, "case": int, "match_count": int}
+            - ngram: a tuple of word indices
+            - case: (one of the values of LookupCase), which category given query belongs to
+            - match_count: number of matched documents, 0 if no match
+        """
+        summary_indices = self.tokenizer.encode(summary, add_special_tokens=False)
+        sum_ngrams = [summary_indices[k:] for k in range(n)]
+        summary_ngrams = list(zip(*sum_ngrams))
+
+        queries = [self._query_ngram_int(ngram) for ngram in summary_ngrams]
+        table = self.ngrams_root[n]
+        rows = iter(
+            posting_rows(
+                table, [ngram_int for _, ngram_int in queries if ngram_int is not None]
+            )
+        )
+        doc_count = table.column("doc_count")
+
+        result_dict_list = []
+        for summary_ngram, (case, ngram_int) in zip(summary_ngrams, queries):
+            row = next(rows) if ngram_int is not None else None
+            if ngram_int is not None and row is None:
+                case = LookupCase.match_not_found.value
+            result_dict_list.append(
+                {
+                    "ngram": summary_ngram,
+                    "case": case,
+                    "match_count": doc_count[row].as_py() if row is not None else 0,
+                }
+            )
+        return result_dict_list
+
     def lookup_summary_from_document(self, summary, document, n):
         """
         lookup given summary from the given document
@@ -0,0 +1,183 @@
+"""
+Staged pipelines running every stage on its own background thread, i.e. tokenize -> generate -> decode,
+so a batch is tokenized and the previous batch decoded while the model generates.
+
+Stages are connected by bounded queues: a stage that is ahead blocks once its output queue is full,
+which bounds memory & keeps fast stages from running away. Every stage maps an item to any number
+of outputs (a generator function), items keep their order.
+
+    pipeline = Pipeline([("tokenize", tokenize), ("generate", generate), ("decode", decode)])
+    for output in pipeline.run(inputs):
+        ...
+    print(pipeline.report())
+
+The report shows per stage how long it was busy, waited for input (starved by the previous stage)
+and waited for output (blocked by the next stage), the stage with the most busy time is the bottleneck.
+Torch releases the GIL during inference, so threads overlap preprocessing & I/O with generation.
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, List, Tuple
+
+_DONE = object()
+# interval at which blocked stages check whether the pipeline was stopped
+_POLL_SECONDS = 0.1
+
+
+class _Error:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+class StageStats:
+    """
+    Busy & idle time of a pipeline stage
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.waiting_input = 0.0
+        self.waiting_output = 0.0
+
+    def __str__(self):
+        total = self.busy + self.waiting_input + self.waiting_output
+        busy_share = self.busy / total if total > 0 else 0.0
+        return (
+            f"{self.name}: {self.items} items, busy {self.busy:.1f}s ({busy_share:.0%}), "
+            f"waiting for input {self.waiting_input:.1f}s, waiting for output {self.waiting_output:.1f}s"
+        )
+
+
+class Pipeline:
+    """
+    Pipeline of stages, each running on its own thread
+    """
+
+    def __init__(
+        self,
+        stages: List[Tuple[str, Callable[[Any], Iterable[Any]]]],
+        queue_size: int = 2,
+    ):
+        """
+        Args:
+            stages: (name, function mapping an item to an iterable of outputs) per stage, in order
+            queue_size: maximum number of items waiting between two stages
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stats = [StageStats(name) for name, _ in stages]
+        self._stop = threading.Event()
+
+    def _put(self, output_queue: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                output_queue.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, input_queue: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return input_queue.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _feed(self, source: Iterable, output_queue: queue.Queue):
+        try:
+            for item in source:
+                if not self._put(output_queue, item):
+                    return
+            self._put(output_queue, _DONE)
+        except BaseException as e:
+            self._put(output_queue, _Error(e))
+
+    def _run_stage(
+        self,
+        fn: Callable[[Any], Iterable[Any]],
+        stats: StageStats,
+        input_queue: queue.Queue,
+        output_queue: queue.Queue,
+    ):
+        while True:
+            start = time.monotonic()
+            item = self._get(input_queue)
+            stats.waiting_input += time.monotonic() - start
+            if item is _DONE or isinstance(item, _Error):
+                self._put(output_queue, item)
+                return
+
+            try:
+                outputs = iter(fn(item))
+                while True:
+                    start = time.monotonic()
+                    try:
+                        output = next(outputs)
+                    except StopIteration:
+                        stats.busy += time.monotonic() - start
+                        break
+                    stats.busy += time.monotonic() - start
+
+                    start = time.monotonic()
+                    if not self._put(output_queue, output):
+                        return
+                    stats.waiting_output += time.monotonic() - start
+                stats.items += 1
+            except BaseException as e:
+                self._put(output_queue, _Error(e))
+                return
+
+    def run(self, source: Iterable) -> Iterator:
+        """
+        Run the items of source through the stages
+
+        Args:
+            source: iterable of inputs of the first stage, read on a background thread
+
+        Yields:
+            outputs of the last stage, in order
+
+        Raises:
+            the first exception raised by the source or a stage
+        """
+        self._stop.clear()
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [
+            threading.Thread(target=self._feed, args=(source, queues[0]), daemon=True)
+        ]
+        for i, ((_, fn), stats) in enumerate(zip(self.stages, self.stats)):
+            threads.append(
+                threading.Thread(
+                    target=self._run_stage,
+                    args=(fn, stats, queues[i], queues[i + 1]),
+                    daemon=True,
+                )
+            )
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _Error):
+                    raise item.exception
+                yield item
+        finally:
+            # stops the stages if the consumer stops early or a stage failed
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+    def report(self) -> str:
+        """
+        Per stage busy & idle time, see StageStats
+        """
+        return "\n".join(str(stats) for stats in self.stats)
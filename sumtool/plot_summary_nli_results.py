@@ -18,6 +18,8 @@ from transformers import pipeline
 from datasets import load_dataset
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 
+from sumtool import model_registry
+
 import seaborn as sns
 import matplotlib.pyplot as plt
 
@@ -164,11 +166,11 @@ def main():
     xsum_train = get_xsum_datapoints(n=args.n, shuffle=args.shuffle)
 
     # Load entailment models
-    nli_model = AutoModelForSequenceClassification.from_pretrained(
-        "typeform/distilbert-base-uncased-mnli"
+    nli_model = model_registry.get_model(
+        AutoModelForSequenceClassification, "typeform/distilbert-base-uncased-mnli"
     )
-    nli_tokenizer = AutoTokenizer.from_pretrained(
-        "typeform/distilbert-base-uncased-mnli"
+    nli_tokenizer = model_registry.get_tokenizer(
+        AutoTokenizer, "typeform/distilbert-base-uncased-mnli"
     )
 
     get_entailment_label = functools.partial(
@@ -0,0 +1,107 @@
+"""
+Dynamic int8 quantization of models for CPU inference.
+
+The weights of every torch.nn.Linear layer are quantized to int8 once and activations are quantized
+on the fly, which speeds up the linear layers of BART and the MNLI classifier on CPU at a small cost
+in accuracy (see scripts/compare_quantized_models.py).
+
+Quantized weights are cached, so the fp32 weights are only loaded on the first start:
+
+    /data/.quantized/<model-id>-dynamic-int8-<model class>-torch<version>.pt
+
+On later starts the model is built from its config, quantized & filled with the cached weights.
+Quantized models only run on CPU.
+"""
+
+import os
+from typing import Dict, Tuple
+
+import torch
+
+from sumtool import storage
+from sumtool.model_registry import build_from_config
+
+QUANTIZED_DIR = ".quantized"
+QUANTIZATION = "dynamic-int8"
+
+
+def quantized_model_id(model_id: str) -> str:
+    """
+    Id that results of a quantized model are stored under, apart from the fp32 results
+
+    Args:
+        model_id: huggingface model id, i.e. "facebook/bart-large-xsum"
+
+    Returns:
+        model id with the quantization as suffix
+    """
+    return f"{model_id}-{QUANTIZATION}"
+
+
+def quantized_path(model_class, model_id: str):
+    # quantized state dicts are specific to the model class (with or without its task head)
+    # and to the torch version that serialized them
+    return (
+        f"{storage.STORAGE_DIR}/{QUANTIZED_DIR}/"
+        f"{storage.slugify(quantized_model_id(model_id))}-"
+        f"{storage.slugify(model_class.__name__)}-torch{torch.__version__}.pt"
+    )
+
+
+def quantize(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Apply dynamic int8 quantization to the linear layers of a model
+
+    Args:
+        model: fp32 model, on CPU
+
+    Returns:
+        the quantized model
+    """
+    return torch.quantization.quantize_dynamic(
+        model.to("cpu").eval(), {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def load_quantized_model(model_class, model_id: str) -> torch.nn.Module:
+    """
+    Load a dynamically quantized model, from the cache of quantized weights if it exists
+
+    Args:
+        model_class: huggingface model class, i.e. BartForConditionalGeneration
+            or AutoModelForSequenceClassification
+        model_id: huggingface model id
+
+    Returns:
+        the quantized model, in eval mode on CPU
+    """
+    path = quantized_path(model_class, model_id)
+    if os.path.exists(path):
+        # the weights are overwritten by the cached ones, skip their random initialization
+        model = quantize(build_from_config(model_class, model_id))
+        model.load_state_dict(torch.load(path, map_location="cpu"))
+        return model.eval()
+
+    model = quantize(model_class.from_pretrained(model_id))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.save(model.state_dict(), f"{path}.{os.getpid()}.tmp")
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+    return model
+
+
+def stored_model(config, quantized: bool) -> Tuple[str, Dict]:
+    """
+    Model id & config dict that generated summaries are stored with
+
+    Args:
+        config: huggingface model config
+        quantized: whether the summaries were generated by the quantized model
+
+    Returns:
+        (model id, config dict)
+    """
+    model_config = config.to_dict()
+    if not quantized:
+        return config.name_or_path, model_config
+    model_config["quantization"] = QUANTIZATION
+    return quantized_model_id(config.name_or_path), model_config
@@ -13,6 +13,8 @@ from transformers import (
     AutoModelForQuestionAnswering,
 )
 
+from sumtool import model_registry
+
 
 class RoundTripConsistency:
     """Performs the round-trip consistency evaluation method from
@@ -25,31 +27,48 @@ class RoundTripConsistency:
     3. Question generation (mrm8488/t5-base-finetuned-question-generation-ap)
     """
 
-    # Model & tokenizer for answer extraction
-    # (pipeline is just a model and tokenizer combined)
-    ae_pipeline: pipeline
-    # Model & tokenizer for question-answering
-    qa_tokenizer: AutoTokenizer
-    qa_model: AutoModelForSeq2SeqLM
-    # Model & tokenizer for question generation
-    qg_tokenizer: AutoTokenizer
-    qg_model: AutoModelWithLMHead
+    # Models & tokenizers are loaded on first use & shared through the model registry
+    AE_MODEL_NAME = "celinelee/answer-extraction"
+    AE_TOKENIZER_NAME = "distilbert-base-uncased"
+    QA_MODEL_NAME = "valhalla/t5-small-qa-qg-hl"
+    QG_MODEL_NAME = "mrm8488/t5-base-finetuned-question-generation-ap"
 
     def __init__(self):
-        ae_model_name = "celinelee/answer-extraction"
-        ae_tokenizer = DistilBertTokenizer.from_pretrained("distilbert-base-uncased")
-        ae_model = AutoModelForQuestionAnswering.from_pretrained(ae_model_name)
-        self.ae_pipeline = pipeline(
-            "question-answering", model=ae_model, tokenizer=ae_tokenizer
-        )
-
-        qa_model_name = "valhalla/t5-small-qa-qg-hl"
-        self.qa_tokenizer = AutoTokenizer.from_pretrained(qa_model_name)
-        self.qa_model = AutoModelForSeq2SeqLM.from_pretrained(qa_model_name)
+        self._ae_pipeline = None
 
-        qg_model_name = "mrm8488/t5-base-finetuned-question-generation-ap"
-        self.qg_tokenizer = AutoTokenizer.from_pretrained(qg_model_name)
-        self.qg_model = AutoModelWithLMHead.from_pretrained(qg_model_name)
+    @property
+    def ae_pipeline(self) -> pipeline:
+        """Model & tokenizer for answer extraction
+        (pipeline is just a model and tokenizer combined)
+        """
+        ae_model = model_registry.get_model(
+            AutoModelForQuestionAnswering, self.AE_MODEL_NAME
+        )
+        # rebuilt if the registry evicted & reloaded the model
+        if self._ae_pipeline is None or self._ae_pipeline.model is not ae_model:
+            ae_tokenizer = model_registry.get_tokenizer(
+                DistilBertTokenizer, self.AE_TOKENIZER_NAME
+            )
+            self._ae_pipeline = pipeline(
+                "question-answering", model=ae_model, tokenizer=ae_tokenizer
+            )
+        return self._ae_pipeline
+
+    @property
+    def qa_tokenizer(self) -> AutoTokenizer:
+        return model_registry.get_tokenizer(AutoTokenizer, self.QA_MODEL_NAME)
+
+    @property
+    def qa_model(self) -> AutoModelForSeq2SeqLM:
+        return model_registry.get_model(AutoModelForSeq2SeqLM, self.QA_MODEL_NAME)
+
+    @property
+    def qg_tokenizer(self) -> AutoTokenizer:
+        return model_registry.get_tokenizer(AutoTokenizer, self.QG_MODEL_NAME)
+
+    @property
+    def qg_model(self) -> AutoModelWithLMHead:
+        return model_registry.get_model(AutoModelWithLMHead, self.QG_MODEL_NAME)
 
     def extract_answer(self, context: str) -> str:
         """Extract the answer from just the context. p(A | C)
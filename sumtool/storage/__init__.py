@@ -0,0 +1,574 @@
+import json
+import os
+from typing import Dict, Optional, Any, Iterator, List, Tuple
+import unicodedata
+import re
+
+from .summary_index import SummaryIndex, update_summary_index  # noqa: F401
+from .summary_log import open_summary_log
+from .reader import open_json_reader, select_fields
+from .cache import read_cache
+from .token_metadata import TokenMetadata, load_token_metadata
+from . import sqlite as sqlite_storage
+from . import sharded
+from . import compression
+
+STORAGE_DIR = "./data"
+
+# how summaries are written, stored summaries are readable regardless of this setting
+# - "json": one json file per model, rewritten on every write
+# - "log": append-only log per model, see summary_log.py
+# - "sqlite": one database in WAL mode for concurrent writers, see sqlite.py
+# - "sharded": summary logs hash-partitioned by document id, see sharded.py
+# a model already stored in a format that readers prefer keeps being written in that format
+STORAGE_BACKEND = os.environ.get("SUMTOOL_STORAGE_BACKEND", "json")
+
+# summary formats in the order readers prefer them, last first
+SUMMARY_FORMATS = ["json", "log", "sharded", "sqlite"]
+
+# files (or directories of sharded models) holding the summaries of a model
+SUMMARY_FILE_SUFFIXES = [
+    "-summaries.jsonl",
+    "-summaries.json",
+    "-shards",
+    "-summaries.jsonl.zst",
+    "-summaries.json.zst",
+]
+
+
+def dataset_dir(dataset: str):
+    return f"{STORAGE_DIR}/{dataset}"
+
+
+def model_path(dataset: str, model: str, ext):
+    return f"{dataset_dir(dataset)}/{slugify(model)}-{ext}"
+
+
+def summaries_path(dataset: str, model: str):
+    """
+    Path of the stored summaries of a model, shards take precedence over the summary log and json
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored summaries
+
+    Returns:
+        the path of the shard manifest, the summary log, the json file or their compressed files,
+        whichever exists first, otherwise the path of the json file
+    """
+    if sharded.is_sharded(dataset, model):
+        return sharded.manifest_path(dataset, model)
+    for ext in ["summaries.jsonl", "summaries.json"]:
+        for suffix in ["", compression.COMPRESSED_SUFFIX]:
+            path = model_path(dataset, model, ext) + suffix
+            if os.path.exists(path):
+                return path
+    return model_path(dataset, model, "summaries.json")
+
+
+def _summary_format(dataset: str, model: str) -> str:
+    """
+    Format that summaries of a model are written in, STORAGE_BACKEND unless the model
+    is already stored in a format that readers prefer, which would shadow the written summaries
+    """
+    if sqlite_storage.has_model(dataset, model):
+        stored = "sqlite"
+    elif sharded.is_sharded(dataset, model):
+        stored = "sharded"
+    elif summaries_path(dataset, model).endswith(".jsonl"):
+        stored = "log"
+    else:
+        stored = "json"
+    backend = STORAGE_BACKEND if STORAGE_BACKEND in SUMMARY_FORMATS else "json"
+    return max(backend, stored, key=SUMMARY_FORMATS.index)
+
+
+def slugify(value: str, allow_unicode: bool = False):
+    """
+    For a given string convert slashes, spaces or repeated dashes to single dashes.
+    Removes characters that aren't alphanumerics, underscores, or hyphens.
+    Converts to lowercase.
+    Strip leading and trailing whitespace, dashes, and underscores.
+
+    Taken from https://github.com/django/django/blob/master/django/utils/text.py
+
+    Args:
+        value: the string to slugify
+        allow_unicode: Convert to ASCII if 'allow_unicode' is False.
+
+    Returns:
+        the slugified string
+    """
+    value = str(value).replace("/", "-")
+    if allow_unicode:
+        value = unicodedata.normalize("NFKC", value)
+    else:
+        value = (
+            unicodedata.normalize("NFKD", value)
+            .encode("ascii", "ignore")
+            .decode("ascii")
+        )
+    value = re.sub(r"[^\w\s-]", "", value.lower())
+    return re.sub(r"[-\s]+", "-", value).strip("-_")
+
+
+def store_model_config(dataset: str, model: str, model_config: dict):
+    if STORAGE_BACKEND == "sqlite" or sqlite_storage.has_model(dataset, model):
+        sqlite_storage.store_model_config(dataset, model, model_config)
+        return
+
+    model_config["sumtool_model"] = slugify(model)
+    model_config_json = json.dumps(model_config, sort_keys=True, indent=2)
+
+    dir = f"{dataset_dir(dataset)}/"
+    path = model_path(dataset, model, "config.json")
+
+    if not os.path.exists(path):
+        os.makedirs(dir, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(model_config_json)
+
+
+def store_model_summaries(
+    dataset: str,
+    model: str,
+    model_config: Dict,
+    generated_summaries: Dict[str, str],
+    metadata: Optional[Dict[str, Any]] = {},
+):
+    """
+    Stores model summaries, indexed by dataset, model name & document id
+
+    If the storage already has a summary for this document id and model config, it will overwrite it.
+    Otherwise summaries are appended to the storage.
+
+    With STORAGE_BACKEND = "log", records are appended to /data/<dataset>/<model-id>-summaries.jsonl
+    instead of rewriting the json file (see summary_log.py).
+    With STORAGE_BACKEND = "sqlite", records are upserted in one transaction (see sqlite.py).
+    With STORAGE_BACKEND = "sharded", records are appended to the shards of their documents
+    in /data/<dataset>/<model-id>-shards/ (see sharded.py).
+    Models already stored as log, shards or sqlite keep their format (see SUMMARY_FORMATS),
+    so a json write never lands in a file that readers ignore.
+
+    Ex. /data/bert-base-summaries.json
+
+    {
+        "<document-id>": {
+            "summary": "this is awesome",
+            "metadata": {
+                "tokens_ids": [1, 2, 3]",
+                "token_entropy": [0.5, 0.3, 0.2]
+            }
+        }
+    }
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: unique name of the model/paper that was used to generate the summary (in huggingface model.config.name_or_path)
+        model_config:
+            dictionary of the config that was used to generate the summary (in huggingface serialize using model.config.to_dict())
+            if the model config is not available, but it was generated by a known paper this dict can reference the paper
+        generated_summaries: dictionary of document id -> summary
+        metadata: optional dict containing metadata for the generated summaries, for example token ids & entropy
+
+    """
+
+    store_model_config(dataset, model, model_config)
+    if summaries_path(dataset, model).endswith(compression.COMPRESSED_SUFFIX):
+        # cold data is written to again, see compression.py
+        compression.decompress_file(summaries_path(dataset, model))
+    records = {
+        str(document_id): {
+            "summary": summary,
+            "metadata": metadata[document_id] if document_id in metadata else {},
+        }
+        for document_id, summary in generated_summaries.items()
+    }
+
+    summary_format = _summary_format(dataset, model)
+    if summary_format == "log":
+        _store_summary_log_records(dataset, model, records)
+    elif summary_format == "sharded":
+        _store_summary_sharded_records(dataset, model, records)
+    elif summary_format == "sqlite":
+        # first sqlite write for a model stored as json, log or shards, carry over its summaries
+        sqlite_storage.store_summary_records(
+            dataset,
+            model,
+            records,
+            carry_over=lambda: _carried_over_summaries(dataset, model),
+        )
+    else:
+        _store_summary_json_records(dataset, model, records)
+
+    read_cache.invalidate(("summaries", dataset, slugify(model)))
+    update_summary_index(dataset, model, generated_summaries)
+
+
+def _store_summary_json_records(dataset: str, model: str, records: Dict[str, Dict]):
+    dir = dataset_dir(dataset)
+    path = model_path(dataset, model, "summaries.json")
+
+    if not os.path.exists(path):
+        os.makedirs(dir, exist_ok=True)
+        stored_summaries = {}
+    else:
+        with open(path, "r") as f:
+            stored_summaries = json.load(f)
+
+    stored_summaries.update(records)
+
+    with open(path, "w") as f:
+        f.write(json.dumps(stored_summaries, indent=2))
+
+
+def _store_summary_log_records(dataset: str, model: str, records: Dict[str, Dict]):
+    summary_log = open_summary_log(model_path(dataset, model, "summaries.jsonl"))
+    json_path = model_path(dataset, model, "summaries.json")
+
+    if not os.path.exists(summary_log.path) and os.path.exists(json_path):
+        # first log write for a model stored as json, carry over its summaries
+        with open(json_path, "r") as f:
+            summary_log.append(json.load(f))
+
+    summary_log.append(records)
+
+
+def _store_summary_sharded_records(dataset: str, model: str, records: Dict[str, Dict]):
+    if not sharded.is_sharded(dataset, model) and os.path.exists(
+        summaries_path(dataset, model)
+    ):
+        # first sharded write for a model stored as json or log, carry over its summaries
+        sharded.store_summary_records(
+            dataset, model, dict(iter_summaries(dataset, model))
+        )
+    sharded.store_summary_records(dataset, model, records)
+
+
+def store_summary_metrics(
+    dataset: str,
+    model: str,
+    summary_metrics: Dict[str, Dict[str, Any]],
+):
+    """
+    Stores summary metrics, indexed by dataset, model, model config hash & document id
+
+    If the storage already has metrics for this document id and model config,
+    it will update similar to a PUT request.
+    Otherwise metrics are appended to the storage.
+
+    Ex. /data/bert-base-metrics.json
+
+    {
+        "<model-config-hash>": {
+            "<document-id>": {
+                "bert-score": 0.5,
+                "rouge-score": 0.5,
+                "entailment": {
+                    ...
+                }
+            }
+        }
+    }
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: identifier of the model that was used to generate the summary
+        summary_metrics: dictionary of document id -> {...summary metrics}
+
+    """
+
+    read_cache.invalidate(("metrics", dataset, slugify(model)))
+    dir = dataset_dir(dataset)
+    path = model_path(dataset, model, "metrics.json")
+
+    if STORAGE_BACKEND == "sqlite" or sqlite_storage.has_metrics(dataset, model):
+        # first sqlite write for a model with json metrics, carry over its metrics
+        sqlite_storage.store_summary_metrics(
+            dataset,
+            model,
+            summary_metrics,
+            carry_over=lambda: _carried_over_metrics(dataset, model),
+        )
+        return
+
+    if not os.path.exists(path):
+        os.makedirs(dir, exist_ok=True)
+        stored_summaries = {}
+    else:
+        with open(path, "r") as f:
+            stored_summaries = json.load(f)
+
+    for document_id, updated_metrics in summary_metrics.items():
+        if document_id in stored_summaries:
+            for key, value in updated_metrics.items():
+                stored_summaries[document_id][key] = value
+        else:
+            stored_summaries[document_id] = updated_metrics
+
+    with open(path, "w") as f:
+        f.write(json.dumps(stored_summaries, indent=2))
+
+
+def get_datasets():
+    # hidden files & directories hold derived data or databases, i.e. the columnar mirror
+    datasets = {x for x in os.listdir(STORAGE_DIR) if not x.startswith(".")}
+    return sorted(datasets | set(sqlite_storage.get_datasets()))
+
+
+def get_models(dataset: str):
+    models = set(sqlite_storage.get_models(dataset))
+    if not os.path.isdir(dataset_dir(dataset)):
+        return sorted(models)
+    for x in os.listdir(dataset_dir(dataset)):
+        for suffix in SUMMARY_FILE_SUFFIXES:
+            if x.endswith(suffix):
+                models.add(x[: -len(suffix)])
+    return sorted(models)
+
+
+def json_reader(dataset: str, model: str, ext: str):
+    """
+    Streaming & random-access reader of a json storage file, see reader.py
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored summaries
+        ext: file suffix, i.e. "summaries.json" or "metrics.json"
+
+    Returns:
+        JsonRecordReader with its offsets sidecar under /data/<dataset>/index/
+    """
+    return open_json_reader(
+        model_path(dataset, model, ext),
+        f"{dataset_dir(dataset)}/index/{slugify(model)}-{ext}.offsets.json",
+    )
+
+
+def _cache_paths(dataset: str, model: str, ext: str):
+    paths = [model_path(dataset, model, ext)]
+    in_sqlite = (
+        sqlite_storage.has_model(dataset, model)
+        if ext == "summaries.json"
+        else sqlite_storage.has_metrics(dataset, model)
+    )
+    if in_sqlite:
+        # the database is shared by all models, so only models stored in it depend on it.
+        # models moving into the database get a longer path list, which invalidates their entry
+        db_path = sqlite_storage.db_path()
+        paths += [db_path, db_path + "-wal"]
+    if ext == "summaries.json":
+        paths.append(model_path(dataset, model, "summaries.jsonl"))
+        paths.append(sharded.manifest_path(dataset, model))
+        paths.append(summaries_path(dataset, model))
+    return paths
+
+
+def get_summaries(dataset: str, model: str):
+    """
+    Get all stored summaries of a model, cached until their storage files change
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored summaries
+
+    Returns:
+        dictionary of document id -> {"summary": ..., "metadata": ...}, shared and read-only
+    """
+    return read_cache.get(
+        ("summaries", dataset, slugify(model)),
+        _cache_paths(dataset, model, "summaries.json"),
+        lambda: _load_summaries(dataset, model),
+    )
+
+
+def _load_summaries(dataset: str, model: str):
+    if sqlite_storage.has_model(dataset, model):
+        return sqlite_storage.get_summaries(dataset, model)
+    return _load_file_summaries(dataset, model)
+
+
+def _load_file_summaries(dataset: str, model: str):
+    """
+    Summaries of a model stored as json, log or shards
+    """
+    if sharded.is_sharded(dataset, model):
+        return dict(sharded.iter_summaries(dataset, model))
+    path = summaries_path(dataset, model)
+    if path.endswith(compression.COMPRESSED_SUFFIX):
+        return compression.load_records(path)
+    if path.endswith(".jsonl"):
+        return dict(open_summary_log(path).items())
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _carried_over_summaries(dataset: str, model: str):
+    if not sharded.is_sharded(dataset, model) and not os.path.exists(
+        summaries_path(dataset, model)
+    ):
+        return {}
+    return _load_file_summaries(dataset, model)
+
+
+def _carried_over_metrics(dataset: str, model: str):
+    path = model_path(dataset, model, "metrics.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def iter_summaries(
+    dataset: str, model: str, fields: Optional[List[str]] = None
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Stream the stored summaries of a model one document at a time
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored summaries
+        fields: dotted fields to read, i.e. ["summary", "metadata.mean_worker_factuality_score"]
+            to skip "metadata.tokens_with_entropy", None for whole records
+
+    Yields:
+        (document id, {"summary": ..., "metadata": ...})
+    """
+    if sqlite_storage.has_model(dataset, model):
+        records = sqlite_storage.iter_summaries(dataset, model)
+    elif sharded.is_sharded(dataset, model):
+        records = sharded.iter_summaries(dataset, model)
+    elif summaries_path(dataset, model).endswith(compression.COMPRESSED_SUFFIX):
+        records = get_summaries(dataset, model).items()
+    elif summaries_path(dataset, model).endswith(".jsonl"):
+        records = open_summary_log(summaries_path(dataset, model)).items()
+    else:
+        yield from json_reader(dataset, model, "summaries.json").iter(fields)
+        return
+    for document_id, record in records:
+        yield document_id, select_fields(record, fields)
+
+
+def get_summary_ids(dataset: str, model: str) -> List[str]:
+    """
+    Get the ids of all documents with a stored summary, without reading the summaries
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored summaries
+
+    Returns:
+        list of document ids
+    """
+    if sqlite_storage.has_model(dataset, model):
+        return [
+            document_id
+            for document_id, _ in sqlite_storage.iter_summaries(dataset, model)
+        ]
+    if sharded.is_sharded(dataset, model):
+        return sharded.document_ids(dataset, model)
+    path = summaries_path(dataset, model)
+    if path.endswith(compression.COMPRESSED_SUFFIX):
+        return list(get_summaries(dataset, model).keys())
+    if path.endswith(".jsonl"):
+        return open_summary_log(path).document_ids()
+    return json_reader(dataset, model, "summaries.json").document_ids()
+
+
+def get_summary(
+    dataset: str, model: str, document_id: str, fields: Optional[List[str]] = None
+):
+    """
+    Get the stored summary of a single document, without parsing the other summaries
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored summaries
+        document_id: id of the summarized document
+        fields: dotted fields to read, None for the whole record
+
+    Returns:
+        {"summary": ..., "metadata": ...} or None if the document has no stored summary
+    """
+    if sqlite_storage.has_model(dataset, model):
+        record = sqlite_storage.get_summary(dataset, model, document_id)
+    elif sharded.is_sharded(dataset, model):
+        record = sharded.get_summary(dataset, model, document_id)
+    elif summaries_path(dataset, model).endswith(compression.COMPRESSED_SUFFIX):
+        record = get_summaries(dataset, model).get(str(document_id))
+    elif summaries_path(dataset, model).endswith(".jsonl"):
+        record = open_summary_log(summaries_path(dataset, model)).get(document_id)
+    else:
+        return json_reader(dataset, model, "summaries.json").get(document_id, fields)
+    return select_fields(record, fields) if record is not None else None
+
+
+def get_summary_metrics(dataset: str, model: str):
+    """
+    Get all stored metrics of a model, cached until their storage files change
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored metrics
+
+    Returns:
+        dictionary of document id -> {...summary metrics}, shared and read-only
+    """
+    return read_cache.get(
+        ("metrics", dataset, slugify(model)),
+        _cache_paths(dataset, model, "metrics.json"),
+        lambda: _load_summary_metrics(dataset, model),
+    )
+
+
+def _load_summary_metrics(dataset: str, model: str):
+    if sqlite_storage.has_metrics(dataset, model):
+        return sqlite_storage.get_summary_metrics(dataset, model)
+    with open(f"{dataset_dir(dataset)}/{model}-metrics.json", "r") as f:
+        return json.load(f)
+
+
+def iter_summary_metrics(
+    dataset: str, model: str, fields: Optional[List[str]] = None
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Stream the stored metrics of a model one document at a time
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored metrics
+        fields: dotted metric names to read, None for all metrics
+
+    Yields:
+        (document id, {...summary metrics})
+    """
+    if sqlite_storage.has_metrics(dataset, model):
+        for document_id, metrics in sqlite_storage.get_summary_metrics(
+            dataset, model
+        ).items():
+            yield document_id, select_fields(metrics, fields)
+        return
+    yield from json_reader(dataset, model, "metrics.json").iter(fields)
+
+
+def get_token_metadata(
+    dataset: str, model: str, document_id: str
+) -> Optional[TokenMetadata]:
+    """
+    Get the binary per-token metadata of a stored summary, see token_metadata.py
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored summaries
+        document_id: id of the summarized document
+
+    Returns:
+        lazily decoded TokenMetadata, None if the summary has none
+    """
+    record = get_summary(
+        dataset, model, document_id, fields=["metadata.token_metadata"]
+    )
+    reference = (record or {}).get("metadata", {}).get("token_metadata")
+    if reference is None:
+        return None
+    return load_token_metadata(dataset, model, reference)
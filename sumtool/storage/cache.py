@@ -0,0 +1,127 @@
+"""
+Process-wide read cache for sumtool.storage.
+
+Parsed summaries & metrics are kept per (kind, dataset, model) together with the os.stat
+(mtime, size) of the files they were read from. A cached value is served only while those
+files are unchanged, so writes by other processes are picked up on the next read, and
+writes through the storage API invalidate their entries right away.
+
+Entries are evicted least recently used first, once there are more than MAX_ENTRIES
+or the stored files they were parsed from add up to more than MAX_BYTES.
+
+Cached values are shared between callers and must not be mutated.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List
+
+MAX_ENTRIES = 64
+MAX_BYTES = 1 << 30
+
+
+def _file_stats(paths: List[str]):
+    stats = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stats.append(None)
+    return tuple(stats)
+
+
+class ReadCache:
+    """
+    LRU cache of parsed storage reads, validated by the stat of their source files
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (file stats, size in bytes, value)
+        self.entries: OrderedDict = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, paths: List[str], load: Callable[[], Any]) -> Any:
+        """
+        Get a cached value, (re)loading it if missing or if its source files changed
+
+        Args:
+            key: cache key, i.e. ("summaries", dataset, model)
+            paths: files the value is read from
+            load: function reading the value from storage
+
+        Returns:
+            the cached or freshly loaded value
+        """
+        stats = _file_stats(paths)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stats:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        value = load()
+        size = sum(stat[1] for stat in stats if stat is not None)
+        with self._lock:
+            self._remove(key)
+            self.entries[key] = (stats, size, value)
+            self.size += size
+            self._evict()
+        return value
+
+    def _remove(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def _evict(self):
+        while len(self.entries) > 1 and (
+            len(self.entries) > self.max_entries or self.size > self.max_bytes
+        ):
+            _, (_, size, _) = self.entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def invalidate(self, *keys: Hashable):
+        """
+        Drop cached values, i.e. after writing their files
+
+        Args:
+            keys: cache keys to drop
+        """
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Cache counters
+
+        Returns:
+            dictionary of hits, misses, evictions, entries & bytes
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
+
+
+read_cache = ReadCache()
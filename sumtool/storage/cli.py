@@ -0,0 +1,506 @@
+"""
+Storage maintenance commands, run with python -m sumtool.storage <command>
+
+- stats: storage format & number of summaries of every model
+- migrate: convert models between the json, log, sharded & sqlite formats
+- compact: drop superseded records of summary logs, shards & token metadata,
+  vacuum the sqlite database
+- compress / decompress: zstd (de)compress cold json & log summary files
+- verify: check files against the per-dataset checksums.json (sha256, size & record count),
+  --update records the current state. Also runs the sqlite database's integrity check
+
+Records are streamed in batches, so migrating & verifying large stores runs in bounded memory.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sumtool import storage
+from . import compression, sharded
+from . import sqlite as sqlite_storage
+from .reader import scan_offsets
+from .summary_log import SummaryLog, open_summary_log
+from .token_metadata import compact_token_metadata, token_metadata_path
+
+FORMATS = ["json", "log", "sharded", "sqlite"]
+CHECKSUMS_FILE = "checksums.json"
+BATCH_SIZE = 1000
+# derived data, rebuilt from the storage files when missing
+DERIVED_DIRS = ["index"]
+
+
+def storage_format(dataset: str, model: str) -> Optional[str]:
+    """
+    Format the summaries of a model are read from
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+
+    Returns:
+        one of "sqlite", "sharded", "compressed", "log", "json", None if the model is not stored
+    """
+    if sqlite_storage.has_model(dataset, model):
+        return "sqlite"
+    if sharded.is_sharded(dataset, model):
+        return "sharded"
+    path = storage.summaries_path(dataset, model)
+    if path.endswith(compression.COMPRESSED_SUFFIX):
+        return "compressed"
+    if path.endswith(".jsonl"):
+        return "log"
+    if os.path.exists(path):
+        return "json"
+    return None
+
+
+def count_summaries(dataset: str, model: str) -> int:
+    fmt = storage_format(dataset, model)
+    if fmt == "sqlite":
+        return sqlite_storage.count_summaries(dataset, model)
+    if fmt is None:
+        return 0
+    return len(storage.get_summary_ids(dataset, model))
+
+
+def _batches(records: Iterator[Tuple[str, Dict]], batch_size: int):
+    batch = {}
+    for document_id, record in records:
+        batch[document_id] = record
+        if len(batch) >= batch_size:
+            yield batch
+            batch = {}
+    if len(batch) > 0:
+        yield batch
+
+
+def _write_json_stream(path: str, records: Iterator[Tuple[str, Dict]]) -> int:
+    # same layout as json.dumps(summaries, indent=2), one record at a time
+    count = 0
+    with open(path + ".migrate", "w") as f:
+        f.write("{")
+        for document_id, record in records:
+            f.write("\n" if count == 0 else ",\n")
+            f.write(json.dumps({document_id: record}, indent=2)[2:-2])
+            count += 1
+        f.write("\n}" if count > 0 else "}")
+    os.replace(path + ".migrate", path)
+    return count
+
+
+def _write_log_stream(path: str, records: Iterator[Tuple[str, Dict]]) -> int:
+    count = 0
+    with open(path + ".migrate", "wb") as f:
+        for document_id, record in records:
+            f.write(SummaryLog._encode(document_id, record))
+            count += 1
+    os.replace(path + ".migrate", path)
+    return count
+
+
+def _model_config(dataset: str, model: str) -> Optional[Dict]:
+    if sqlite_storage.has_model(dataset, model):
+        return sqlite_storage.get_model_config(dataset, model)
+    path = storage.model_path(dataset, model, "config.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _retire(path: str):
+    # keeps the latest retired version only
+    if not os.path.exists(path):
+        return
+    if os.path.isdir(path + ".bak"):
+        shutil.rmtree(path + ".bak")
+    os.replace(path, path + ".bak")
+
+
+def migrate(
+    dataset: str,
+    model: str,
+    to: str,
+    batch_size: int = BATCH_SIZE,
+    keep_source: bool = False,
+    num_shards: int = sharded.DEFAULT_NUM_SHARDS,
+):
+    """
+    Convert the stored summaries (and config) of a model to another storage format,
+    metrics are moved along to & from the sqlite database
+
+    The source is retired once the number of migrated records is verified:
+    files are renamed to <path>.bak, sqlite rows are deleted.
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+        to: target format, one of FORMATS
+        batch_size: number of records written per batch
+        keep_source: keep the source as is, it shadows targets with a lower precedence
+        num_shards: number of shards when migrating to "sharded"
+
+    Raises:
+        ValueError: if the model is not stored, is compressed or the target format is unknown
+        RuntimeError: if the number of migrated records does not match the source
+    """
+    if to not in FORMATS:
+        raise ValueError(f"unknown storage format: {to}, expected one of {FORMATS}")
+    source = storage_format(dataset, model)
+    if source is None:
+        raise ValueError(f"no stored summaries for {dataset}/{model}")
+    if source == "compressed":
+        raise ValueError(f"{dataset}/{model} is compressed, decompress it first")
+    if source == to:
+        print(f"{dataset}/{model}: already stored as {to}")
+        return
+
+    model = storage.slugify(model)
+    model_config = _model_config(dataset, model)
+    records = storage.iter_summaries(dataset, model)
+
+    if to == "json":
+        count = _write_json_stream(
+            storage.model_path(dataset, model, "summaries.json"), records
+        )
+    elif to == "log":
+        count = _write_log_stream(
+            storage.model_path(dataset, model, "summaries.jsonl"), records
+        )
+    else:
+        count = 0
+        for batch in _batches(records, batch_size):
+            if to == "sharded":
+                sharded.store_summary_records(dataset, model, batch, num_shards)
+            else:
+                sqlite_storage.store_summary_records(dataset, model, batch)
+            count += len(batch)
+
+    if to == "sqlite":
+        if model_config is not None:
+            sqlite_storage.store_model_config(dataset, model, model_config)
+        metrics_path = storage.model_path(dataset, model, "metrics.json")
+        if os.path.exists(metrics_path):
+            for batch in _batches(
+                storage.iter_summary_metrics(dataset, model), batch_size
+            ):
+                sqlite_storage.store_summary_metrics(dataset, model, batch)
+    elif source == "sqlite":
+        if model_config is not None:
+            with open(storage.model_path(dataset, model, "config.json"), "w") as f:
+                f.write(json.dumps(model_config, sort_keys=True, indent=2))
+        if sqlite_storage.has_metrics(dataset, model):
+            _write_json_stream(
+                storage.model_path(dataset, model, "metrics.json"),
+                iter(sqlite_storage.get_summary_metrics(dataset, model).items()),
+            )
+
+    stored = _count_format(dataset, model, to)
+    if stored != count:
+        raise RuntimeError(
+            f"{dataset}/{model}: migrated {count} records but {stored} are stored as {to}, source kept"
+        )
+
+    if not keep_source:
+        if source == "sqlite":
+            sqlite_storage.delete_model(dataset, model)
+        elif source == "sharded":
+            _retire(sharded.shards_dir(dataset, model))
+        elif source == "log":
+            _retire(storage.model_path(dataset, model, "summaries.jsonl"))
+        else:
+            _retire(storage.model_path(dataset, model, "summaries.json"))
+        if to == "sqlite":
+            _retire(storage.model_path(dataset, model, "metrics.json"))
+    elif storage_format(dataset, model) != to:
+        print(f"{dataset}/{model}: {source} is kept and still read before {to}")
+
+    storage.read_cache.invalidate(
+        ("summaries", dataset, model), ("metrics", dataset, model)
+    )
+    print(f"{dataset}/{model}: migrated {count} records from {source} to {to}")
+
+
+def _count_format(dataset: str, model: str, fmt: str) -> int:
+    if fmt == "sqlite":
+        return sqlite_storage.count_summaries(dataset, model)
+    if fmt == "sharded":
+        return len(sharded.document_ids(dataset, model))
+    if fmt == "log":
+        return len(SummaryLog(storage.model_path(dataset, model, "summaries.jsonl")))
+    return len(scan_offsets(storage.model_path(dataset, model, "summaries.json"))[0])
+
+
+def _size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(_size(f"{path}/{x}") for x in os.listdir(path))
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def compact(dataset: str, model: str):
+    """
+    Rewrite the summary log or shards of a model with only the latest record of every document,
+    and its token metadata file with only the records its summaries reference
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+    """
+    # first, it stores the summaries again with their new references,
+    # which the log compaction below drops the earlier records of
+    sizes = compact_token_metadata(dataset, model)
+    if sizes is not None:
+        print(
+            f"{dataset}/{model}: compacted token metadata {sizes[0]} -> {sizes[1]} bytes"
+        )
+    elif os.path.exists(token_metadata_path(dataset, model)):
+        print(
+            f"{dataset}/{model}: token metadata not compacted, it has unstored records"
+        )
+
+    fmt = storage_format(dataset, model)
+    if fmt == "log":
+        paths = [storage.summaries_path(dataset, model)]
+    elif fmt == "sharded":
+        paths = [p for p in sharded.shard_paths(dataset, model) if os.path.exists(p)]
+    else:
+        return
+
+    before = sum(_size(p) for p in paths)
+    for path in paths:
+        open_summary_log(path).compact()
+    after = sum(_size(p) for p in paths)
+    print(f"{dataset}/{model}: compacted {fmt} {before} -> {after} bytes")
+
+
+def vacuum():
+    """
+    Checkpoint the WAL & vacuum the sqlite storage database
+    """
+    if not os.path.exists(sqlite_storage.db_path()):
+        return
+    connection = sqlite_storage.connect()
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    connection.execute("VACUUM")
+
+
+def compress(dataset: str, model: str, level: int = compression.DEFAULT_LEVEL):
+    """
+    zstd compress the json or log summaries of a model, which stay readable
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+        level: zstd compression level
+    """
+    if storage_format(dataset, model) not in ["json", "log"]:
+        return
+    path = storage.summaries_path(dataset, model)
+    before = _size(path)
+    compressed_path = compression.compress_file(path, level)
+    print(f"{dataset}/{model}: compressed {before} -> {_size(compressed_path)} bytes")
+
+
+def decompress(dataset: str, model: str):
+    if storage_format(dataset, model) == "compressed":
+        compression.decompress_file(storage.summaries_path(dataset, model))
+        print(f"{dataset}/{model}: decompressed")
+
+
+def file_checksum(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def count_records(path: str) -> Optional[int]:
+    """
+    Number of documents in a summaries, metrics or shard file
+
+    Args:
+        path: storage file path
+
+    Returns:
+        number of documents, None for other files
+    """
+    name = os.path.basename(path)
+    if name.endswith(compression.COMPRESSED_SUFFIX):
+        # streamed, compressed files are cold data and may not fit in memory decompressed
+        name = name[: -len(compression.COMPRESSED_SUFFIX)]
+        with compression.open_compressed(path) as f:
+            if name.endswith(".jsonl"):
+                return _count_log_records(f)
+            if name.endswith("-summaries.json") or name.endswith("-metrics.json"):
+                return len(scan_offsets(path, f)[0])
+        return None
+    if name.endswith(".jsonl"):
+        return len(SummaryLog(path))
+    if name.endswith("-summaries.json") or name.endswith("-metrics.json"):
+        return len(scan_offsets(path)[0])
+    return None
+
+
+def _count_log_records(f) -> int:
+    # distinct document ids of the complete lines of a summary log stream
+    document_ids = set()
+    pending = b""
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        document_ids.update(line.partition(b"\t")[0] for line in lines)
+    return len(document_ids)
+
+
+def _storage_files(dataset: str) -> List[str]:
+    root = storage.dataset_dir(dataset)
+    files = []
+    for dir, dirs, names in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not (dir == root and d in DERIVED_DIRS))
+        for name in sorted(names):
+            if name == CHECKSUMS_FILE or name.endswith((".tmp", ".lock")):
+                continue
+            files.append(os.path.relpath(f"{dir}/{name}", root))
+    return files
+
+
+def verify_database() -> List[str]:
+    """
+    Check the integrity of the sqlite storage database, which is shared by all datasets
+    and changes with every write, so it has no checksum
+
+    Returns:
+        list of problems, empty if the database is ok or does not exist
+    """
+    if not os.path.exists(sqlite_storage.db_path()):
+        return []
+    rows = sqlite_storage.connect().execute("PRAGMA integrity_check").fetchall()
+    return [
+        f"{sqlite_storage.DB_FILE}: {message}" for (message,) in rows if message != "ok"
+    ]
+
+
+def verify(dataset: str, update: bool = False) -> List[str]:
+    """
+    Check the storage files of a dataset against its checksums.json
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        update: record the current sha256, size & record count of every file instead
+
+    Returns:
+        list of problems, empty if all files match
+    """
+    checksums_path = f"{storage.dataset_dir(dataset)}/{CHECKSUMS_FILE}"
+    current = {}
+    for file in _storage_files(dataset):
+        path = f"{storage.dataset_dir(dataset)}/{file}"
+        current[file] = {
+            "sha256": file_checksum(path),
+            "size": os.path.getsize(path),
+            "records": count_records(path),
+        }
+
+    if update:
+        with open(checksums_path, "w") as f:
+            f.write(json.dumps(current, sort_keys=True, indent=2))
+        return []
+
+    if not os.path.exists(checksums_path):
+        return [f"{dataset}: no {CHECKSUMS_FILE}, run verify --update first"]
+    with open(checksums_path, "r") as f:
+        expected = json.load(f)
+
+    problems = []
+    for file, checksum in expected.items():
+        if file not in current:
+            problems.append(f"{dataset}/{file}: missing")
+        elif current[file]["records"] != checksum["records"]:
+            problems.append(
+                f"{dataset}/{file}: {current[file]['records']} records, expected {checksum['records']}"
+            )
+        elif current[file]["sha256"] != checksum["sha256"]:
+            problems.append(f"{dataset}/{file}: checksum mismatch")
+    for file in current:
+        if file not in expected:
+            problems.append(f"{dataset}/{file}: not in {CHECKSUMS_FILE}")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m sumtool.storage", description="sumtool storage maintenance"
+    )
+    parser.add_argument("--storage_dir", type=str, default=storage.STORAGE_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_command(name, help):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("--dataset", type=str, help="defaults to all datasets")
+        command.add_argument("--model", type=str, help="defaults to all models")
+        return command
+
+    add_command("stats", "storage format & number of summaries per model")
+    command = add_command("migrate", "convert models to another storage format")
+    command.add_argument("--to", type=str, required=True, choices=FORMATS)
+    command.add_argument("--batch_size", type=int, default=BATCH_SIZE)
+    command.add_argument("--num_shards", type=int, default=sharded.DEFAULT_NUM_SHARDS)
+    command.add_argument("--keep_source", action="store_true")
+    add_command(
+        "compact",
+        "drop superseded summary & token metadata records, vacuum the sqlite database",
+    )
+    command = add_command("compress", "zstd compress json & log summary files")
+    command.add_argument("--level", type=int, default=compression.DEFAULT_LEVEL)
+    add_command("decompress", "decompress zstd compressed summary files")
+    command = add_command(
+        "verify", f"check files against {CHECKSUMS_FILE} & the sqlite database"
+    )
+    command.add_argument("--update", action="store_true")
+
+    args = parser.parse_args(argv)
+    storage.STORAGE_DIR = args.storage_dir
+
+    datasets = [args.dataset] if args.dataset else storage.get_datasets()
+    if args.command == "verify":
+        problems = verify_database()
+        for dataset in datasets:
+            problems.extend(verify(dataset, args.update))
+        for problem in problems:
+            print(problem)
+        if len(problems) > 0:
+            sys.exit(1)
+        print("ok")
+        return
+
+    for dataset in datasets:
+        models = [args.model] if args.model else storage.get_models(dataset)
+        for model in models:
+            if args.command == "stats":
+                print(
+                    f"{dataset}/{model}: {storage_format(dataset, model)}, "
+                    f"{count_summaries(dataset, model)} summaries"
+                )
+            elif args.command == "migrate":
+                migrate(
+                    dataset,
+                    model,
+                    args.to,
+                    args.batch_size,
+                    args.keep_source,
+                    args.num_shards,
+                )
+            elif args.command == "compact":
+                compact(dataset, model)
+            elif args.command == "compress":
+                compress(dataset, model, args.level)
+            elif args.command == "decompress":
+                decompress(dataset, model)
+    if args.command == "compact":
+        vacuum()
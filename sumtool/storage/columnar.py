@@ -0,0 +1,365 @@
+"""
+Columnar (Arrow/Parquet) mirror of stored summaries, metadata & metrics for analysis.
+
+Every model is stored as one parquet file per table, hive-partitioned by dataset and model:
+
+    /data/.columnar/<table>/dataset=<dataset>/model=<model-id>/part-0.parquet
+
+- summaries: document_id, summary
+- metadata: document_id, one column per (flattened) metadata field
+- metrics: document_id, one column per (flattened) metric, i.e. entails_prob
+
+Nested dicts are flattened into "parent.child" columns, lists are stored as json strings.
+Columns whose type differs across models are read as strings.
+Partitions are (re)written from the json/log storage whenever they are older than it
+(sqlite models: whenever the model's write version differs from the partition's), so queries always reflect the latest stores and read only the projected columns
+of the selected partitions, with filters pushed down to the parquet reader.
+
+Ex. mean entails_prob per model for documents with a factuality score below 0.5
+
+    metadata = query("metadata", ["document_id", "mean_worker_factuality_score"],
+                     ds.field("mean_worker_factuality_score") < 0.5)
+    metrics = query("metrics", ["document_id", "entails_prob"])
+    metadata.join(metrics, ["dataset", "model", "document_id"]).group_by("model").aggregate(
+        [("entails_prob", "mean")])
+"""
+
+import json
+import os
+from glob import glob
+from numbers import Number
+from typing import Any, Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from sumtool import storage
+from . import sqlite as sqlite_storage
+from .summary_index import summary_text
+
+COLUMNAR_DIR = ".columnar"
+TABLES = ["summaries", "metadata", "metrics"]
+PARTITION_FIELDS = [pa.field("dataset", pa.string()), pa.field("model", pa.string())]
+# schema metadata key of the sqlite write version a partition was written from
+VERSION_KEY = "sumtool_version"
+
+
+def table_dir(table: str):
+    return f"{storage.STORAGE_DIR}/{COLUMNAR_DIR}/{table}"
+
+
+def partition_path(table: str, dataset: str, model: str):
+    return f"{table_dir(table)}/dataset={dataset}/model={storage.slugify(model)}/part-0.parquet"
+
+
+def _flatten(record: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def _column(values: List[Any]) -> Optional[pa.Array]:
+    present = [v for v in values if v is not None]
+    if len(present) == 0:
+        return None
+    if all(isinstance(v, bool) for v in present):
+        return pa.array(values, pa.bool_())
+    if all(isinstance(v, Number) and not isinstance(v, bool) for v in present):
+        return pa.array(
+            [float(v) if v is not None else None for v in values], pa.float64()
+        )
+    if all(isinstance(v, str) for v in present):
+        return pa.array(values, pa.string())
+    return pa.array(
+        [json.dumps(v) if v is not None else None for v in values], pa.string()
+    )
+
+
+def records_to_table(records: Dict[str, Dict[str, Any]]) -> pa.Table:
+    """
+    Converts document id -> (nested) record dicts into a flat arrow table
+
+    Args:
+        records: dictionary of document id -> record, i.e. stored metrics
+
+    Returns:
+        pyarrow.Table with a document_id column and one column per flattened field
+    """
+    document_ids = list(records.keys())
+    flat_records = [_flatten(records[document_id]) for document_id in document_ids]
+
+    names = []
+    for flat_record in flat_records:
+        names.extend(name for name in flat_record if name not in names)
+
+    columns = {"document_id": pa.array(document_ids, pa.string())}
+    for name in names:
+        column = _column([flat_record.get(name) for flat_record in flat_records])
+        if column is not None:
+            columns[name] = column
+    return pa.table(columns)
+
+
+def _write_partition(table: pa.Table, path: str, version: Optional[int] = None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if version is not None:
+        table = table.replace_schema_metadata({VERSION_KEY: str(version)})
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def _partition_version(path: str) -> Optional[int]:
+    metadata = pq.read_schema(path).metadata or {}
+    version = metadata.get(VERSION_KEY.encode("utf-8"))
+    return int(version) if version is not None else None
+
+
+def _source_paths(dataset: str, model: str):
+    if sqlite_storage.has_model(dataset, model):
+        return {
+            "summaries": sqlite_storage.db_path(),
+            "metadata": sqlite_storage.db_path(),
+            "metrics": sqlite_storage.db_path(),
+        }
+    return {
+        "summaries": storage.summaries_path(dataset, model),
+        "metadata": storage.summaries_path(dataset, model),
+        "metrics": storage.model_path(dataset, model, "metrics.json"),
+    }
+
+
+def is_stale(dataset: str, model: str) -> bool:
+    if sqlite_storage.has_model(dataset, model):
+        # models share the database file, partitions store the model's write version instead
+        version = sqlite_storage.model_version(dataset, model)
+        tables = TABLES if sqlite_storage.has_metrics(dataset, model) else TABLES[:2]
+        return any(
+            not os.path.exists(path) or _partition_version(path) != version
+            for path in [partition_path(table, dataset, model) for table in tables]
+        )
+
+    for table, source in _source_paths(dataset, model).items():
+        path = partition_path(table, dataset, model)
+        if os.path.exists(source) and (
+            not os.path.exists(path)
+            or os.path.getmtime(path) < os.path.getmtime(source)
+        ):
+            return True
+    return False
+
+
+def write_model(dataset: str, model: str):
+    """
+    (Re)writes the summaries, metadata & metrics partitions of a model from storage
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored summaries
+    """
+    sources = _source_paths(dataset, model)
+    model = storage.slugify(model)
+    # read before the data, so writes made while reading leave the partitions stale
+    version = (
+        sqlite_storage.model_version(dataset, model)
+        if sources["summaries"] == sqlite_storage.db_path()
+        else None
+    )
+
+    if os.path.exists(sources["summaries"]):
+        stored_summaries = storage.get_summaries(dataset, model)
+        _write_partition(
+            pa.table(
+                {
+                    "document_id": pa.array(list(stored_summaries.keys()), pa.string()),
+                    "summary": pa.array(
+                        [summary_text(x["summary"]) for x in stored_summaries.values()],
+                        pa.string(),
+                    ),
+                }
+            ),
+            partition_path("summaries", dataset, model),
+            version,
+        )
+        _write_partition(
+            records_to_table(
+                {
+                    document_id: x.get("metadata", {})
+                    for document_id, x in stored_summaries.items()
+                }
+            ),
+            partition_path("metadata", dataset, model),
+            version,
+        )
+
+    if os.path.exists(sources["metrics"]) and (
+        sources["metrics"] != sqlite_storage.db_path()
+        or sqlite_storage.has_metrics(dataset, model)
+    ):
+        _write_partition(
+            records_to_table(storage.get_summary_metrics(dataset, model)),
+            partition_path("metrics", dataset, model),
+            version,
+        )
+
+
+def refresh(datasets: Optional[List[str]] = None, models: Optional[List[str]] = None):
+    """
+    Rewrites the partitions of every selected model that is older than its stored data
+
+    Args:
+        datasets: dataset names, defaults to all datasets in storage
+        models: model ids, defaults to all models of each dataset
+    """
+    for dataset in datasets if datasets is not None else _storage_datasets():
+        dataset_models = storage.get_models(dataset)
+        if models is not None:
+            selected = {storage.slugify(model) for model in models}
+            dataset_models = [model for model in dataset_models if model in selected]
+        for model in dataset_models:
+            if is_stale(dataset, model):
+                write_model(dataset, model)
+
+
+def _storage_datasets():
+    return [
+        dataset
+        for dataset in storage.get_datasets()
+        if os.path.isdir(storage.dataset_dir(dataset))
+        and len(storage.get_models(dataset)) > 0
+    ]
+
+
+def partition_files(
+    table: str, datasets: Optional[List[str]] = None, models: Optional[List[str]] = None
+) -> List[str]:
+    """
+    Parquet files of the selected partitions of a table
+
+    Args:
+        table: one of "summaries", "metadata", "metrics"
+        datasets: dataset names, defaults to all
+        models: model ids, defaults to all
+
+    Returns:
+        list of partition file paths
+    """
+    files = []
+    for dataset in datasets if datasets is not None else ["*"]:
+        for model in models if models is not None else ["*"]:
+            model_pattern = model if model == "*" else storage.slugify(model)
+            files.extend(
+                sorted(
+                    glob(
+                        f"{table_dir(table)}/dataset={dataset}/model={model_pattern}/part-0.parquet"
+                    )
+                )
+            )
+    return files
+
+
+def table_columns(
+    table: str, datasets: Optional[List[str]] = None, models: Optional[List[str]] = None
+) -> List[str]:
+    """
+    Columns of the unified schema of the selected partitions of a table, without reading them
+
+    Args:
+        table: one of "summaries", "metadata", "metrics"
+        datasets: dataset names, defaults to all
+        models: model ids, defaults to all
+
+    Returns:
+        list of column names, without the dataset & model partition columns
+    """
+    files = partition_files(table, datasets, models)
+    if len(files) == 0:
+        return []
+    return unify_schemas([pq.read_schema(file) for file in files]).names
+
+
+def unify_schemas(schemas: List[pa.Schema]) -> pa.Schema:
+    """
+    Unify the schemas of partitions, columns with conflicting types across models
+    (i.e. a metric stored as a number by one model and as a string by another) become strings
+
+    Args:
+        schemas: partition schemas
+
+    Returns:
+        pyarrow.Schema, with the fields in order of first appearance
+    """
+    types: Dict[str, List[pa.DataType]] = {}
+    for schema in schemas:
+        for field in schema:
+            types.setdefault(field.name, [])
+            if field.type not in types[field.name]:
+                types[field.name].append(field.type)
+    return pa.schema(
+        [
+            pa.field(name, field_types[0] if len(field_types) == 1 else pa.string())
+            for name, field_types in types.items()
+        ]
+    )
+
+
+def query(
+    table: str,
+    columns: Optional[List[str]] = None,
+    filter: Optional[ds.Expression] = None,
+    datasets: Optional[List[str]] = None,
+    models: Optional[List[str]] = None,
+    as_pandas: bool = False,
+    refresh_stale: bool = True,
+):
+    """
+    Reads a columnar table across datasets & models, with column projection and predicate pushdown
+
+    Args:
+        table: one of "summaries", "metadata", "metrics"
+        columns: columns to read, defaults to all. "dataset" & "model" are always included
+        filter: pyarrow.dataset expression, i.e. ds.field("entails_prob") > 0.5
+        datasets: only read partitions of these datasets, defaults to all
+        models: only read partitions of these models, defaults to all
+        as_pandas: return a pandas.DataFrame instead of a pyarrow.Table
+        refresh_stale: rewrite partitions older than the stored json/log data first
+
+    Returns:
+        pyarrow.Table (or pandas.DataFrame) with dataset & model columns
+
+    Raises:
+        ValueError: if the table name is unknown
+    """
+    if table not in TABLES:
+        raise ValueError(f"unknown columnar table: {table}, expected one of {TABLES}")
+
+    if refresh_stale:
+        refresh(datasets, models)
+
+    files = partition_files(table, datasets, models)
+    if len(files) == 0:
+        empty = pa.table({"document_id": pa.array([], pa.string())})
+        return empty.to_pandas() if as_pandas else empty
+
+    # models store different metadata/metrics fields, read them all with a unified schema
+    schema = unify_schemas(
+        [pq.read_schema(file) for file in files] + [pa.schema(PARTITION_FIELDS)]
+    )
+    arrow_dataset = ds.dataset(
+        files,
+        schema=schema,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema(PARTITION_FIELDS), flavor="hive"),
+        partition_base_dir=table_dir(table),
+    )
+
+    if columns is not None:
+        columns = ["dataset", "model"] + [
+            column for column in columns if column not in ("dataset", "model")
+        ]
+    result = arrow_dataset.to_table(columns=columns, filter=filter)
+    return result.to_pandas() if as_pandas else result
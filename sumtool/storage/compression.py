@@ -0,0 +1,98 @@
+"""
+zstd compression of cold storage files.
+
+A compressed file keeps its name with a ".zst" suffix, i.e. <model-id>-summaries.json.zst,
+and stays readable through the storage API (decompressed as a whole on read).
+Writing summaries to a compressed model decompresses it first.
+
+Requires the zstandard package.
+"""
+
+import json
+import os
+import shutil
+from typing import Any, Dict
+
+COMPRESSED_SUFFIX = ".zst"
+DEFAULT_LEVEL = 19
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            "zstandard is required for compressed storage files, pip install zstandard"
+        ) from e
+    return zstandard
+
+
+def open_compressed(path: str):
+    """
+    Open a compressed file for streaming reads
+
+    Args:
+        path: path of the .zst file
+
+    Returns:
+        binary file object of the decompressed content
+    """
+    return _zstd().ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+
+
+def compress_file(path: str, level: int = DEFAULT_LEVEL) -> str:
+    """
+    Compress a file with zstd in a streaming fashion and remove the original
+
+    Args:
+        path: path of the file to compress
+        level: zstd compression level
+
+    Returns:
+        path of the compressed file
+    """
+    compressed_path = path + COMPRESSED_SUFFIX
+    compressor = _zstd().ZstdCompressor(level=level, write_checksum=True)
+    with open(path, "rb") as src, open(compressed_path + ".tmp", "wb") as dst:
+        compressor.copy_stream(src, dst)
+    os.replace(compressed_path + ".tmp", compressed_path)
+    os.remove(path)
+    return compressed_path
+
+
+def decompress_file(compressed_path: str) -> str:
+    """
+    Decompress a .zst file in a streaming fashion and remove the compressed file
+
+    Args:
+        compressed_path: path of the .zst file
+
+    Returns:
+        path of the decompressed file
+    """
+    path = compressed_path[: -len(COMPRESSED_SUFFIX)]
+    with open_compressed(compressed_path) as src, open(path + ".tmp", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(path + ".tmp", path)
+    os.remove(compressed_path)
+    return path
+
+
+def load_records(compressed_path: str) -> Dict[str, Any]:
+    """
+    Read a compressed json file or summary log
+
+    Args:
+        compressed_path: path of the .json.zst or .jsonl.zst file
+
+    Returns:
+        dictionary of document id -> record
+    """
+    with open_compressed(compressed_path) as f:
+        if not compressed_path.endswith(".jsonl" + COMPRESSED_SUFFIX):
+            return json.load(f)
+        records = {}
+        for line in f.read().splitlines():
+            document_id, _, record = line.partition(b"\t")
+            records[document_id.decode("utf-8")] = json.loads(record)
+        return records
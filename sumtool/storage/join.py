@@ -0,0 +1,184 @@
+"""
+Multi-model queries joining summaries, metadata & metrics into one long-format table.
+
+    join_models("xsum", fields=["summary", "metadata.mean_worker_factuality_score", "metrics.entails_prob"])
+
+    dataset  model           document_id  summary  metadata.mean_worker_factuality_score  metrics.entails_prob
+    xsum     maynez-berts2s  10162452     ...      0.33                                   0.04
+    xsum     maynez-gold     10162452     ...      0.0                                    0.01
+
+Built on the columnar mirror (see columnar.py): stale models are rewritten in parallel processes,
+then only the requested columns of the selected models are read and joined with Arrow.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from sumtool import storage
+from . import columnar
+
+JOIN_KEYS = ["dataset", "model", "document_id"]
+# field prefix -> columnar table
+FIELD_TABLES = {"metadata": "metadata", "metrics": "metrics"}
+
+
+def _write_model(args):
+    storage_dir, dataset, model = args
+    storage.STORAGE_DIR = storage_dir
+    columnar.write_model(dataset, model)
+
+
+def refresh_models(dataset: str, models: List[str], processes: Optional[int] = None):
+    """
+    Rewrite the columnar partitions of stale models, in parallel processes
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        models: model ids
+        processes: number of worker processes, defaults to the number of cpus
+    """
+    stale = [model for model in models if columnar.is_stale(dataset, model)]
+    if len(stale) <= 1 or processes == 1:
+        for model in stale:
+            columnar.write_model(dataset, model)
+        return
+    with ProcessPoolExecutor(processes) as executor:
+        list(
+            executor.map(
+                _write_model,
+                [(storage.STORAGE_DIR, dataset, model) for model in stale],
+            )
+        )
+
+
+def _empty(names: List[str]) -> pa.Table:
+    return pa.table({name: pa.array([], pa.string()) for name in JOIN_KEYS + names})
+
+
+def _read_fields(
+    table: str,
+    names: List[str],
+    dataset: str,
+    models: List[str],
+    filter: Optional[ds.Expression],
+) -> pa.Table:
+    available = columnar.table_columns(table, [dataset], models)
+    if len(available) == 0:
+        return _empty([f"{table}.{name}" for name in names if name != "*"])
+    if "*" in names:
+        names = [name for name in available if name != "document_id"]
+    columns = [name for name in names if name in available]
+    result = columnar.query(
+        table,
+        ["document_id"] + columns,
+        filter,
+        datasets=[dataset],
+        models=models,
+        refresh_stale=False,
+    )
+    # missing fields are null, i.e. metrics that were not computed for any selected model
+    for name in names:
+        if name not in columns:
+            result = result.append_column(name, pa.nulls(len(result), pa.string()))
+    return result.rename_columns(
+        [
+            name if name in JOIN_KEYS else f"{table}.{name}"
+            for name in result.column_names
+        ]
+    )
+
+
+def join_models(
+    dataset: str,
+    models: Optional[List[str]] = None,
+    fields: Optional[List[str]] = None,
+    document_ids: Optional[List[str]] = None,
+    annotations=None,
+    as_pandas: bool = True,
+    processes: Optional[int] = None,
+):
+    """
+    One row per (model, document) with the requested summary, metadata & metric fields
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        models: model ids, defaults to all models of the dataset
+        fields: "summary", "metadata.<name>" or "metrics.<name>", "metadata.*" & "metrics.*" select all,
+            defaults to ["summary", "metrics.*"]
+        document_ids: only these documents, defaults to all
+        annotations: optional pandas.DataFrame or pyarrow.Table with a document_id column
+            (and optionally a model column) that is left joined onto the result,
+            i.e. annotations from XsumDataset
+        as_pandas: return a pandas.DataFrame instead of a pyarrow.Table
+        processes: number of processes used to refresh stale models
+
+    Returns:
+        pyarrow.Table (or pandas.DataFrame) sorted by model & document id
+
+    Raises:
+        ValueError: if a field is not "summary" or prefixed with metadata. or metrics.
+    """
+    models = (
+        [storage.slugify(model) for model in models]
+        if models is not None
+        else storage.get_models(dataset)
+    )
+    fields = fields if fields is not None else ["summary", "metrics.*"]
+
+    by_table = {}
+    for field in fields:
+        if field == "summary":
+            continue
+        prefix, _, name = field.partition(".")
+        if prefix not in FIELD_TABLES or name == "":
+            raise ValueError(
+                f"unknown field: {field}, expected summary, metadata.<name> or metrics.<name>"
+            )
+        by_table.setdefault(FIELD_TABLES[prefix], []).append(name)
+
+    refresh_models(dataset, models, processes)
+
+    filter = None
+    if document_ids is not None:
+        filter = ds.field("document_id").isin([str(x) for x in document_ids])
+
+    summary_columns = ["summary"] if "summary" in fields else []
+    if len(columnar.partition_files("summaries", [dataset], models)) == 0:
+        result = _empty(summary_columns)
+    else:
+        result = columnar.query(
+            "summaries",
+            ["document_id"] + summary_columns,
+            filter,
+            datasets=[dataset],
+            models=models,
+            refresh_stale=False,
+        )
+    for table, names in by_table.items():
+        result = result.join(
+            _read_fields(table, names, dataset, models, filter),
+            keys=JOIN_KEYS,
+            join_type="left outer",
+        )
+
+    if annotations is not None:
+        if not isinstance(annotations, pa.Table):
+            annotations = pa.Table.from_pandas(annotations, preserve_index=False)
+        keys = [
+            key for key in ["model", "document_id"] if key in annotations.column_names
+        ]
+        for key in keys:
+            annotations = annotations.set_column(
+                annotations.column_names.index(key),
+                key,
+                pc.cast(annotations.column(key), pa.string()),
+            )
+        result = result.join(annotations, keys=keys, join_type="left outer")
+
+    if len(result) > 0:
+        result = result.sort_by([("model", "ascending"), ("document_id", "ascending")])
+    return result.to_pandas() if as_pandas else result
@@ -0,0 +1,139 @@
+"""
+Persistent, content-addressed cache of metric results.
+
+Every result is keyed by the sha256 of (document text, summary text, metric name,
+scoring model id, scorer parameters), so a pair is scored once no matter which model
+generated the summary, i.e. gold summaries duplicated across the maynez files, and
+reruns only score pairs that changed or were added.
+
+Results are stored as json in /data/.metric-cache.sqlite, shared by concurrent metric jobs.
+"""
+
+import hashlib
+import json
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sumtool import storage
+from . import sqlite as sqlite_storage
+
+DB_FILE = ".metric-cache.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# sqlite limits the number of query parameters
+_BATCH_SIZE = 500
+
+
+def _connect():
+    return sqlite_storage.connect(f"{storage.STORAGE_DIR}/{DB_FILE}", SCHEMA)
+
+
+def metric_key(
+    document: str,
+    summary: str,
+    metric: str,
+    model_id: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Content address of a metric result
+
+    Args:
+        document: source document (or reference) text
+        summary: summary (or hypothesis) text
+        metric: metric name, i.e. "bertscore"
+        model_id: id of the model used for scoring, if any
+        params: scorer parameters that change the result
+
+    Returns:
+        hex sha256 digest
+    """
+    content = json.dumps(
+        [document, summary, metric, model_id, params or {}],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_cached(keys: Iterable[str]) -> Dict[str, Any]:
+    """
+    Look up cached metric results
+
+    Args:
+        keys: metric keys
+
+    Returns:
+        dictionary of key -> result, for the keys that are cached
+    """
+    keys = list(keys)
+    connection = _connect()
+    cached = {}
+    for i in range(0, len(keys), _BATCH_SIZE):
+        batch = keys[i : i + _BATCH_SIZE]
+        rows = connection.execute(
+            f"SELECT key, value FROM metric_cache WHERE key IN ({','.join('?' * len(batch))})",
+            batch,
+        )
+        for key, value in rows:
+            cached[key] = json.loads(value)
+    return cached
+
+
+def put_cached(results: Dict[str, Any]):
+    """
+    Store metric results in one transaction
+
+    Args:
+        results: dictionary of key -> json serializable result
+    """
+    with sqlite_storage._transaction(_connect()) as connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO metric_cache VALUES (?, ?)",
+            [(key, json.dumps(value)) for key, value in results.items()],
+        )
+
+
+def cached_scores(
+    pairs: List[Tuple[str, str]],
+    metric: str,
+    compute: Callable[[List[Tuple[str, str]]], List[Any]],
+    model_id: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None,
+) -> List[Any]:
+    """
+    Score (document, summary) pairs, computing only pairs that are not cached yet.
+    Duplicate pairs are computed once.
+
+    Args:
+        pairs: list of (document, summary) texts
+        metric: metric name, i.e. "entailment"
+        compute: function scoring a list of pairs, returning one json serializable result per pair
+        model_id: id of the model used for scoring, if any
+        params: scorer parameters that change the result
+
+    Returns:
+        list of results aligned with pairs
+    """
+    keys = [
+        metric_key(document, summary, metric, model_id, params)
+        for document, summary in pairs
+    ]
+    results = get_cached(keys)
+
+    missing = {}
+    for key, pair in zip(keys, pairs):
+        if key not in results:
+            missing.setdefault(key, pair)
+
+    if len(missing) > 0:
+        computed = dict(zip(missing.keys(), compute(list(missing.values()))))
+        put_cached(computed)
+        results.update(computed)
+
+    return [results[key] for key in keys]
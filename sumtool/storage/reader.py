@@ -0,0 +1,301 @@
+"""
+Streaming & random-access reader for large json storage files
+(<model-id>-summaries.json, <model-id>-metrics.json) without json.load-ing the whole file.
+
+The file is scanned once to build a sidecar index of byte offsets, stored under
+/data/<dataset>/index/<file name>.offsets.json and rebuilt when the file's size or mtime changes:
+
+{
+    "size": file size, "mtime_ns": file mtime,
+    "records": {"<document-id>": [start, length]},
+    "fields": {"<document-id>": {"summary": [start, length], "metadata.<key>": [start, length]}}
+}
+
+Reading one document parses only its own bytes, and reading selected fields
+(i.e. "summary" without "metadata.tokens_with_entropy") parses only those fields.
+"""
+
+import json
+import os
+import re
+from contextlib import nullcontext
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+CHUNK_SIZE = 1 << 20
+# record fields are indexed up to this many levels below the document id
+MAX_FIELD_DEPTH = 2
+
+_STRUCTURAL = re.compile(rb'[{}\[\]",:\\]')
+
+
+def scan_offsets(path: str, fileobj: Optional[BinaryIO] = None) -> Tuple[Dict, Dict]:
+    """
+    Scan a json object of document id -> record in constant memory,
+    recording the byte span of every record and of its nested fields
+
+    Args:
+        path: path of the json file
+        fileobj: binary file object to scan instead of opening path,
+            i.e. the decompressing stream of a .zst file
+
+    Returns:
+        (records, fields) as stored in the sidecar index
+    """
+    records, fields = {}, {}
+    # one frame per open container: [is_object, path, key_start, key, value_start]
+    stack = []
+    in_string = False
+    skip_to = 0  # position after an escaped character
+    base = 0
+    pending_key = b""
+
+    def end_member(frame, end):
+        path = frame[1] + (frame[3],)
+        span = [frame[4], end - frame[4]]
+        if len(path) == 1:
+            records[path[0]] = span
+        else:
+            fields.setdefault(path[0], {})[".".join(path[1:])] = span
+        frame[3], frame[4] = None, None
+
+    with open(path, "rb") if fileobj is None else nullcontext(fileobj) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            for match in _STRUCTURAL.finditer(chunk):
+                pos = base + match.start()
+                if pos < skip_to:
+                    continue
+                char = match.group(0)
+                frame = stack[-1] if stack else None
+
+                if in_string:
+                    if char == b"\\":
+                        skip_to = pos + 2
+                    elif char == b'"':
+                        in_string = False
+                        if frame is not None and frame[0] and frame[2] is not None:
+                            if frame[2] >= base:
+                                key_bytes = chunk[frame[2] - base : match.start() + 1]
+                            else:
+                                key_bytes = pending_key + chunk[: match.start() + 1]
+                            frame[3] = json.loads(key_bytes.decode("utf-8"))
+                            frame[2] = None
+                    continue
+
+                if char == b'"':
+                    in_string = True
+                    if frame is not None and frame[0] and frame[3] is None:
+                        frame[2] = pos  # key starts
+                elif char == b":":
+                    if frame is not None and frame[0]:
+                        frame[4] = pos + 1
+                elif char == b",":
+                    if frame is not None and frame[0] and frame[4] is not None:
+                        if frame[1] is not None and len(frame[1]) <= MAX_FIELD_DEPTH:
+                            end_member(frame, pos)
+                        else:
+                            frame[3], frame[4] = None, None
+                elif char in (b"{", b"["):
+                    if frame is None:
+                        path = ()
+                    elif frame[0] and frame[1] is not None:
+                        path = frame[1] + (frame[3],)
+                    else:
+                        path = None
+                    stack.append([char == b"{", path, None, None, None])
+                elif char in (b"}", b"]"):
+                    if (
+                        frame[0]
+                        and frame[4] is not None
+                        and frame[1] is not None
+                        and len(frame[1]) <= MAX_FIELD_DEPTH
+                    ):
+                        end_member(frame, pos)
+                    stack.pop()
+
+            # keep the unfinished part of a key that crosses the chunk boundary
+            frame = stack[-1] if stack else None
+            if in_string and frame is not None and frame[0] and frame[2] is not None:
+                if frame[2] >= base:
+                    pending_key = chunk[frame[2] - base :]
+                else:
+                    pending_key += chunk
+            base += len(chunk)
+
+    return records, fields
+
+
+def _get_field(value: Any, keys: List[str]) -> Tuple[bool, Any]:
+    for key in keys:
+        if not isinstance(value, dict) or key not in value:
+            return False, None
+        value = value[key]
+    return True, value
+
+
+def _set_field(record: Dict, field: str, value: Any):
+    keys = field.split(".")
+    for key in keys[:-1]:
+        record = record.setdefault(key, {})
+    record[keys[-1]] = value
+
+
+def select_fields(record: Dict[str, Any], fields: Optional[List[str]]) -> Dict:
+    """
+    Keep only the selected (dotted) fields of a parsed record
+
+    Args:
+        record: the parsed record
+        fields: dotted field paths, i.e. ["summary", "metadata.mean_worker_factuality_score"], None for all
+
+    Returns:
+        the record with only the selected fields
+    """
+    if fields is None:
+        return record
+    selected = {}
+    for field in fields:
+        found, value = _get_field(record, field.split("."))
+        if found:
+            _set_field(selected, field, value)
+    return selected
+
+
+class JsonRecordReader:
+    """
+    Random-access & streaming reads of a json object of document id -> record
+    """
+
+    def __init__(self, path: str, sidecar_path: str):
+        self.path = path
+        self.sidecar_path = sidecar_path
+        self.records: Dict[str, List[int]] = {}
+        self.fields: Dict[str, Dict[str, List[int]]] = {}
+        self._stat = None
+
+    def refresh(self):
+        """
+        Load the sidecar index, (re)building it if the file changed since it was built
+        """
+        stat = os.stat(self.path)
+        current = (stat.st_size, stat.st_mtime_ns)
+        if current == self._stat:
+            return
+
+        if os.path.exists(self.sidecar_path):
+            with open(self.sidecar_path, "r") as f:
+                sidecar = json.load(f)
+            if (sidecar["size"], sidecar["mtime_ns"]) == current:
+                self.records, self.fields = sidecar["records"], sidecar["fields"]
+                self._stat = current
+                return
+
+        self.records, self.fields = scan_offsets(self.path)
+        os.makedirs(os.path.dirname(self.sidecar_path), exist_ok=True)
+        with open(self.sidecar_path + ".tmp", "w") as f:
+            json.dump(
+                {
+                    "size": current[0],
+                    "mtime_ns": current[1],
+                    "records": self.records,
+                    "fields": self.fields,
+                },
+                f,
+            )
+        os.replace(self.sidecar_path + ".tmp", self.sidecar_path)
+        self._stat = current
+
+    def __len__(self):
+        self.refresh()
+        return len(self.records)
+
+    def __contains__(self, document_id):
+        self.refresh()
+        return str(document_id) in self.records
+
+    def document_ids(self) -> List[str]:
+        self.refresh()
+        return list(self.records.keys())
+
+    def _read(self, f, document_id: str, fields: Optional[List[str]]):
+        if fields is None:
+            start, length = self.records[document_id]
+            f.seek(start)
+            return json.loads(f.read(length))
+
+        record = {}
+        document_fields = self.fields.get(document_id, {})
+        for field in fields:
+            if field in document_fields:
+                start, length = document_fields[field]
+                f.seek(start)
+                _set_field(record, field, json.loads(f.read(length)))
+            else:
+                # field nested deeper than the index, parse its deepest indexed ancestor
+                keys = field.split(".")
+                for depth in range(len(keys) - 1, 0, -1):
+                    parent = ".".join(keys[:depth])
+                    if parent in document_fields:
+                        start, length = document_fields[parent]
+                        f.seek(start)
+                        found, value = _get_field(
+                            json.loads(f.read(length)), keys[depth:]
+                        )
+                        if found:
+                            _set_field(record, field, value)
+                        break
+        return record
+
+    def get(self, document_id: str, fields: Optional[List[str]] = None):
+        """
+        Read a single document's record, parsing only its bytes
+
+        Args:
+            document_id: id of the summarized document
+            fields: dotted field paths to read, None for the whole record
+
+        Returns:
+            the record, or None if the document is not in the file
+        """
+        self.refresh()
+        if str(document_id) not in self.records:
+            return None
+        with open(self.path, "rb") as f:
+            return self._read(f, str(document_id), fields)
+
+    def iter(self, fields: Optional[List[str]] = None) -> Iterator[Tuple[str, Dict]]:
+        """
+        Stream all records in file order, holding one record in memory at a time
+
+        Args:
+            fields: dotted field paths to read, None for whole records
+
+        Yields:
+            (document id, record)
+        """
+        self.refresh()
+        ordered = sorted(self.records.items(), key=lambda item: item[1][0])
+        with open(self.path, "rb") as f:
+            for document_id, _ in ordered:
+                yield document_id, self._read(f, document_id, fields)
+
+
+_readers: Dict[str, JsonRecordReader] = {}
+
+
+def open_json_reader(path: str, sidecar_path: str) -> JsonRecordReader:
+    """
+    Get the process-wide reader of a json storage file
+
+    Args:
+        path: path of the json file
+        sidecar_path: path of its offsets sidecar
+
+    Returns:
+        JsonRecordReader
+    """
+    if path not in _readers:
+        _readers[path] = JsonRecordReader(path, sidecar_path)
+    return _readers[path]
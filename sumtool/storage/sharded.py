@@ -0,0 +1,198 @@
+"""
+Sharded summary storage, for models with too many summaries for a single file.
+
+The summaries of a model are hash-partitioned by document id into summary logs (see summary_log.py):
+
+    /data/<dataset>/<model-id>-shards/manifest.json
+    /data/<dataset>/<model-id>-shards/shard-00000.jsonl
+    ...
+
+    manifest.json
+    {
+        "format_version": 1,
+        "partitioning": "crc32",
+        "num_shards": 64,
+        "shards": ["shard-00000.jsonl", ...]
+    }
+
+A document is stored in shard crc32(document id) % num_shards, so writing or reading a document
+touches a single shard. The manifest's mtime is bumped on every write, so it marks the last
+change of the model (see summaries_path). Shards are independent files and can be processed
+in parallel with map_shards.
+"""
+
+import json
+import os
+import zlib
+from multiprocessing import Pool
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sumtool import storage
+from .summary_log import open_summary_log
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+DEFAULT_NUM_SHARDS = 64
+
+
+def shards_dir(dataset: str, model: str):
+    return storage.model_path(dataset, model, "shards")
+
+
+def manifest_path(dataset: str, model: str):
+    return f"{shards_dir(dataset, model)}/{MANIFEST}"
+
+
+def is_sharded(dataset: str, model: str) -> bool:
+    return os.path.exists(manifest_path(dataset, model))
+
+
+_manifests: Dict[str, Dict[str, Any]] = {}
+
+
+def load_manifest(dataset: str, model: str) -> Dict[str, Any]:
+    # the shards of a manifest never change once it is created
+    path = manifest_path(dataset, model)
+    if path not in _manifests:
+        with open(path, "r") as f:
+            _manifests[path] = json.load(f)
+    return _manifests[path]
+
+
+def create_shards(
+    dataset: str, model: str, num_shards: int = DEFAULT_NUM_SHARDS
+) -> Dict[str, Any]:
+    """
+    Create the manifest of a sharded model, if it does not exist yet
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+        num_shards: number of hash partitions, fixed once the manifest exists
+
+    Returns:
+        the manifest
+    """
+    if is_sharded(dataset, model):
+        return load_manifest(dataset, model)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "partitioning": "crc32",
+        "num_shards": num_shards,
+        "shards": [f"shard-{i:05d}.jsonl" for i in range(num_shards)],
+    }
+    os.makedirs(shards_dir(dataset, model), exist_ok=True)
+    path = manifest_path(dataset, model)
+    with open(f"{path}.{os.getpid()}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    # concurrent creators write identical manifests, the last replace wins
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+    _manifests[path] = manifest
+    return manifest
+
+
+def shard_of(document_id: str, num_shards: int) -> int:
+    return zlib.crc32(str(document_id).encode("utf-8")) % num_shards
+
+
+def shard_paths(dataset: str, model: str) -> List[str]:
+    """
+    Paths of the shards of a model, including shards without records yet
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+
+    Returns:
+        list of shard paths, in shard order
+    """
+    return [
+        f"{shards_dir(dataset, model)}/{shard}"
+        for shard in load_manifest(dataset, model)["shards"]
+    ]
+
+
+def _shard_path(dataset: str, model: str, document_id: str) -> str:
+    manifest = load_manifest(dataset, model)
+    shard = manifest["shards"][shard_of(document_id, manifest["num_shards"])]
+    return f"{shards_dir(dataset, model)}/{shard}"
+
+
+def store_summary_records(
+    dataset: str,
+    model: str,
+    records: Dict[str, Dict],
+    num_shards: int = DEFAULT_NUM_SHARDS,
+):
+    """
+    Append summary records to the shards of their documents
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+        records: dictionary of document id -> {"summary": ..., "metadata": ...}
+        num_shards: number of shards, if the model is not sharded yet
+    """
+    manifest = create_shards(dataset, model, num_shards)
+    by_shard: Dict[int, Dict[str, Dict]] = {}
+    for document_id, record in records.items():
+        shard = shard_of(document_id, manifest["num_shards"])
+        by_shard.setdefault(shard, {})[str(document_id)] = record
+
+    for shard, shard_records in by_shard.items():
+        open_summary_log(
+            f"{shards_dir(dataset, model)}/{manifest['shards'][shard]}"
+        ).append(shard_records)
+    os.utime(manifest_path(dataset, model))
+
+
+def get_summary(dataset: str, model: str, document_id: str) -> Optional[Dict]:
+    return open_summary_log(_shard_path(dataset, model, document_id)).get(document_id)
+
+
+def iter_shard(path: str) -> Iterator[Tuple[str, Dict]]:
+    """
+    Iterate over the records of one shard
+
+    Args:
+        path: shard path, see shard_paths
+
+    Yields:
+        (document id, {"summary": ..., "metadata": ...})
+    """
+    if os.path.exists(path):
+        yield from open_summary_log(path).items()
+
+
+def iter_summaries(dataset: str, model: str) -> Iterator[Tuple[str, Dict]]:
+    for path in shard_paths(dataset, model):
+        yield from iter_shard(path)
+
+
+def document_ids(dataset: str, model: str) -> List[str]:
+    return [
+        document_id
+        for path in shard_paths(dataset, model)
+        if os.path.exists(path)
+        for document_id in open_summary_log(path).document_ids()
+    ]
+
+
+def map_shards(
+    dataset: str, model: str, fn: Callable[[str], Any], processes: Optional[int] = None
+) -> List[Any]:
+    """
+    Process the shards of a model in parallel, i.e. to compute metrics per shard
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+        fn: picklable function of a shard path, i.e. reading it with iter_shard
+        processes: number of worker processes, defaults to the number of cpus
+
+    Returns:
+        list of fn results, in shard order
+    """
+    with Pool(processes) as pool:
+        return pool.map(fn, shard_paths(dataset, model))
@@ -0,0 +1,390 @@
+"""
+SQLite implementation of the sumtool.storage API, for concurrent writers.
+
+All datasets & models share one database at /data/.sumtool.sqlite in WAL mode,
+so many generation/metric processes can write at once (writers queue on a busy timeout
+instead of losing updates) while readers keep reading the last committed state.
+Every store call is a single batched transaction.
+
+Tables, keyed by (dataset, model, document_id):
+- configs: model config json, keyed by (dataset, model)
+- versions: write version of a model, keyed by (dataset, model). Every write of a model
+  sets it to a new database-wide maximum, so derived data can tell which models changed
+- summaries: summary
+- metadata: metadata json
+- metrics: one row per metric name with its json value, so metric updates merge like a PUT
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from sumtool import storage
+
+DB_FILE = ".sumtool.sqlite"
+BUSY_TIMEOUT_MS = 60_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    dataset TEXT NOT NULL,
+    model TEXT NOT NULL,
+    config TEXT NOT NULL,
+    PRIMARY KEY (dataset, model)
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    dataset TEXT NOT NULL,
+    model TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    PRIMARY KEY (dataset, model, document_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS metadata (
+    dataset TEXT NOT NULL,
+    model TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    PRIMARY KEY (dataset, model, document_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS metrics (
+    dataset TEXT NOT NULL,
+    model TEXT NOT NULL,
+    document_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (dataset, model, document_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS versions (
+    dataset TEXT NOT NULL,
+    model TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (dataset, model)
+);
+"""
+
+_connections = threading.local()
+
+
+def db_path():
+    return f"{storage.STORAGE_DIR}/{DB_FILE}"
+
+
+def connect(path: Optional[str] = None, schema: str = SCHEMA) -> sqlite3.Connection:
+    """
+    Get this thread's connection to the storage database, creating the schema if needed.
+    Connections are not shared across threads or forked processes.
+
+    Args:
+        path: database path, defaults to the storage database
+        schema: schema script run when connecting
+
+    Returns:
+        sqlite3.Connection
+    """
+    path = path if path is not None else db_path()
+    key = (os.getpid(), path)
+    if not hasattr(_connections, "by_key"):
+        _connections.by_key = {}
+    connection = _connections.by_key.get(key)
+    if connection is not None:
+        return connection
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # transactions are managed explicitly with BEGIN IMMEDIATE
+    connection = sqlite3.connect(
+        path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None
+    )
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    connection.executescript(schema)
+
+    _connections.by_key[key] = connection
+    return connection
+
+
+class _transaction:
+    """
+    Write transaction that takes the write lock up front, so concurrent writers
+    wait on the busy timeout instead of failing when upgrading a read lock
+    """
+
+    def __init__(self, connection: Optional[sqlite3.Connection] = None):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection = self.connection or connect()
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def store_model_config(dataset: str, model: str, model_config: dict):
+    model_config["sumtool_model"] = storage.slugify(model)
+    with _transaction() as connection:
+        connection.execute(
+            "INSERT OR IGNORE INTO configs VALUES (?, ?, ?)",
+            (dataset, storage.slugify(model), json.dumps(model_config, sort_keys=True)),
+        )
+
+
+def _has_rows(connection: sqlite3.Connection, table: str, dataset: str, model: str):
+    row = connection.execute(
+        f"SELECT 1 FROM {table} WHERE dataset = ? AND model = ? LIMIT 1",
+        (dataset, model),
+    ).fetchone()
+    return row is not None
+
+
+def _bump_version(connection: sqlite3.Connection, dataset: str, model: str):
+    connection.execute(
+        "INSERT OR REPLACE INTO versions "
+        "SELECT ?, ?, COALESCE(MAX(version), 0) + 1 FROM versions",
+        (dataset, model),
+    )
+
+
+def model_version(dataset: str, model: str) -> int:
+    """
+    Write version of a model, changes with every write of the model (and only then)
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+
+    Returns:
+        version, 0 if the model was never written
+    """
+    if not os.path.exists(db_path()):
+        return 0
+    row = (
+        connect()
+        .execute(
+            "SELECT version FROM versions WHERE dataset = ? AND model = ?",
+            (dataset, storage.slugify(model)),
+        )
+        .fetchone()
+    )
+    return row[0] if row is not None else 0
+
+
+def store_summary_records(
+    dataset: str,
+    model: str,
+    records: Dict[str, Dict],
+    carry_over: Optional[Callable[[], Dict[str, Dict]]] = None,
+):
+    """
+    Upserts summary records in one transaction
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+        records: dictionary of document id -> {"summary": ..., "metadata": ...}
+        carry_over: function loading the records the model has stored in other formats,
+            written in the same transaction if the database has no summaries of the model yet
+    """
+    model = storage.slugify(model)
+    with _transaction() as connection:
+        if carry_over is not None and not _has_rows(
+            connection, "summaries", dataset, model
+        ):
+            # readers only read the database once it has summaries of the model
+            records = {**carry_over(), **records}
+        connection.executemany(
+            "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)",
+            [
+                (dataset, model, str(document_id), json.dumps(record["summary"]))
+                for document_id, record in records.items()
+            ],
+        )
+        connection.executemany(
+            "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)",
+            [
+                (dataset, model, str(document_id), json.dumps(record["metadata"]))
+                for document_id, record in records.items()
+            ],
+        )
+        _bump_version(connection, dataset, model)
+
+
+def store_summary_metrics(
+    dataset: str,
+    model: str,
+    summary_metrics: Dict[str, Dict[str, Any]],
+    carry_over: Optional[Callable[[], Dict[str, Dict[str, Any]]]] = None,
+):
+    """
+    Upserts summary metrics in one transaction, keeping other metrics of the same documents
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+        summary_metrics: dictionary of document id -> {...summary metrics}
+        carry_over: function loading the metrics the model has stored as json,
+            written in the same transaction if the database has no metrics of the model yet
+    """
+    model = storage.slugify(model)
+    with _transaction() as connection:
+        if carry_over is not None and not _has_rows(
+            connection, "metrics", dataset, model
+        ):
+            stored_metrics = carry_over()
+            for document_id, metrics in summary_metrics.items():
+                stored_metrics[document_id] = {
+                    **stored_metrics.get(document_id, {}),
+                    **metrics,
+                }
+            summary_metrics = stored_metrics
+        connection.executemany(
+            "INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?)",
+            [
+                (dataset, model, str(document_id), name, json.dumps(value))
+                for document_id, metrics in summary_metrics.items()
+                for name, value in metrics.items()
+            ],
+        )
+        _bump_version(connection, dataset, model)
+
+
+def has_model(dataset: str, model: str) -> bool:
+    if not os.path.exists(db_path()):
+        return False
+    row = (
+        connect()
+        .execute(
+            "SELECT 1 FROM summaries WHERE dataset = ? AND model = ? LIMIT 1",
+            (dataset, storage.slugify(model)),
+        )
+        .fetchone()
+    )
+    return row is not None
+
+
+def has_metrics(dataset: str, model: str) -> bool:
+    if not os.path.exists(db_path()):
+        return False
+    row = (
+        connect()
+        .execute(
+            "SELECT 1 FROM metrics WHERE dataset = ? AND model = ? LIMIT 1",
+            (dataset, storage.slugify(model)),
+        )
+        .fetchone()
+    )
+    return row is not None
+
+
+def get_datasets() -> List[str]:
+    if not os.path.exists(db_path()):
+        return []
+    return [
+        row[0] for row in connect().execute("SELECT DISTINCT dataset FROM summaries")
+    ]
+
+
+def get_models(dataset: str) -> List[str]:
+    if not os.path.exists(db_path()):
+        return []
+    return [
+        row[0]
+        for row in connect().execute(
+            "SELECT DISTINCT model FROM summaries WHERE dataset = ?", (dataset,)
+        )
+    ]
+
+
+def iter_summaries(dataset: str, model: str) -> Iterator:
+    rows = connect().execute(
+        """
+        SELECT s.document_id, s.summary, m.metadata
+        FROM summaries s LEFT JOIN metadata m USING (dataset, model, document_id)
+        WHERE s.dataset = ? AND s.model = ?
+        """,
+        (dataset, storage.slugify(model)),
+    )
+    for document_id, summary, metadata in rows:
+        yield document_id, {
+            "summary": json.loads(summary),
+            "metadata": json.loads(metadata) if metadata is not None else {},
+        }
+
+
+def get_summaries(dataset: str, model: str) -> Dict[str, Dict]:
+    return dict(iter_summaries(dataset, model))
+
+
+def get_summary(dataset: str, model: str, document_id: str) -> Optional[Dict]:
+    row = (
+        connect()
+        .execute(
+            """
+            SELECT s.summary, m.metadata
+            FROM summaries s LEFT JOIN metadata m USING (dataset, model, document_id)
+            WHERE s.dataset = ? AND s.model = ? AND s.document_id = ?
+            """,
+            (dataset, storage.slugify(model), str(document_id)),
+        )
+        .fetchone()
+    )
+    if row is None:
+        return None
+    return {
+        "summary": json.loads(row[0]),
+        "metadata": json.loads(row[1]) if row[1] is not None else {},
+    }
+
+
+def get_summary_metrics(dataset: str, model: str) -> Dict[str, Dict[str, Any]]:
+    summary_metrics = {}
+    rows = connect().execute(
+        "SELECT document_id, name, value FROM metrics WHERE dataset = ? AND model = ?",
+        (dataset, storage.slugify(model)),
+    )
+    for document_id, name, value in rows:
+        summary_metrics.setdefault(document_id, {})[name] = json.loads(value)
+    return summary_metrics
+
+
+def get_model_config(dataset: str, model: str) -> Optional[Dict]:
+    row = (
+        connect()
+        .execute(
+            "SELECT config FROM configs WHERE dataset = ? AND model = ?",
+            (dataset, storage.slugify(model)),
+        )
+        .fetchone()
+    )
+    return json.loads(row[0]) if row is not None else None
+
+
+def count_summaries(dataset: str, model: str) -> int:
+    return (
+        connect()
+        .execute(
+            "SELECT COUNT(*) FROM summaries WHERE dataset = ? AND model = ?",
+            (dataset, storage.slugify(model)),
+        )
+        .fetchone()[0]
+    )
+
+
+def delete_model(dataset: str, model: str):
+    """
+    Deletes the config, summaries, metadata & metrics of a model in one transaction
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+    """
+    with _transaction() as connection:
+        for table in ["configs", "summaries", "metadata", "metrics"]:
+            connection.execute(
+                f"DELETE FROM {table} WHERE dataset = ? AND model = ?",
+                (dataset, storage.slugify(model)),
+            )
+        # the version is kept, so a recreated model never reuses an earlier version
+        _bump_version(connection, dataset, storage.slugify(model))
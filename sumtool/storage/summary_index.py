@@ -0,0 +1,383 @@
+"""
+Positional inverted index over stored model summaries.
+
+One index file is kept per model under /data/<dataset>/index/<model-id>-index.json
+and is updated by store_model_summaries (through an append-only pending file that is
+merged on the next load), so term & phrase queries across all models never have to
+load and scan the summaries themselves.
+
+Ex. /data/xsum/index/maynez-gold-index.json
+
+{
+    "postings": {
+        "<term>": {
+            "<document-id>": [[position, start_offset, end_offset], ...]
+        }
+    },
+    "documents": {
+        "<document-id>": ["<term>", ...]
+    }
+}
+"""
+
+import fcntl
+import json
+import os
+import re
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sumtool import storage
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# (model, document id, [(start_offset, end_offset), ...])
+SummaryMatch = Tuple[str, str, List[Tuple[int, int]]]
+
+
+def index_dir(dataset: str):
+    return f"{storage.dataset_dir(dataset)}/index"
+
+
+def index_path(dataset: str, model: str):
+    return f"{index_dir(dataset)}/{storage.slugify(model)}-index.json"
+
+
+def tokenize(text: str) -> List[Tuple[str, int, int]]:
+    """
+    Splits text into lowercased word tokens with their character offsets
+
+    Args:
+        text: the text to tokenize
+
+    Returns:
+        list of (token, start_offset, end_offset)
+    """
+    return [
+        (match.group(0).lower(), match.start(), match.end())
+        for match in TOKEN_PATTERN.finditer(text)
+    ]
+
+
+def summary_text(summary) -> str:
+    # summaries stored by generate_all_xsum_summaries are single-element lists
+    if isinstance(summary, list):
+        return " ".join(summary)
+    return summary
+
+
+class ModelSummaryIndex:
+    """
+    Positional inverted index over the summaries of a single model
+    """
+
+    def __init__(self, postings=None, documents=None):
+        # term -> document id -> [[position, start_offset, end_offset], ...]
+        self.postings = postings if postings is not None else {}
+        # document id -> unique terms of the summary, used to drop stale postings
+        self.documents = documents if documents is not None else {}
+
+    def add(self, document_id: str, summary: str):
+        """
+        Indexes a summary, replacing any previously indexed summary for the document
+
+        Args:
+            document_id: id of the summarized document
+            summary: the summary text
+        """
+        document_id = str(document_id)
+        self.remove(document_id)
+
+        occurrences = defaultdict(list)
+        for position, (term, start, end) in enumerate(tokenize(summary_text(summary))):
+            occurrences[term].append([position, start, end])
+
+        for term, term_occurrences in occurrences.items():
+            self.postings.setdefault(term, {})[document_id] = term_occurrences
+        self.documents[document_id] = list(occurrences.keys())
+
+    def remove(self, document_id: str):
+        """
+        Removes all postings of a document from the index
+
+        Args:
+            document_id: id of the summarized document
+        """
+        for term in self.documents.pop(str(document_id), []):
+            term_postings = self.postings[term]
+            term_postings.pop(str(document_id), None)
+            if len(term_postings) == 0:
+                del self.postings[term]
+
+    def term(self, term: str) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        Looks up a single term
+
+        Args:
+            term: the term to look up (case insensitive)
+
+        Returns:
+            dictionary of document id -> list of (start_offset, end_offset)
+        """
+        return {
+            document_id: [(start, end) for _, start, end in occurrences]
+            for document_id, occurrences in self.postings.get(term.lower(), {}).items()
+        }
+
+    def phrase(self, terms: List[str]) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        Looks up a sequence of consecutive terms
+
+        Args:
+            terms: the terms of the phrase, in order (case insensitive)
+
+        Returns:
+            dictionary of document id -> list of (start_offset, end_offset) spanning the phrase
+        """
+        terms = [term.lower() for term in terms]
+        if len(terms) == 0:
+            return {}
+
+        term_postings = [self.postings.get(term, {}) for term in terms]
+        # intersect starting from the rarest term
+        candidates = set(min(term_postings, key=len).keys())
+        for postings in term_postings:
+            candidates &= postings.keys()
+
+        matches = {}
+        for document_id in candidates:
+            positions = [
+                {
+                    position: (start, end)
+                    for position, start, end in postings[document_id]
+                }
+                for postings in term_postings
+            ]
+            spans = [
+                (positions[0][first][0], positions[-1][first + len(terms) - 1][1])
+                for first in sorted(positions[0])
+                if all(first + i in positions[i] for i in range(1, len(terms)))
+            ]
+            if len(spans) > 0:
+                matches[document_id] = spans
+        return matches
+
+    def vocabulary(self) -> Iterable[str]:
+        return self.postings.keys()
+
+    def save(self, file_path: str):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path + ".tmp", "w") as f:
+            json.dump({"postings": self.postings, "documents": self.documents}, f)
+        os.replace(file_path + ".tmp", file_path)
+
+    @classmethod
+    def load(cls, file_path: str):
+        with open(file_path, "r") as f:
+            stored_index = json.load(f)
+        return cls(stored_index["postings"], stored_index["documents"])
+
+    @classmethod
+    def from_summaries(cls, stored_summaries: Dict[str, Dict]):
+        """
+        Builds an index from stored summaries, as returned by get_summaries
+
+        Args:
+            stored_summaries: dictionary of document id -> {"summary": ..., "metadata": ...}
+
+        Returns:
+            ModelSummaryIndex
+        """
+        model_index = cls()
+        for document_id, stored_summary in stored_summaries.items():
+            model_index.add(document_id, stored_summary["summary"])
+        return model_index
+
+
+def pending_path(dataset: str, model: str):
+    return f"{index_dir(dataset)}/{storage.slugify(model)}-index.pending.jsonl"
+
+
+def _mtime(path: str):
+    return os.path.getmtime(path) if os.path.exists(path) else 0.0
+
+
+@contextmanager
+def _index_lock(dataset: str, model: str):
+    # serializes index builds, merges & pending appends across processes
+    os.makedirs(index_dir(dataset), exist_ok=True)
+    with open(f"{index_dir(dataset)}/{storage.slugify(model)}-index.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_model_index(dataset: str, model: str) -> ModelSummaryIndex:
+    """
+    Loads the summary index of a model and merges pending updates into it.
+    The index is (re)built from storage if it is missing or older than the stored summaries
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored summaries
+
+    Returns:
+        ModelSummaryIndex
+    """
+    with _index_lock(dataset, model):
+        return _load_model_index(dataset, model)
+
+
+def _load_model_index(dataset: str, model: str) -> ModelSummaryIndex:
+    path = index_path(dataset, model)
+    pending = pending_path(dataset, model)
+    summaries_path = storage.summaries_path(dataset, model)
+
+    if os.path.exists(path) and max(_mtime(path), _mtime(pending)) >= _mtime(
+        summaries_path
+    ):
+        model_index = ModelSummaryIndex.load(path)
+        if os.path.exists(pending):
+            with open(pending, "r") as f:
+                for line in f:
+                    update = json.loads(line)
+                    model_index.add(update["id"], update["summary"])
+            model_index.save(path)
+            os.remove(pending)
+        return model_index
+
+    if storage.slugify(model) in storage.get_models(dataset):
+        model_index = ModelSummaryIndex.from_summaries(
+            storage.get_summaries(dataset, storage.slugify(model))
+        )
+    else:
+        model_index = ModelSummaryIndex()
+    model_index.save(path)
+    if os.path.exists(pending):
+        os.remove(pending)
+    return model_index
+
+
+def update_summary_index(dataset: str, model: str, summaries: Dict[str, str]):
+    """
+    Adds newly stored summaries to the model's summary index,
+    called by store_model_summaries after every write.
+    Updates are appended to a pending file and merged into the index on the next load,
+    so a write costs O(written summaries) instead of rewriting the whole index.
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id used to index into stored summaries
+        summaries: dictionary of document id -> summary
+    """
+    with _index_lock(dataset, model):
+        if not os.path.exists(index_path(dataset, model)):
+            # first write for this model (or index deleted), index everything stored
+            _load_model_index(dataset, model)
+            return
+
+        with open(pending_path(dataset, model), "a") as f:
+            f.write(
+                "".join(
+                    json.dumps({"id": str(document_id), "summary": summary}) + "\n"
+                    for document_id, summary in summaries.items()
+                )
+            )
+
+
+class SummaryIndex:
+    """
+    Term & phrase search over the stored summaries of every model in a dataset
+    """
+
+    def __init__(self, dataset: str, models: Optional[List[str]] = None):
+        """
+        Args:
+            dataset: dataset name, i.e. "xsum"
+            models: model ids to load, defaults to all models in get_models(dataset)
+        """
+        self.dataset = dataset
+        if models is None:
+            models = storage.get_models(dataset)
+        self.model_indices = {
+            storage.slugify(model): load_model_index(dataset, model) for model in models
+        }
+
+    def _selected(self, models: Optional[List[str]]):
+        if models is None:
+            return self.model_indices.items()
+        selected = [storage.slugify(model) for model in models]
+        return [
+            (model, self.model_indices[model])
+            for model in selected
+            if model in self.model_indices
+        ]
+
+    def term(self, term: str, models: Optional[List[str]] = None) -> List[SummaryMatch]:
+        """
+        Finds summaries containing a term
+
+        Args:
+            term: the term to look up (case insensitive)
+            models: only search summaries of these models, defaults to all models
+
+        Returns:
+            list of (model, document id, [(start_offset, end_offset), ...])
+        """
+        return [
+            (model, document_id, offsets)
+            for model, model_index in self._selected(models)
+            for document_id, offsets in model_index.term(term).items()
+        ]
+
+    def phrase(
+        self, phrase: str, models: Optional[List[str]] = None
+    ) -> List[SummaryMatch]:
+        """
+        Finds summaries containing a phrase, i.e. "according to"
+
+        Args:
+            phrase: the phrase to look up, tokenized the same way as summaries
+            models: only search summaries of these models, defaults to all models
+
+        Returns:
+            list of (model, document id, [(start_offset, end_offset), ...])
+        """
+        terms = [term for term, _, _ in tokenize(phrase)]
+        return [
+            (model, document_id, offsets)
+            for model, model_index in self._selected(models)
+            for document_id, offsets in model_index.phrase(terms).items()
+        ]
+
+    def pattern(
+        self, pattern: str, models: Optional[List[str]] = None
+    ) -> List[SummaryMatch]:
+        """
+        Finds summaries containing a term that fully matches a regular expression,
+        i.e. r"(19|20)\\d\\d" for summaries mentioning a year.
+        Only the index vocabulary is scanned, not the summaries.
+
+        Args:
+            pattern: regular expression matched against lowercased terms
+            models: only search summaries of these models, defaults to all models
+
+        Returns:
+            list of (model, document id, [(start_offset, end_offset), ...])
+        """
+        regex = re.compile(pattern)
+        matches = []
+        for model, model_index in self._selected(models):
+            offsets_by_document = defaultdict(list)
+            for term in model_index.vocabulary():
+                if regex.fullmatch(term):
+                    for document_id, offsets in model_index.term(term).items():
+                        offsets_by_document[document_id].extend(offsets)
+            matches.extend(
+                (model, document_id, sorted(offsets))
+                for document_id, offsets in offsets_by_document.items()
+            )
+        return matches
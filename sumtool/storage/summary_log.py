@@ -0,0 +1,202 @@
+"""
+Append-only, log-structured storage for model summaries.
+
+Every write appends one line per document to /data/<dataset>/<model-id>-summaries.jsonl,
+the latest record of a document wins:
+
+    <document-id>\\t{"summary": "...", "metadata": {...}}
+
+An in-memory index of document id -> (byte offset, length) of the latest record is built
+by a single scan of the file and extended incrementally as the file grows, so reading one
+document is a seek + one json.loads. Stale records are dropped by compaction, which runs
+automatically once they outnumber the live records. Appends & compactions hold an exclusive
+flock on <path>.lock, so a compaction never drops records appended by another process.
+"""
+
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# compact when stale records exceed live records, but never for tiny logs
+COMPACTION_MIN_STALE_RECORDS = 1000
+
+
+class SummaryLog:
+    """
+    Append-only summary log of a single model with an in-memory offset index
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # document id -> (offset, length) of the latest record
+        self.offsets: Dict[str, Tuple[int, int]] = {}
+        self.num_records = 0
+        # open handle of the file the index was built from, so its inode is not reused
+        # by another file after a compaction replaces it, and its indexed size
+        self._file = None
+        self._indexed_size = 0
+
+    def _refresh(self):
+        """
+        Bring the offset index up to date, scanning only bytes appended since the last refresh
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset(None)
+            return
+
+        if self._file is None or os.fstat(self._file.fileno()).st_ino != stat.st_ino:
+            # compacted or replaced, rebuild the index from scratch
+            self._reset(open(self.path, "rb"))
+        size = os.fstat(self._file.fileno()).st_size
+        if size == self._indexed_size:
+            return
+
+        self._file.seek(self._indexed_size)
+        offset = self._indexed_size
+        for line in self._file:
+            if not line.endswith(b"\n"):
+                # partially written record, picked up on the next refresh
+                break
+            document_id, _, _ = line.partition(b"\t")
+            self.offsets[document_id.decode("utf-8")] = (offset, len(line))
+            self.num_records += 1
+            offset += len(line)
+        self._indexed_size = offset
+
+    def _reset(self, file):
+        if self._file is not None:
+            self._file.close()
+        self.offsets, self.num_records = {}, 0
+        self._file, self._indexed_size = file, 0
+
+    def _read(self, offset: int, length: int) -> bytes:
+        # reads the indexed file, even if a compaction has replaced it since the refresh
+        return os.pread(self._file.fileno(), length, offset)
+
+    def __len__(self):
+        self._refresh()
+        return len(self.offsets)
+
+    def __contains__(self, document_id):
+        self._refresh()
+        return str(document_id) in self.offsets
+
+    def document_ids(self):
+        self._refresh()
+        return list(self.offsets.keys())
+
+    @property
+    def stale_records(self):
+        self._refresh()
+        return self.num_records - len(self.offsets)
+
+    def get(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Read the latest record of a document
+
+        Args:
+            document_id: id of the summarized document
+
+        Returns:
+            {"summary": ..., "metadata": ...} or None if the document is not stored
+        """
+        self._refresh()
+        if str(document_id) not in self.offsets:
+            return None
+        return self._decode(self._read(*self.offsets[str(document_id)]))
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Iterate over the latest record of every document, in file order
+
+        Yields:
+            (document id, {"summary": ..., "metadata": ...})
+        """
+        self._refresh()
+        for offset, length in sorted(self.offsets.values()):
+            line = self._read(offset, length)
+            document_id, _, _ = line.partition(b"\t")
+            yield document_id.decode("utf-8"), self._decode(line)
+
+    @staticmethod
+    def _decode(line: bytes) -> Dict[str, Any]:
+        _, _, record = line.partition(b"\t")
+        return json.loads(record)
+
+    @staticmethod
+    def _encode(document_id: str, record: Dict[str, Any]) -> bytes:
+        return (
+            str(document_id) + "\t" + json.dumps(record, separators=(",", ":")) + "\n"
+        ).encode("utf-8")
+
+    @contextmanager
+    def _lock(self):
+        # a separate lock file, the log itself is replaced by compaction
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def append(self, records: Dict[str, Dict[str, Any]]):
+        """
+        Append records, overriding earlier records of the same documents
+
+        Args:
+            records: dictionary of document id -> {"summary": ..., "metadata": ...}
+        """
+        data = b"".join(
+            self._encode(document_id, record) for document_id, record in records.items()
+        )
+        with self._lock():
+            with open(self.path, "ab") as f:
+                f.write(data)
+
+            if (
+                self.stale_records >= COMPACTION_MIN_STALE_RECORDS
+                and self.stale_records > len(self.offsets)
+            ):
+                self._compact()
+
+    def compact(self):
+        """
+        Rewrite the log with only the latest record of every document
+        """
+        with self._lock():
+            self._compact()
+
+    def _compact(self):
+        # under the lock, so the index covers every record appended before the replace
+        self._refresh()
+        if self._file is None:
+            return
+        tmp_path = self.path + ".compact"
+        with open(tmp_path, "wb") as dst:
+            for offset, length in sorted(self.offsets.values()):
+                dst.write(self._read(offset, length))
+        os.replace(tmp_path, self.path)
+        self._refresh()
+
+
+_summary_logs: Dict[str, SummaryLog] = {}
+
+
+def open_summary_log(path: str) -> SummaryLog:
+    """
+    Get the process-wide SummaryLog of a path, so its offset index is built only once
+
+    Args:
+        path: path of the summary log file
+
+    Returns:
+        SummaryLog
+    """
+    if path not in _summary_logs:
+        _summary_logs[path] = SummaryLog(path)
+    return _summary_logs[path]
@@ -0,0 +1,357 @@
+"""
+Compact binary storage for per-token generation metadata.
+
+Per-token metadata of generated summaries (see generate_xsum_summary.generate_summaries)
+is appended to /data/<dataset>/<model-id>-token-metadata.bin, one binary record per summary,
+and the summary metadata only keeps a reference to it:
+
+    "metadata": {"token_metadata": {"offset": 1024, "length": 480, "num_tokens": 12}}
+
+A record is a header followed by fixed-width little-endian arrays:
+
+    header: magic b"TKM1", num_tokens (uint32), top_k (uint32), text length (uint32)
+    token_id        int32[num_tokens]
+    entropy         float32[num_tokens]
+    beam_token_prob float32[num_tokens]
+    beam_idx        int32[num_tokens]
+    top_token_ids   int32[num_tokens, top_k]
+    text_offsets    int32[num_tokens + 1], token strings are text[offsets[i]:offsets[i + 1]]
+    top_probs       float16[num_tokens, top_k]
+    token_in_input  uint8[num_tokens]
+    text            utf-8 bytes of all token strings
+
+Arrays are decoded lazily from the record bytes when accessed.
+
+Rewriting a summary leaves its earlier record in the file, compact_token_metadata
+drops records no stored summary references anymore (see sumtool.storage.cli compact).
+"""
+
+import fcntl
+import os
+import struct
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from sumtool import storage
+
+MAGIC = b"TKM1"
+HEADER = struct.Struct("<4sIII")
+TOP_K = 3
+
+
+def token_metadata_path(dataset: str, model: str):
+    return storage.model_path(dataset, model, "token-metadata.bin")
+
+
+def encode_token_metadata(seq_metadata: List[Dict[str, Any]], top_k: int = TOP_K):
+    """
+    Encode the per-token metadata of one generated summary
+
+    Args:
+        seq_metadata: list of token metadata dicts as returned by generate_summaries
+        top_k: number of top alternatives stored per token, missing alternatives are padded with -1
+
+    Returns:
+        the binary record
+    """
+    num_tokens = len(seq_metadata)
+    top_token_ids = np.full((num_tokens, top_k), -1, dtype="<i4")
+    top_probs = np.zeros((num_tokens, top_k), dtype="<f2")
+    for i, token in enumerate(seq_metadata):
+        for j, alternative in enumerate(token.get("beam_top_probs", [])[:top_k]):
+            top_token_ids[i, j] = int(alternative["token_id"])
+            top_probs[i, j] = alternative["beam_token_prob"]
+
+    token_texts = [token["token"].encode("utf-8") for token in seq_metadata]
+    text_offsets = np.zeros(num_tokens + 1, dtype="<i4")
+    text_offsets[1:] = np.cumsum([len(text) for text in token_texts])
+    text = b"".join(token_texts)
+
+    def column(key, dtype, default=0):
+        return np.array(
+            [token.get(key, default) for token in seq_metadata], dtype=dtype
+        ).tobytes()
+
+    return b"".join(
+        [
+            HEADER.pack(MAGIC, num_tokens, top_k, len(text)),
+            np.array(
+                [int(token["token_id"]) for token in seq_metadata], dtype="<i4"
+            ).tobytes(),
+            column("entropy", "<f4"),
+            column("beam_token_prob", "<f4"),
+            column("beam_idx", "<i4"),
+            top_token_ids.tobytes(),
+            text_offsets.tobytes(),
+            top_probs.tobytes(),
+            column("token_in_input", "u1", False),
+            text,
+        ]
+    )
+
+
+class TokenMetadata:
+    """
+    Lazily decoded per-token metadata of one generated summary
+    """
+
+    def __init__(self, data: bytes):
+        magic, self.num_tokens, self.top_k, text_length = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not a token metadata record")
+        self._data = memoryview(data)
+
+        n, k = self.num_tokens, self.top_k
+        # (name, dtype, shape) in record order
+        layout = [
+            ("token_id", "<i4", (n,)),
+            ("entropy", "<f4", (n,)),
+            ("beam_token_prob", "<f4", (n,)),
+            ("beam_idx", "<i4", (n,)),
+            ("top_token_ids", "<i4", (n, k)),
+            ("text_offsets", "<i4", (n + 1,)),
+            ("top_probs", "<f2", (n, k)),
+            ("token_in_input", "u1", (n,)),
+        ]
+        self._sections = {}
+        offset = HEADER.size
+        for name, dtype, shape in layout:
+            self._sections[name] = (offset, dtype, shape)
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self._text = (offset, text_length)
+
+    def array(self, name: str) -> np.ndarray:
+        """
+        Decode one array of the record, without copying
+
+        Args:
+            name: array name, i.e. "entropy"
+
+        Returns:
+            read-only numpy array
+        """
+        offset, dtype, shape = self._sections[name]
+        count = int(np.prod(shape))
+        return np.frombuffer(
+            self._data, dtype=dtype, count=count, offset=offset
+        ).reshape(shape)
+
+    @property
+    def token_ids(self):
+        return self.array("token_id")
+
+    @property
+    def entropy(self):
+        return self.array("entropy")
+
+    @property
+    def beam_token_prob(self):
+        return self.array("beam_token_prob")
+
+    @property
+    def beam_idx(self):
+        return self.array("beam_idx")
+
+    @property
+    def top_token_ids(self):
+        return self.array("top_token_ids")
+
+    @property
+    def top_probs(self):
+        return self.array("top_probs")
+
+    @property
+    def token_in_input(self):
+        return self.array("token_in_input").astype(bool)
+
+    @property
+    def tokens(self) -> List[str]:
+        offset, length = self._text
+        text = bytes(self._data[offset : offset + length])
+        offsets = self.array("text_offsets")
+        return [
+            text[offsets[i] : offsets[i + 1]].decode("utf-8")
+            for i in range(self.num_tokens)
+        ]
+
+    def tokens_with_entropy(self):
+        """
+        Token strings with their entropy, as stored in json by earlier versions
+
+        Returns:
+            list of (token, entropy)
+        """
+        return list(zip(self.tokens, self.entropy.tolist()))
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """
+        Decode the whole record into token metadata dicts, like generate_summaries returns
+        (without alternative token strings, decode top token ids with the tokenizer)
+
+        Returns:
+            list of token metadata dicts
+        """
+        top_token_ids, top_probs = self.top_token_ids, self.top_probs
+        return [
+            {
+                "token_id": token_id,
+                "token": token,
+                "entropy": entropy,
+                "beam_token_prob": prob,
+                "beam_idx": beam_idx,
+                "beam_top_probs": [
+                    {"token_id": int(i), "beam_token_prob": float(p)}
+                    for i, p in zip(top_token_ids[idx], top_probs[idx])
+                    if i >= 0
+                ],
+                "token_in_input": in_input,
+            }
+            for idx, (token_id, token, entropy, prob, beam_idx, in_input) in enumerate(
+                zip(
+                    self.token_ids.tolist(),
+                    self.tokens,
+                    self.entropy.tolist(),
+                    self.beam_token_prob.tolist(),
+                    self.beam_idx.tolist(),
+                    self.token_in_input.tolist(),
+                )
+            )
+        ]
+
+
+@contextmanager
+def _locked(path: str, mode: str):
+    while True:
+        f = open(path, mode)
+        fcntl.flock(f, fcntl.LOCK_EX)
+        if os.path.exists(path) and os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+            break
+        # replaced by a compaction while waiting for the lock, lock the new file
+        f.close()
+    try:
+        yield f
+    finally:
+        f.close()
+
+
+def append_token_metadata(
+    dataset: str, model: str, token_metadata: Dict[str, List[Dict[str, Any]]]
+) -> Dict[str, Dict[str, int]]:
+    """
+    Append the token metadata of generated summaries to the model's binary file
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+        token_metadata: dictionary of document id -> token metadata dicts of its summary
+
+    Returns:
+        dictionary of document id -> reference to store in the summary metadata
+    """
+    path = token_metadata_path(dataset, model)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    records = {
+        document_id: encode_token_metadata(seq_metadata)
+        for document_id, seq_metadata in token_metadata.items()
+    }
+    references = {}
+    # locked, so the offsets of concurrent appenders are not interleaved
+    with _locked(path, "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(b"".join(records.values()))
+    for document_id, record in records.items():
+        references[document_id] = {
+            "offset": offset,
+            "length": len(record),
+            "num_tokens": len(token_metadata[document_id]),
+        }
+        offset += len(record)
+    return references
+
+
+def load_token_metadata(
+    dataset: str, model: str, reference: Dict[str, int]
+) -> TokenMetadata:
+    """
+    Read the token metadata record of a summary
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+        reference: the "token_metadata" reference stored in the summary metadata
+
+    Returns:
+        TokenMetadata
+    """
+    with open(token_metadata_path(dataset, model), "rb") as f:
+        f.seek(reference["offset"])
+        return TokenMetadata(f.read(reference["length"]))
+
+
+def compact_token_metadata(dataset: str, model: str) -> Optional[Tuple[int, int]]:
+    """
+    Rewrite the model's binary file with only the records referenced by its stored summaries,
+    and store the summaries with their new references. Holds the appenders' lock, but
+    references are stored after appending, so run it while no job writes the model.
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        model: model id
+
+    Returns:
+        (bytes before, bytes after), None if the model has no token metadata
+        or records after the last referenced one, which a running job has not stored yet
+    """
+    path = token_metadata_path(dataset, model)
+    if not os.path.exists(path):
+        return None
+
+    with _locked(path, "rb") as f:
+        stored = storage.get_summaries(dataset, model)
+        references = {
+            document_id: record["metadata"]["token_metadata"]
+            for document_id, record in stored.items()
+            if "token_metadata" in (record.get("metadata") or {})
+        }
+        size = os.fstat(f.fileno()).st_size
+        referenced_end = max(
+            [
+                reference["offset"] + reference["length"]
+                for reference in references.values()
+            ],
+            default=0,
+        )
+        if referenced_end < size:
+            return None
+        if sum(reference["length"] for reference in references.values()) == size:
+            return size, size
+
+        compacted = {}
+        offset = 0
+        with open(path + ".compact", "wb") as dst:
+            for document_id, reference in sorted(
+                references.items(), key=lambda item: item[1]["offset"]
+            ):
+                f.seek(reference["offset"])
+                dst.write(f.read(reference["length"]))
+                compacted[document_id] = {**reference, "offset": offset}
+                offset += reference["length"]
+        os.replace(path + ".compact", path)
+
+        storage.store_model_summaries(
+            dataset,
+            model,
+            {},
+            {document_id: stored[document_id]["summary"] for document_id in compacted},
+            {
+                document_id: {
+                    **stored[document_id]["metadata"],
+                    "token_metadata": reference,
+                }
+                for document_id, reference in compacted.items()
+            },
+        )
+    return size, offset
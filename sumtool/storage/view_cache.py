@@ -0,0 +1,103 @@
+"""
+Persistent cache of records derived from (huggingface) datasets, i.e. the aligned & view-prepared
+annotations loaded on every start of the streamlit interface.
+
+Records are stored in an Arrow IPC file, keyed by the fingerprints of the source datasets:
+
+    /data/<dataset>/index/<name>-<fingerprint>.arrow
+
+    id      record
+    "1001"  "{\"document\": ..., \"factuality_data\": ...}"
+
+The file is memory mapped on load, and rebuilt only when the fingerprint changes,
+i.e. when a source dataset or the version of the derivation changes.
+"""
+
+import hashlib
+import json
+import os
+from glob import glob
+from typing import Any, Callable, Dict
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from sumtool import storage
+
+
+def dataset_fingerprint(*datasets, version: Any = None) -> str:
+    """
+    Fingerprint of the source datasets of a derivation
+
+    Args:
+        datasets: huggingface datasets.Dataset (fingerprinted on load & transformation by huggingface)
+        version: version of the derivation, change it to invalidate cached records
+
+    Returns:
+        hex digest
+    """
+    fingerprints = [dataset._fingerprint for dataset in datasets]
+    content = json.dumps([fingerprints, version], sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def cache_path(dataset: str, name: str, fingerprint: str):
+    return f"{storage.dataset_dir(dataset)}/index/{name}-{fingerprint}.arrow"
+
+
+def _write_records(path: str, records: Dict[str, Any]):
+    table = pa.table(
+        {
+            "id": pa.array(list(records.keys()), pa.string()),
+            "record": pa.array(
+                [json.dumps(record) for record in records.values()], pa.string()
+            ),
+        }
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with pa.OSFile(f"{path}.{os.getpid()}.tmp", "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+
+def _read_records(path: str) -> Dict[str, Any]:
+    with pa.memory_map(path, "r") as source:
+        table = ipc.open_file(source).read_all()
+        return {
+            document_id: json.loads(record)
+            for document_id, record in zip(
+                table.column("id").to_pylist(), table.column("record").to_pylist()
+            )
+        }
+
+
+def cached_records(
+    dataset: str,
+    name: str,
+    fingerprint: str,
+    build: Callable[[], Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Load derived records from the cache, building & storing them if the fingerprint changed
+
+    Args:
+        dataset: dataset name, i.e. "xsum"
+        name: name of the derivation, i.e. "annotated-view"
+        fingerprint: fingerprint of the sources, see dataset_fingerprint
+        build: function building the records, dictionary of id -> json serializable record
+
+    Returns:
+        dictionary of id -> record
+    """
+    path = cache_path(dataset, name, fingerprint)
+    if os.path.exists(path):
+        return _read_records(path)
+
+    records = build()
+    _write_records(path, records)
+    # records of previous fingerprints are never read again
+    for stale in glob(cache_path(dataset, name, "*")):
+        if stale != path:
+            os.remove(stale)
+    return records
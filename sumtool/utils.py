@@ -17,3 +17,18 @@ def entropy(p_dist: torch.Tensor) -> float:
         p_dist,
         p_dist.log()
     ).sum(0).item()
+
+
+def batched_entropy(log_probs: torch.Tensor) -> torch.Tensor:
+    """
+    Calculates Shannon entropy for a batch of log probability distributions
+
+    Args:
+        log_probs: log probabilities, distributions over the last dimension (torch.Tensor)
+
+    Returns:
+        entropies (torch.Tensor), one per distribution
+    """
+    # xlogy(0, 0) = 0, so zero probabilities (-inf log probs) don't produce nan
+    probs = log_probs.exp()
+    return - torch.xlogy(probs, probs).sum(-1)
@@ -1,27 +1,196 @@
+from collections.abc import Mapping
 from datasets import load_dataset
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, IterableDataset, get_worker_info
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import pprint
 
 
+def arrow_table(data):
+    """
+    Arrow table of a dataset split. Memory mapped huggingface datasets are not copied,
+    except for the selected rows of a select/shuffle/filter indices mapping
+
+    Args:
+        data: huggingface datasets.Dataset, pyarrow.Table or list of dicts
+
+    Returns:
+        pyarrow.Table
+    """
+    table, indices = _table_and_indices(data)
+    return table.take(indices) if indices is not None else table
+
+
+def _table_and_indices(data):
+    if isinstance(data, pa.Table):
+        return data, None
+    if hasattr(data, "data"):
+        # huggingface datasets.Dataset, the arrow table is memory mapped from the dataset cache
+        table = getattr(data.data, "table", data.data)
+        indices = getattr(data, "_indices", None)
+        if indices is not None:
+            # select/shuffle/filter keep the original table and an indices mapping
+            return table, getattr(indices, "table", indices).column(0)
+        return table, None
+    return pa.Table.from_pylist(list(data)), None
+
+
+def _is_table(data) -> bool:
+    return isinstance(data, pa.Table) or hasattr(data, "data")
+
+
+def _string_ids(column) -> np.ndarray:
+    return pc.cast(column, pa.string()).to_numpy(zero_copy_only=False).astype(str)
+
+
+def _build_item(xsum_row, factuality_rows, faithfulness_rows):
+    item = {
+        "id": xsum_row["id"],
+        "document": xsum_row["document"],
+        "true_summary": xsum_row["summary"],
+        "factuality_data": {},
+        "faithfulness_data": {},
+    }
+    for data in factuality_rows:
+        _add_factuality(item, data)
+    for data in faithfulness_rows:
+        _add_faithfulness(item, data)
+    return item
+
+
+def _add_factuality(item, data):
+    if data["system"] in item["factuality_data"]:
+        item["factuality_data"][data["system"]]["labels"][str(data["worker_id"])] = (
+            data["is_factual"]
+        )
+    else:
+        item["factuality_data"][data["system"]] = {
+            "system": data["system"],
+            "summary": data["summary"],
+            "labels": {data["worker_id"]: data["is_factual"]},
+        }
+
+
+def _add_faithfulness(item, data):
+    annotation = {
+        "worker_id": data["worker_id"],
+        "hallucination_type": data["hallucination_type"],
+        # spans of hallucinations seem off by one character --> one-indexing vs zero-indexing?
+        "hallucinated_span": data["summary"][
+            data["hallucinated_span_start"] - 1 : data["hallucinated_span_end"]
+        ],
+        "hallucinated_span_start": data["hallucinated_span_start"],
+        "hallucinated_span_end": data["hallucinated_span_end"],
+    }
+    if data["system"] in item["faithfulness_data"]:
+        item["faithfulness_data"][data["system"]]["labels"].append(annotation)
+    else:
+        item["faithfulness_data"][data["system"]] = {
+            "system": data["system"],
+            "summary": data["summary"],
+            "labels": [annotation],
+        }
+
+
+class _AlignedAnnotations:
+    """
+    Annotation rows grouped by the xsum row of their bbcid:
+    the rows of document i are table.take(order[offsets[i] : offsets[i + 1]])
+    """
+
+    def __init__(self, table, xsum_rows, num_documents):
+        self.table = table
+        # stable, so annotations of a document keep their original order
+        self.order = np.argsort(xsum_rows, kind="stable")
+        self.offsets = np.searchsorted(
+            xsum_rows[self.order], np.arange(num_documents + 1)
+        )
+
+    def counts(self):
+        return np.diff(self.offsets)
+
+    def rows(self, idx):
+        return self.table.take(
+            self.order[self.offsets[idx] : self.offsets[idx + 1]]
+        ).to_pylist()
+
+
+class _DataById(Mapping):
+    """
+    Read-only bbc id -> item mapping, items are built when accessed
+    """
+
+    def __init__(self, dataset):
+        self._dataset = dataset
+
+    def __getitem__(self, bbc_id):
+        idx = self._dataset.index_of(bbc_id)
+        if idx is None:
+            raise KeyError(bbc_id)
+        return self._dataset[idx]
+
+    def __contains__(self, bbc_id):
+        return self._dataset.index_of(bbc_id) is not None
+
+    def __iter__(self):
+        return iter(self._dataset.ids)
+
+    def __len__(self):
+        return len(self._dataset)
+
+
 class XsumDataset(Dataset):
     def __init__(self, xsum_data, factuality_data=None, faithfulness_data=None):
         self.xsum_data = xsum_data
         self.factuality_data = factuality_data
         self.faithfulness_data = faithfulness_data
-        self.dataset = list(self._align_data().values())
-        self.data_by_id = {x["id"]: x for x in self.dataset}
+        # documents stay in the memory mapped table, indices map rows of a selected split to it
+        table, self._indices = _table_and_indices(xsum_data)
+        self._xsum = table.select(["id", "document", "summary"])
+        self._align_data()
+        self.data_by_id = _DataById(self)
+
+    @property
+    def dataset(self):
+        # items used to be materialized in a list, the dataset itself is indexable
+        return self
+
+    @property
+    def ids(self):
+        return self._ids.tolist()
+
+    def index_of(self, bbc_id):
+        """
+        Row index of a bbc id, a binary search in the sorted ids
+
+        Args:
+            bbc_id: id of the bbc article
+
+        Returns:
+            the row index, None if the article is not in the dataset
+        """
+        idx = self._rows_of(np.array([str(bbc_id)]))[0]
+        return int(idx) if idx >= 0 else None
+
+    def _rows_of(self, bbc_ids):
+        pos = np.searchsorted(self._sorted_ids, bbc_ids)
+        pos = np.minimum(pos, len(self._sorted_ids) - 1)
+        found = (len(self._sorted_ids) > 0) & (self._sorted_ids[pos] == bbc_ids)
+        return np.where(found, self._id_order[pos], -1)
 
     def query_by_bbc_id(self, bbc_id):
-        if str(bbc_id) in self.data_by_id:
-            return self.data_by_id[str(bbc_id)]
+        idx = self.index_of(bbc_id)
+        if idx is not None:
+            return self[idx]
         raise ValueError(f"no article for bbc_id: {bbc_id}")
 
     def _align_data(self):
         """
-        Aligns data in xsum, factuality, and faithfulness datasets:
+        Aligns data in xsum, factuality, and faithfulness datasets with a vectorized join on bbcid.
+        Items are built from the aligned arrow tables when accessed:
 
-        Returns:
-            dataset:  Dict(id, {
+            {
                 'id': id of bbc article,
                 'document': original document,
                 'true_summary': true summary,
@@ -42,75 +211,178 @@ class XsumDataset(Dataset):
                         ]
                     })
                 })
+        """
+        ids = self._xsum.column("id")
+        if self._indices is not None:
+            ids = pc.take(ids, self._indices)
+        self._ids = _string_ids(ids)
+        self._id_order = np.argsort(self._ids, kind="stable")
+        self._sorted_ids = self._ids[self._id_order]
+
+        self._factuality = self._align_annotations(self.factuality_data, "factuality")
+        self._faithfulness = self._align_annotations(
+            self.faithfulness_data, "faithfulness"
+        )
 
+    def _align_annotations(self, data, name):
+        if data is None:
+            return None
+        table = arrow_table(data)
+        bbc_ids = _string_ids(table.column("bbcid"))
+        xsum_rows = self._rows_of(bbc_ids)
+        if (xsum_rows < 0).any():
+            print(
+                "ERROR: New datapoint in {}: {}".format(
+                    name, bbc_ids[np.argmax(xsum_rows < 0)]
+                )
+            )
+            exit()
+        return _AlignedAnnotations(table, xsum_rows, len(self))
+
+    def annotated_indices(self):
         """
+        Row indices of the documents with factuality or faithfulness annotations
 
-        dataset = {}
-
-        for data in self.xsum_data:
-            dataset[str(data["id"])] = {
-                "id": data["id"],
-                "document": data["document"],
-                "true_summary": data["summary"],
-                "factuality_data": {},
-                "faithfulness_data": {},
-            }
-
-        if self.factuality_data is not None:
-            for data in self.factuality_data:
-                if str(data["bbcid"]) not in dataset:
-                    print(
-                        "ERROR: New datapoint in factuality: {}".format(data["bbcid"])
-                    )
-                    exit()
-
-                if data["system"] in dataset[str(data["bbcid"])]["factuality_data"]:
-                    dataset[str(data["bbcid"])]["factuality_data"][data["system"]][
-                        "labels"
-                    ][str(data["worker_id"])] = data["is_factual"]
-                else:
-                    dataset[str(data["bbcid"])]["factuality_data"][data["system"]] = {
-                        "system": data["system"],
-                        "summary": data["summary"],
-                        "labels": {data["worker_id"]: data["is_factual"]},
-                    }
-
-        if self.faithfulness_data is not None:
-            for data in self.faithfulness_data:
-                if str(data["bbcid"]) not in dataset:
-                    print(
-                        "ERROR: New datapoint in faithfulness: {}".format(data["bbcid"])
-                    )
-                    exit()
-
-                annotation = {
-                    "worker_id": data["worker_id"],
-                    "hallucination_type": data["hallucination_type"],
-                    # spans of hallucinations seem off by one character --> one-indexing vs zero-indexing?
-                    "hallucinated_span": data["summary"][
-                        data["hallucinated_span_start"]
-                        - 1 : data["hallucinated_span_end"]
-                    ],
-                    "hallucinated_span_start": data["hallucinated_span_start"],
-                    "hallucinated_span_end": data["hallucinated_span_end"],
-                }
-                if data["system"] in dataset[str(data["bbcid"])]["faithfulness_data"]:
-                    dataset[str(data["bbcid"])]["faithfulness_data"][data["system"]][
-                        "labels"
-                    ].append(annotation)
-                else:
-                    dataset[str(data["bbcid"])]["faithfulness_data"][data["system"]] = {
-                        "system": data["system"],
-                        "summary": data["summary"],
-                        "labels": [annotation],
-                    }
-        return dataset
+        Returns:
+            numpy array of row indices
+        """
+        counts = np.zeros(len(self), dtype=np.int64)
+        for annotations in [self._factuality, self._faithfulness]:
+            if annotations is not None:
+                counts += annotations.counts()
+        return np.flatnonzero(counts)
 
     def __len__(self):
-        return len(self.dataset)
+        return len(self._indices) if self._indices is not None else len(self._xsum)
 
     def __getitem__(self, idx):
-        return self.dataset[idx]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError(f"index {idx} out of range")
+        row = self._indices[idx].as_py() if self._indices is not None else idx
+        return _build_item(
+            self._xsum.slice(row, 1).to_pylist()[0],
+            self._factuality.rows(idx) if self._factuality is not None else [],
+            self._faithfulness.rows(idx) if self._faithfulness is not None else [],
+        )
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class _AnnotationsById:
+    """
+    Annotation rows grouped by bbcid, looked up with a binary search in the sorted bbcids
+    """
+
+    def __init__(self, data):
+        self.table = arrow_table(data)
+        bbc_ids = _string_ids(self.table.column("bbcid"))
+        self.order = np.argsort(bbc_ids, kind="stable")
+        self.ids, self.starts = np.unique(bbc_ids[self.order], return_index=True)
+        self.ends = np.append(self.starts[1:], len(self.order))
+
+    def rows(self, bbc_id):
+        pos = np.searchsorted(self.ids, bbc_id)
+        if pos == len(self.ids) or self.ids[pos] != bbc_id:
+            return []
+        return self.table.take(
+            self.order[self.starts[pos] : self.ends[pos]]
+        ).to_pylist()
+
+
+class StreamingXsumDataset(IterableDataset):
+    """
+    Iterable variant of XsumDataset, for splits or corpora that should not be aligned up front.
+
+    Articles are read in batches (from memory mapped arrow tables, or any iterable of
+    id/document/summary records such as streaming huggingface datasets) and joined with
+    their annotations on the fly, so memory is bounded by the annotation tables and one batch.
+    Items are split between DataLoader workers, and between processes with num_shards & shard_index.
+
+    Annotations of articles that are not in xsum_data are never yielded.
+    """
+
+    def __init__(
+        self,
+        xsum_data,
+        factuality_data=None,
+        faithfulness_data=None,
+        batch_size: int = 1000,
+        num_shards: int = 1,
+        shard_index: int = 0,
+    ):
+        """
+        Args:
+            xsum_data: huggingface datasets.Dataset or IterableDataset, pyarrow.Table or
+                iterable of dicts with id, document & summary
+            factuality_data: optional xsum_factuality annotations
+            faithfulness_data: optional xsum_faithfulness annotations
+            batch_size: number of articles read at once
+            num_shards: number of processes sharing the dataset, i.e. the distributed world size
+            shard_index: index of this process, i.e. the distributed rank
+        """
+        self.xsum_data = xsum_data
+        self.batch_size = batch_size
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+        self._factuality = (
+            _AnnotationsById(factuality_data) if factuality_data is not None else None
+        )
+        self._faithfulness = (
+            _AnnotationsById(faithfulness_data)
+            if faithfulness_data is not None
+            else None
+        )
+
+    def _shard(self):
+        worker_info = get_worker_info()
+        num_workers = worker_info.num_workers if worker_info is not None else 1
+        worker_id = worker_info.id if worker_info is not None else 0
+        return (
+            self.num_shards * num_workers,
+            self.shard_index * num_workers + worker_id,
+        )
+
+    def _table_rows(self, num_shards, shard):
+        table, indices = _table_and_indices(self.xsum_data)
+        table = table.select(["id", "document", "summary"])
+        num_rows = len(indices) if indices is not None else len(table)
+        # contiguous row ranges, so every shard reads its own part of the file
+        start = num_rows * shard // num_shards
+        stop = num_rows * (shard + 1) // num_shards
+        for offset in range(start, stop, self.batch_size):
+            length = min(self.batch_size, stop - offset)
+            if indices is not None:
+                batch = table.take(indices.slice(offset, length))
+            else:
+                batch = table.slice(offset, length)
+            yield from batch.to_pylist()
+
+    def _iterable_rows(self, num_shards, shard):
+        for i, row in enumerate(self.xsum_data):
+            if i % num_shards == shard:
+                yield row
+
+    def __iter__(self):
+        num_shards, shard = self._shard()
+        if _is_table(self.xsum_data):
+            rows = self._table_rows(num_shards, shard)
+        else:
+            rows = self._iterable_rows(num_shards, shard)
+        for row in rows:
+            bbc_id = str(row["id"])
+            yield _build_item(
+                row,
+                self._factuality.rows(bbc_id) if self._factuality is not None else [],
+                (
+                    self._faithfulness.rows(bbc_id)
+                    if self._faithfulness is not None
+                    else []
+                ),
+            )
 
 
 if __name__ == "__main__":
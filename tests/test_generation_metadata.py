@@ -0,0 +1,124 @@
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from sumtool.generate_xsum_summary import _generation_metadata  # noqa: E402
+from sumtool.utils import entropy  # noqa: E402
+
+VOCAB_SIZE = 12
+EOS_TOKEN_ID = 2
+
+
+class FakeTokenizer:
+    name_or_path = "fake"
+    eos_token_id = EOS_TOKEN_ID
+
+    def __len__(self):
+        return VOCAB_SIZE
+
+    def decode(self, token_ids):
+        return " ".join(f"t{int(token_id)}" for token_id in token_ids)
+
+
+def _per_item_metadata(tokenizer, input_token_ids, model_output):
+    # the implementation before batching: exp of the raw scores, one item at a time
+    token_metadata = []
+    input_set = input_token_ids.view(-1).tolist()
+    for seq_idx in range(model_output.sequences.shape[0]):
+        seq_metadata = []
+        token_metadata.append(seq_metadata)
+        for idx, output_token_id in enumerate(model_output.sequences[seq_idx][1:]):
+            beam_idx = model_output.beam_indices[seq_idx][idx]
+            selected_beam_probs = torch.exp(model_output.scores[idx][beam_idx])
+            top_probs = torch.topk(selected_beam_probs, k=3)
+            seq_metadata.append(
+                {
+                    "token_id": output_token_id.item(),
+                    "entropy": entropy(selected_beam_probs),
+                    "beam_token_prob": selected_beam_probs[output_token_id].item(),
+                    "beam_idx": beam_idx.item(),
+                    "beam_top_probs": [
+                        {"token_id": i.item(), "beam_token_prob": v.item()}
+                        for i, v in zip(top_probs.indices, top_probs.values)
+                    ],
+                    "token_in_input": output_token_id.item() in input_set,
+                }
+            )
+    return token_metadata
+
+
+@pytest.fixture
+def generation():
+    generator = torch.Generator().manual_seed(0)
+    num_sequences, num_beams, num_steps = 2, 2, 4
+    inputs = SimpleNamespace(
+        input_ids=torch.tensor([[0, 5, 6, 7, 2], [0, 8, 9, 2, 1]]),
+        attention_mask=torch.tensor([[1, 1, 1, 1, 1], [1, 1, 1, 1, 0]]),
+    )
+    # beam search scores are log probabilities, normalized unless a processor masks tokens
+    scores = tuple(
+        torch.randn(
+            num_sequences * num_beams, VOCAB_SIZE, generator=generator
+        ).log_softmax(dim=-1)
+        for _ in range(num_steps)
+    )
+    model_output = SimpleNamespace(
+        sequences=torch.tensor([[2, 5, 8, 6, 4], [2, 9, 5, 10, 3]]),
+        scores=scores,
+        beam_indices=torch.tensor([[0, 1, 0, 0], [2, 3, 3, 2]]),
+    )
+    return inputs, model_output
+
+
+def test_generation_metadata_matches_per_item_implementation(generation):
+    inputs, model_output = generation
+    tokenizer = FakeTokenizer()
+    batched = _generation_metadata(tokenizer, inputs, model_output)
+    per_item = _per_item_metadata(tokenizer, inputs.input_ids, model_output)
+
+    assert [len(x) for x in batched] == [len(x) for x in per_item]
+    for batched_seq, per_item_seq in zip(batched, per_item):
+        for token, expected in zip(batched_seq, per_item_seq):
+            assert token["token_id"] == expected["token_id"]
+            assert token["beam_idx"] == expected["beam_idx"]
+            assert token["entropy"] == pytest.approx(expected["entropy"], abs=1e-5)
+            assert token["beam_token_prob"] == pytest.approx(
+                expected["beam_token_prob"], abs=1e-6
+            )
+            assert [x["token_id"] for x in token["beam_top_probs"]] == [
+                x["token_id"] for x in expected["beam_top_probs"]
+            ]
+            assert [x["beam_token_prob"] for x in token["beam_top_probs"]] == (
+                pytest.approx(
+                    [x["beam_token_prob"] for x in expected["beam_top_probs"]]
+                )
+            )
+
+
+def test_generation_metadata_checks_the_vocabulary_per_document(generation):
+    inputs, model_output = generation
+    batched = _generation_metadata(FakeTokenizer(), inputs, model_output)
+    per_item = _per_item_metadata(FakeTokenizer(), inputs.input_ids, model_output)
+
+    # 8 is in the second document only, 5 & 6 in the first only, padding (1) in none
+    assert [x["token_in_input"] for x in batched[0]] == [True, False, True, False]
+    assert [x["token_in_input"] for x in batched[1]] == [True, False, False, False]
+    # the per-item implementation checked the whole (padded) batch
+    assert [x["token_in_input"] for x in per_item[0]] == [True, True, True, False]
+    assert [x["token_in_input"] for x in per_item[1]] == [True, True, False, False]
+
+
+def test_generation_metadata_renormalizes_masked_scores(generation):
+    inputs, model_output = generation
+    # a logits processor masked token 4 at the last step, i.e. no_repeat_ngram_size
+    masked = model_output.scores[-1].clone()
+    masked[:, 4] = float("-inf")
+    model_output.scores = model_output.scores[:-1] + (masked,)
+
+    batched = _generation_metadata(FakeTokenizer(), inputs, model_output)
+    expected = masked[model_output.beam_indices[1, -1]].log_softmax(dim=-1).exp()
+    assert batched[1][-1]["beam_token_prob"] == pytest.approx(expected[3].item())
+    assert expected[3].item() > masked[model_output.beam_indices[1, -1], 3].exp().item()
@@ -0,0 +1,103 @@
+import pytest
+
+from sumtool import model_registry, storage
+
+
+@pytest.fixture(autouse=True)
+def storage_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_DIR", str(tmp_path))
+    yield tmp_path
+
+
+def test_get_frees_models_idle_for_longer_than_max_idle_seconds(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(model_registry.time, "monotonic", lambda: now[0])
+    registry = model_registry.ModelRegistry(max_idle_seconds=60)
+
+    first = registry.get("first", object)
+    registry.get("second", object)
+    now[0] = 30.0
+    assert registry.get("first", object) is first
+
+    now[0] = 100.0
+    # "second" was last used 100s ago, "first" 70s ago but is the requested model
+    assert registry.get("first", object) is first
+    assert registry.stats()["entries"] == 1
+    assert registry.stats()["evictions"] == 1
+
+
+def test_free_idle(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(model_registry.time, "monotonic", lambda: now[0])
+    registry = model_registry.ModelRegistry()
+    registry.get("model", object)
+
+    now[0] = 10.0
+    assert registry.free_idle(60) == 0
+    now[0] = 100.0
+    assert registry.free_idle(60) == 1
+    assert registry.stats()["entries"] == 0
+
+
+@pytest.fixture
+def bart_id(tmp_path):
+    transformers = pytest.importorskip("transformers")
+    config = transformers.BartConfig(
+        vocab_size=100,
+        d_model=16,
+        encoder_layers=1,
+        decoder_layers=1,
+        encoder_attention_heads=2,
+        decoder_attention_heads=2,
+        encoder_ffn_dim=32,
+        decoder_ffn_dim=32,
+    )
+    model_id = str(tmp_path / "bart")
+    transformers.BartForConditionalGeneration(config).save_pretrained(model_id)
+    return model_id
+
+
+def test_load_model_from_safetensors(bart_id):
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    pytest.importorskip("safetensors")
+    model_id = bart_id
+    input_ids = torch.tensor([[0, 5, 6, 7, 2]])
+
+    model_class = transformers.BartForConditionalGeneration
+    pretrained = model_registry.load_model(model_class, model_id)
+    assert model_registry.safetensors_path(model_class, model_id).endswith(
+        "-bartforconditionalgeneration.safetensors"
+    )
+    from_safetensors = model_registry.load_model(model_class, model_id)
+
+    assert torch.equal(
+        pretrained(input_ids=input_ids).logits,
+        from_safetensors(input_ids=input_ids).logits,
+    )
+    # loading strictly needs the lm head & shared embeddings tied
+    assert (
+        from_safetensors.lm_head.weight.data_ptr()
+        == from_safetensors.model.shared.weight.data_ptr()
+    )
+
+
+@pytest.mark.parametrize(
+    "model_class",
+    ["BartForConditionalGeneration", "AutoModelForSequenceClassification"],
+)
+def test_load_quantized_model_from_cache(bart_id, model_class):
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    from sumtool.quantization import load_quantized_model
+
+    model_class = getattr(transformers, model_class)
+    input_ids = torch.tensor([[0, 5, 6, 7, 2]])
+    # the other class's cache of the same checkpoint must not be picked up
+    load_quantized_model(transformers.BartModel, bart_id)
+    quantized = load_quantized_model(model_class, bart_id)
+    from_cache = load_quantized_model(model_class, bart_id)
+
+    assert torch.equal(
+        quantized(input_ids=input_ids).logits, from_cache(input_ids=input_ids).logits
+    )
@@ -0,0 +1,196 @@
+import multiprocessing
+
+import pytest
+
+from sumtool import storage
+from sumtool.storage import (
+    cli,
+    columnar,
+    compression,
+    read_cache,
+    reader,
+    summary_log,
+    token_metadata,
+)
+from sumtool.storage.summary_log import SummaryLog
+
+
+@pytest.fixture(autouse=True)
+def storage_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_DIR", str(tmp_path))
+    read_cache.clear()
+    yield tmp_path
+    read_cache.clear()
+
+
+@pytest.mark.parametrize("first_backend", ["json", "log", "sharded"])
+def test_sqlite_write_carries_over_stored_summaries(monkeypatch, first_backend):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", first_backend)
+    storage.store_model_summaries(
+        "xsum", "org/model", {}, {str(i): f"summary {i}" for i in range(500)}
+    )
+
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "sqlite")
+    storage.store_model_summaries(
+        "xsum", "org/model", {}, {"0": "updated", "new": "new summary"}
+    )
+
+    summaries = storage.get_summaries("xsum", "org/model")
+    assert len(summaries) == 501
+    assert summaries["0"]["summary"] == "updated"
+    assert summaries["499"]["summary"] == "summary 499"
+    assert len(storage.get_summary_ids("xsum", "org/model")) == 501
+    assert storage.get_summary("xsum", "org/model", "1")["summary"] == "summary 1"
+
+
+def test_sqlite_write_carries_over_stored_metrics(monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "json")
+    storage.store_summary_metrics(
+        "xsum", "model", {str(i): {"rouge": i, "bleu": i} for i in range(500)}
+    )
+
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "sqlite")
+    storage.store_summary_metrics("xsum", "model", {"0": {"rouge": -1}})
+
+    metrics = storage.get_summary_metrics("xsum", "model")
+    assert len(metrics) == 500
+    assert metrics["0"] == {"rouge": -1, "bleu": 0}
+    assert metrics["499"] == {"rouge": 499, "bleu": 499}
+    assert len(dict(storage.iter_summary_metrics("xsum", "model"))) == 500
+
+
+def test_sqlite_writes_keep_cached_summaries_of_other_models(monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "json")
+    storage.store_model_summaries("xsum", "json-model", {}, {"0": "summary"})
+    cached = storage.get_summaries("xsum", "json-model")
+
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "sqlite")
+    storage.store_model_summaries("xsum", "sqlite-model", {}, {"0": "summary"})
+    assert storage.get_summaries("xsum", "json-model") is cached
+
+    # the first sqlite write of a cached model invalidates its entry
+    storage.store_model_summaries("xsum", "json-model", {}, {"1": "summary"})
+    assert len(storage.get_summaries("xsum", "json-model")) == 2
+
+
+def _append_records(path, worker):
+    summary_log = SummaryLog(path)
+    for i in range(500):
+        # rewrites make stale records, so appends keep triggering compaction
+        summary_log.append({f"{worker}-{i % 5}": {"summary": i}})
+
+
+def test_summary_log_compaction_keeps_concurrent_appends(storage_dir, monkeypatch):
+    monkeypatch.setattr(summary_log, "COMPACTION_MIN_STALE_RECORDS", 10)
+    path = f"{storage_dir}/xsum/model-summaries.jsonl"
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=_append_records, args=(path, worker))
+        for worker in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # a record appended during another process' compaction must not be lost
+    records = dict(SummaryLog(path).items())
+    assert records == {
+        f"{worker}-{i}": {"summary": 495 + i} for worker in range(4) for i in range(5)
+    }
+
+
+def test_columnar_sqlite_models_go_stale_on_their_own_writes(monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "sqlite")
+    for model in ["model-a", "model-b"]:
+        storage.store_model_summaries("xsum", model, {}, {"0": "summary"})
+    columnar.refresh(["xsum"])
+    assert not columnar.is_stale("xsum", "model-a")
+
+    storage.store_model_summaries("xsum", "model-b", {}, {"1": "summary"})
+    assert not columnar.is_stale("xsum", "model-a")
+    assert columnar.is_stale("xsum", "model-b")
+
+
+def test_columnar_query_reads_conflicting_column_types_as_strings(monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "json")
+    storage.store_summary_metrics("xsum", "model-a", {"0": {"label": 1.5}})
+    storage.store_summary_metrics("xsum", "model-b", {"0": {"label": "entailed"}})
+    for model in ["model-a", "model-b"]:
+        storage.store_model_summaries("xsum", model, {}, {"0": "summary"})
+
+    metrics = columnar.query("metrics", ["model", "label"]).to_pydict()
+    assert sorted(zip(metrics["model"], metrics["label"])) == [
+        ("model-a", "1.5"),
+        ("model-b", "entailed"),
+    ]
+
+
+def test_get_summary_reads_fields_nested_below_the_index(monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "json")
+    metadata = {"tm": {"path": "/data/tm", "steps": {"n": 3}}, "score": 0.5}
+    storage.store_model_summaries(
+        "xsum", "model", {}, {"0": "summary"}, {"0": metadata}
+    )
+    assert reader.MAX_FIELD_DEPTH == 2
+
+    summary = storage.get_summary(
+        "xsum",
+        "model",
+        "0",
+        fields=["metadata.score", "metadata.tm.path", "metadata.tm.steps.n"],
+    )
+    assert summary == {
+        "metadata": {"score": 0.5, "tm": {"path": "/data/tm", "steps": {"n": 3}}}
+    }
+    assert storage.get_summary("xsum", "model", "0", ["metadata.tm.missing"]) == {}
+
+
+def _token_metadata(token):
+    return [{"token_id": 1, "token": token, "entropy": 0.5, "beam_token_prob": 0.9}]
+
+
+@pytest.mark.parametrize("backend", ["json", "log", "sqlite"])
+def test_compact_drops_superseded_token_metadata(monkeypatch, backend):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", backend)
+    for token in ["old", "new"]:
+        references = token_metadata.append_token_metadata(
+            "xsum", "model", {"0": _token_metadata(token), "1": _token_metadata("b")}
+        )
+        storage.store_model_summaries(
+            "xsum",
+            "model",
+            {},
+            {"0": "summary 0", "1": "summary 1"},
+            {id: {"token_metadata": reference} for id, reference in references.items()},
+        )
+
+    before, after = token_metadata.compact_token_metadata("xsum", "model")
+    assert after == before // 2
+    assert storage.get_token_metadata("xsum", "model", "0").tokens == ["new"]
+    assert storage.get_token_metadata("xsum", "model", "1").tokens == ["b"]
+    assert storage.get_summary("xsum", "model", "0")["summary"] == "summary 0"
+
+    # records a job has appended but not stored yet are kept
+    token_metadata.append_token_metadata("xsum", "model", {"0": _token_metadata("x")})
+    assert token_metadata.compact_token_metadata("xsum", "model") is None
+
+
+@pytest.mark.parametrize("backend", ["json", "log"])
+def test_count_records_of_compressed_files(monkeypatch, backend):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", backend)
+    for batch in range(3):
+        storage.store_model_summaries(
+            "xsum", "model", {}, {str(i): f"summary {batch}" for i in range(100)}
+        )
+    cli.compress("xsum", "model")
+
+    path = storage.summaries_path("xsum", "model")
+    assert path.endswith(compression.COMPRESSED_SUFFIX)
+    assert cli.count_records(path) == 100
+
+
+def test_verify_checks_the_sqlite_database(monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "sqlite")
+    storage.store_model_summaries("xsum", "model", {}, {"0": "summary"})
+    assert cli.verify_database() == []